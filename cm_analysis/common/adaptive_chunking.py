@@ -0,0 +1,102 @@
+import time
+import logging
+
+import numpy as np
+
+from common import logit_store
+
+
+def frame_energy(audio, sampling_rate, frame_s=0.02):
+    """
+    Energy of each frame in dB relative to the loudest frame.
+    """
+    frame = max(int(frame_s*sampling_rate), 1)
+    n_frames = len(audio) // frame
+    frames = np.asarray(audio[:n_frames*frame], dtype=np.float64).reshape(n_frames, frame)
+    rms = np.sqrt(np.mean(np.square(frames), axis=1))
+    db = 20*np.log10(rms + 1e-10)
+    return db - db.max() if n_frames > 0 else db, frame
+
+
+def adaptive_windows(audio, sampling_rate, chunk_length_s=10, min_chunk_s=None, max_chunk_s=None,
+                     silence_db=-35.0, silence_stride_s=0.1, speech_stride_s=1.0, frame_s=0.02, align_to=1):
+    """
+    Windows of a long segment as (start, end, left, right) samples, in the
+    format of logit_store.fixed_windows.
+
+    Each cut is placed at the quietest frame between min_chunk_s and
+    max_chunk_s after the previous one (closer to chunk_length_s on ties).
+    A cut in silence (below silence_db) only needs a small context stride
+    on each side, while a cut in speech keeps speech_stride_s of context.
+    Cuts and strides are multiples of align_to (the inputs_to_logits_ratio of
+    the model), so the kept logit frames of consecutive windows are contiguous.
+    """
+    min_chunk_s = chunk_length_s*0.5 if min_chunk_s is None else min_chunk_s
+    max_chunk_s = chunk_length_s*1.5 if max_chunk_s is None else max_chunk_s
+    n_samples = len(audio)
+    if n_samples <= max_chunk_s*sampling_rate:
+        return [(0, n_samples, 0, 0)]
+
+    db, frame = frame_energy(audio, sampling_rate, frame_s)
+    # Smoothed over 100 ms so a short gap inside a word is not taken as silence
+    width = max(int(round(0.1/frame_s)), 1)
+    smooth_db = np.convolve(db, np.ones(width)/width, mode='same')
+
+    cuts = [(0, True)]
+    position = 0
+    while n_samples - position > max_chunk_s*sampling_rate:
+        lo = (position + int(min_chunk_s*sampling_rate)) // frame
+        hi = min((position + int(max_chunk_s*sampling_rate)) // frame, len(smooth_db))
+        target = (position + int(chunk_length_s*sampling_rate)) // frame
+        candidates = np.arange(lo, hi)
+        # 1 dB per second away from the target length
+        cost = smooth_db[lo:hi] + np.abs(candidates - target)*frame/sampling_rate
+        best = int(candidates[np.argmin(cost)])
+        position = max(int(round((best*frame + frame//2)/align_to))*align_to, position + align_to)
+        cuts.append((position, bool(smooth_db[best] <= silence_db)))
+    cuts.append((n_samples, True))
+
+    def stride(is_silence, limit):
+        length = int(round((silence_stride_s if is_silence else speech_stride_s)*sampling_rate/align_to))*align_to
+        return min(length, limit // align_to*align_to)
+
+    windows = []
+    for (start, start_silence), (end, end_silence) in zip(cuts[:-1], cuts[1:]):
+        left = 0 if start == 0 else stride(start_silence, start)
+        right = 0 if end == n_samples else stride(end_silence, n_samples - end)
+        windows.append((start - left, end + right, left, right))
+    logging.debug(f"{len(windows)} adaptive chunks, {sum(not s for _, s in cuts)} cuts in speech")
+    return windows
+
+
+def processed_ratio(windows, n_samples):
+    """
+    Audio given to the model (chunks with their strides) over the segment
+    length.
+    """
+    return sum(end - start for start, end, _, _ in windows) / max(n_samples, 1)
+
+
+def efficient_chunk_length(asr, candidates=(5, 10, 15, 20, 30), repeats=2):
+    """
+    Chunk length (in seconds) with the smallest inference time per second
+    of audio for the model and device of a pipeline, measured on noise
+    (--chunk-length auto). It takes about a minute on CPU.
+    """
+    sampling_rate = asr.feature_extractor.sampling_rate
+    rng = np.random.default_rng(0)
+    # Warm-up (CUDA kernels, allocations)
+    logit_store.compute_logits(asr, rng.uniform(-0.1, 0.1, sampling_rate).astype(np.float32))
+    costs = {}
+    for length in candidates:
+        audio = rng.uniform(-0.1, 0.1, int(length*sampling_rate)).astype(np.float32)
+        elapsed = []
+        for _ in range(repeats):
+            start = time.perf_counter()
+            logit_store.compute_logits(asr, audio)
+            elapsed.append(time.perf_counter() - start)
+        costs[length] = min(elapsed)/length
+        logging.info(f"Chunks of {length}s: {costs[length]:.4f}s of inference per second of audio")
+    best = min(costs, key=costs.get)
+    logging.info(f"Using adaptive chunks of about {best}s")
+    return best
@@ -0,0 +1,156 @@
+import os
+import re
+import glob
+import logging
+
+import numpy as np
+import pandas as pd
+from tabulate import tabulate
+
+
+METRICS = ["wer", "mer", "wil", "cer"]
+DURATION_BUCKETS = [0, 2, 5, 10, 20, np.inf]
+
+
+def get_genre(sample):
+    """
+    Inquiry genre from the NURC/SP name (SP_D2_062 -> D2).
+    """
+    match = re.search(r"_(D2|DID|EF)_", sample)
+    return match.group(1) if match is not None else "OTHER"
+
+
+def bucket_labels(buckets):
+    return [f"{a:g}-{b:g}s" if np.isfinite(b) else f">={a:g}s" for a, b in zip(buckets[:-1], buckets[1:])]
+
+
+class _Accumulator:
+    """
+    Running sums of one group. Only sums are kept, so the memory does not
+    depend on the number of sentences.
+
+    The weighted averages use the reference length (words for WER/MER/WIL,
+    characters for CER), which makes the weighted WER and CER equal to the
+    ones computed over all the sentences of the group at once.
+    """
+
+    def __init__(self):
+        self.sentences = 0
+        self.duration = 0.0
+        self.sums = dict.fromkeys(METRICS, 0.0)
+        self.counts = dict.fromkeys(METRICS, 0)
+        self.weighted_sums = dict.fromkeys(METRICS, 0.0)
+        self.weights = dict.fromkeys(METRICS, 0.0)
+
+    def update(self, chunk):
+        self.sentences += len(chunk)
+        self.duration += float(chunk["duration"].sum())
+        for metric in METRICS:
+            if metric not in chunk:
+                continue
+            valid = chunk[metric] >= 0  # -1 == not calculated
+            values = chunk.loc[valid, metric]
+            weights = chunk.loc[valid, "n_chars" if metric == "cer" else "n_words"]
+            self.sums[metric] += float(values.sum())
+            self.counts[metric] += int(valid.sum())
+            self.weighted_sums[metric] += float((values*weights).sum())
+            self.weights[metric] += float(weights.sum())
+
+    def row(self):
+        row = {"SENTENCES": self.sentences, "DURATION": self.duration}
+        for metric in METRICS:
+            if self.counts[metric] == 0:
+                continue
+            row[f"AVG {metric.upper()}"] = self.sums[metric]/self.counts[metric]
+            row[f"WAVG {metric.upper()}"] = self.weighted_sums[metric]/self.weights[metric] \
+                if self.weights[metric] > 0 else np.nan
+        return row
+
+
+def read_results(results_file, ptbr, chunksize):
+    """
+    Lazily reads a per-inquiry results CSV, chunksize rows at a time.
+    """
+    columns = ["sentence", "duration"] + METRICS
+    return pd.read_csv(
+        results_file,
+        sep=';' if ptbr else ',',
+        decimal=',' if ptbr else '.',
+        usecols=lambda c: c in columns,
+        chunksize=chunksize
+    )
+
+
+def aggregate_results(results_files, ptbr=False, chunksize=10000, buckets=DURATION_BUCKETS):
+    """
+    Computes corpus, per-genre and per-duration-bucket metrics from the
+    per-inquiry results files ({sample}_results_{model}.csv).
+
+    Returns a DataFrame with one row per group.
+    """
+    labels = bucket_labels(buckets)
+    groups = {}
+
+    def accumulator(level, key):
+        if (level, key) not in groups:
+            groups[(level, key)] = _Accumulator()
+        return groups[(level, key)]
+
+    for results_file in results_files:
+        sample = os.path.basename(results_file).split("_results_")[0]
+        genre = get_genre(sample)
+        logging.info(f"Aggregating {results_file}")
+
+        for chunk in read_results(results_file, ptbr, chunksize):
+            sentences = chunk["sentence"].fillna("").astype(str)
+            chunk = chunk.assign(
+                n_words=sentences.str.split().str.len(),
+                n_chars=sentences.str.len()
+            )
+            accumulator("CORPUS", "ALL").update(chunk)
+            accumulator("GENRE", genre).update(chunk)
+            bucket = pd.cut(chunk["duration"], bins=buckets, labels=labels, right=False)
+            for label, bucket_chunk in chunk.groupby(bucket, observed=True):
+                accumulator("DURATION", label).update(bucket_chunk)
+
+    order = {"CORPUS": 0, "GENRE": 1, "DURATION": 2}
+    rows = []
+    for (level, key) in sorted(groups, key=lambda k: (order[k[0]], labels.index(k[1]) if k[0] == "DURATION" else k[1])):
+        rows.append({"LEVEL": level, "GROUP": key, **groups[(level, key)].row()})
+    return pd.DataFrame(rows)
+
+
+def export_aggregation(aggregation_pd, out_dir, ptbr=False, print_table=True):
+    aggregation_pd.to_csv(
+        os.path.join(out_dir, "aggregate.csv"),
+        sep=';' if ptbr else ',',
+        decimal=',' if ptbr else '.',
+        index=False
+    )
+    if print_table:
+        print(tabulate(aggregation_pd, headers='keys', tablefmt='psql', showindex=False))
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser("Agrega os resultados de um diretório de saída do test_asr.py "
+                                     "(corpus, gênero e faixas de duração) sem carregar todos os arquivos na memória.")
+    parser.add_argument("--out-dir", "-o",
+                        help="Diretório com os arquivos {amostra}_results_{modelo}.csv",
+                        required=True)
+    parser.add_argument("--chunksize",
+                        help="Número de linhas lidas por vez de cada arquivo",
+                        type=int,
+                        default=10000)
+    parser.add_argument("--no-tables",
+                        help="Não imprime a tabela de resultados no console",
+                        action="store_true")
+    parser.add_argument("--ptbr",
+                        help="Usa o separador de ponto-e-virgula (;) e o formato de número em PT-BR (XX,XX)",
+                        action="store_true")
+    args = parser.parse_args()
+
+    results_files = sorted(glob.glob(os.path.join(args.out_dir, "*_results_*.csv")))
+    aggregation_pd = aggregate_results(results_files, ptbr=args.ptbr, chunksize=args.chunksize)
+    export_aggregation(aggregation_pd, args.out_dir, ptbr=args.ptbr, print_table=not args.no_tables)
@@ -2,10 +2,36 @@ import numpy as np
 import librosa
 from pydub import AudioSegment
 
+TARGET_DBFS = -31.187887972911266
+
+
+def needs_gain_normalization(model_name):
+    return "gain-normalization" in model_name
+
+
+def load_audio(audio_path, sr):
+    audio, _ = librosa.load(audio_path, sr=sr)
+    return audio
+
+
+def normalize_gain(audio, target_dbfs=TARGET_DBFS):
+    """
+    Array version of the gain normalization below, so a segment decoded
+    once can be shared by models with and without normalization.
+    """
+    rms = np.sqrt(np.mean(np.square(audio, dtype=np.float64)))
+    if rms == 0:
+        return audio
+    gain = 10**((target_dbfs - 20*np.log10(rms))/20)
+    # Same 16-bit saturation as pydub's apply_gain
+    samples = np.clip(np.trunc(audio*32768.0*gain), -32768, 32767)
+    return (samples/32768.0).astype(np.float32, order='C')
+
+
 def get_preprocessing_function(model_name, sr):
-    if "gain-normalization" in model_name:
+    if needs_gain_normalization(model_name):
         # https://github.com/alefiury/SE-R-2022-SER-Track/blob/main/utils/utils.py
-        def pre_proc_audio(audio_path, sr=sr, target_dbfs=-31.187887972911266):
+        def pre_proc_audio(audio_path, sr=sr, target_dbfs=TARGET_DBFS):
             sound = AudioSegment.from_file(audio_path, format="wav")
             sound = sound.set_channels(1)
             change_in_dBFS = target_dbfs - sound.dBFS
@@ -20,7 +46,6 @@ def get_preprocessing_function(model_name, sr):
     else:
         # Skip preprocessing
         def pre_proc_audio(audio_path):
-            audio, _ = librosa.load(audio_path, sr=sr)
-            return audio
+            return load_audio(audio_path, sr)
 
-    return pre_proc_audio
\ No newline at end of file
+    return pre_proc_audio
@@ -0,0 +1,84 @@
+import os
+import logging
+
+import numpy as np
+
+
+def index_regions(sentences, tolerance=1e-6):
+    """
+    Groups the sentences of one inquiry into unique audio regions.
+
+    Sentences from different tiers (e.g. one tier per speaker in D2
+    inquiries) may cover identical or nested time ranges. Each region is
+    the outermost range of a group and lists the indexes of the sentences
+    it contains, so the audio is cut and transcribed only once.
+    """
+    starts = sentences.column("start_sec")
+    ends = sentences.column("end_sec")
+    order = np.lexsort((-ends, starts))
+
+    regions = []
+    for i in order.tolist():
+        start_sec = float(starts[i])
+        end_sec = float(ends[i])
+        if regions and start_sec >= regions[-1]["start_sec"] - tolerance \
+                and end_sec <= regions[-1]["end_sec"] + tolerance:
+            regions[-1]["sentences"].append(i)
+            continue
+        regions.append({
+            "start_sec": start_sec,
+            "end_sec": end_sec,
+            "duration": end_sec-start_sec,
+            "sentences": [i]
+        })
+
+    logging.debug(f"{len(sentences)} sentences grouped into {len(regions)} audio regions")
+    return regions
+
+
+def sentence_regions(sentences, tolerance=1e-6):
+    """
+    Maps each sentence index to its audio region.
+    """
+    mapping = {}
+    for region in index_regions(sentences, tolerance):
+        for i in region["sentences"]:
+            mapping[i] = region
+    return mapping
+
+
+def region_audio_path(audio_out_dir, sample, region):
+    return os.path.join(
+        audio_out_dir,
+        f"{sample}_{region['start_sec']}_{region['end_sec']}.wav"
+    )
+
+
+def is_same_range(region, start_sec, end_sec, tolerance=1e-6):
+    return abs(region["start_sec"] - start_sec) <= tolerance \
+        and abs(region["end_sec"] - end_sec) <= tolerance
+
+
+def slice_output(output, offset_start, offset_end, separator=" "):
+    """
+    Extracts the part of a region transcription that belongs to a nested
+    sentence.
+
+    Chunks are selected by the midpoint of their timestamps and shifted to
+    be relative to the start of the sentence.
+    """
+    chunks = []
+    for tp in output["chunks"]:
+        tp_start, tp_end = tp["timestamp"]
+        if tp_end is None:
+            tp_end = tp_start
+        if offset_start <= (tp_start+tp_end)/2 <= offset_end:
+            chunks.append({
+                "text": tp["text"],
+                "timestamp": (
+                    max(tp_start-offset_start, 0.0),
+                    min(tp_end, offset_end)-offset_start
+                )
+            })
+    text = separator.join(tp["text"] for tp in chunks)
+    return {"text": text.strip(), "chunks": chunks}
@@ -7,42 +7,87 @@ import librosa
 import soundfile as sf
 from tqdm import tqdm
 
+from common import audio_regions, manifest, segment_archive, resampling
+
 
 def segment_raw_audios(args, corpus_sentences):
     def process(audio_path):
         logging.info(f"Segmenting audio {audio_path}")
         sample = os.path.splitext(os.path.basename(audio_path))[0]
         full_audio_path = os.path.abspath(audio_path)
+
+        if args.dedup_overlaps:
+            # Sentences with identical or nested ranges share the same segment
+            segments = audio_regions.index_regions(corpus_sentences[sample])
+        else:
+            segments = corpus_sentences[sample]
+
+        if args.incremental:
+            # Segments transcribed in the last run are not needed again (with --chunk-length
+            # auto, the manifest only matches after it runs, so all are segmented)
+            cached = manifest.Manifest(args, args.chunk_length).load(sample)["outputs"]
+            segments = [r for r in segments if f"{sample}_{r['start_sec']}_{r['end_sec']}.wav" not in cached]
+            logging.info(f"{len(segments)} new segments in {sample}")
+            if len(segments) == 0:
+                return
+
+        archive = None
+        if args.segment_archive:
+            # Existing segments are found in the index of the archive (no file checks)
+            archive = segment_archive.SegmentArchiveWriter(
+                args.audio_out_dir, sample, int(args.sample_rate), overwrite=args.overwrite_audios_dir
+            )
+            segments = [r for r in segments
+                        if segment_archive.segment_key(sample, r["start_sec"], r["end_sec"]) not in archive]
+            logging.info(f"{len(segments)} segments of {sample} will be added to the archive")
+            if len(segments) == 0:
+                archive.close()
+                return
         
+        if archive is None and not args.overwrite_audios_dir:
+            existing = set()
+            for r in segments:
+                segment_name = f"{sample}_{r['start_sec']}_{r['end_sec']}.wav"
+                if os.path.isfile(os.path.join(args.audio_out_dir, segment_name)):
+                    logging.debug(f"The segmented audio {segment_name} exists. Skipping segmentation.")
+                    existing.add((r["start_sec"], r["end_sec"]))
+            segments = [r for r in segments if (r["start_sec"], r["end_sec"]) not in existing]
+
         if args.load_full_audio:
             # Carrega o áudio inteiro na memória antes (economiza tempo no for seguinte)
             logging.info(f"Loading audio {full_audio_path}")
             full_audio, _ = librosa.load(full_audio_path, sr=args.sample_rate)
+            segment_audios = ((r, full_audio[int(args.sample_rate*r["start_sec"]):int(args.sample_rate*r["end_sec"])])
+                              for r in segments)
+        elif args.resampling == "librosa":
+            segment_audios = ((r, librosa.load(full_audio_path,
+                                               sr=int(args.sample_rate),
+                                               offset=r["start_sec"],
+                                               duration=r["duration"])[0])
+                              for r in segments)
         else:
-            full_audio = None
+            # The file is read and resampled once and the segments are cut at their sample offsets
+            segments = list(segments)
+            segment_audios = ((segments[i], audio) for i, audio in resampling.stream_segments(
+                full_audio_path, int(args.sample_rate), [(r["start_sec"], r["end_sec"]) for r in segments], args.resampling
+            ))
 
-        for r in tqdm(corpus_sentences[sample]):
+        for r, audio in tqdm(segment_audios, total=len(segments)):
             start_sec = r["start_sec"]
             end_sec = r["end_sec"]
-            duration = r["duration"]
                                         
             sentence_audio_path = os.path.join(
                 args.audio_out_dir, 
                 f"{sample}_{start_sec}_{end_sec}.wav"
             )
 
-            if os.path.isfile(sentence_audio_path) and not args.overwrite_audios_dir:
-                logging.debug(f"The segmented audio {sentence_audio_path} exists. Skipping segmentation.")
-                continue
-
-            if full_audio is not None:
-                audio = full_audio[int(args.sample_rate*start_sec):int(args.sample_rate*end_sec)]
+            if archive is not None:
+                archive.add(os.path.basename(sentence_audio_path), start_sec, end_sec, audio)
             else:
-                audio, _ = librosa.load(full_audio_path,
-                                        sr=int(args.sample_rate), 
-                                        offset=start_sec, 
-                                        duration=duration)
-            sf.write(sentence_audio_path, audio, int(args.sample_rate))
+                sf.write(sentence_audio_path, audio, int(args.sample_rate))
+
+        if archive is not None:
+            archive.close()
         
 
     # with concurrent.futures.ProcessPoolExecutor() as executor:
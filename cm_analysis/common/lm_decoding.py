@@ -0,0 +1,196 @@
+import os
+import logging
+import multiprocessing
+
+import numpy as np
+
+
+def log_softmax(logits):
+    logits = logits - logits.max(axis=-1, keepdims=True)
+    return logits - np.log(np.exp(logits).sum(axis=-1, keepdims=True))
+
+
+def get_labels(tokenizer):
+    """
+    pyctcdecode labels in the order of the logits: the CTC blank (pad
+    token) is "" and the word delimiter is " ".
+    """
+    vocab = sorted(tokenizer.get_vocab().items(), key=lambda item: item[1])
+    labels = []
+    for token, _ in vocab:
+        if token == tokenizer.pad_token:
+            labels.append("")
+        elif token == tokenizer.word_delimiter_token:
+            labels.append(" ")
+        else:
+            labels.append(token)
+    return labels
+
+
+def model_decoder(model_name):
+    """
+    pyctcdecode decoder distributed with a model (Wav2Vec2ProcessorWithLM),
+    loaded as in the transformers pipeline, or None if the model has no
+    language model.
+    """
+    from transformers import AutoFeatureExtractor
+
+    feature_extractor = AutoFeatureExtractor.from_pretrained(model_name)
+    processor_class = getattr(feature_extractor, "_processor_class", None)
+    if processor_class is None or not processor_class.endswith("WithLM"):
+        return None
+    try:
+        import kenlm  # noqa: F401
+        from pyctcdecode import BeamSearchDecoderCTC
+    except ImportError:
+        logging.warning(f"{model_name} has a language model, but pyctcdecode or kenlm is not installed. "
+                        "The logits will be decoded without it.")
+        return None
+    logging.info(f"Loading the language model of {model_name}")
+    if os.path.isdir(model_name) or os.path.isfile(model_name):
+        return BeamSearchDecoderCTC.load_from_dir(model_name)
+    allow_regex = [
+        os.path.join(BeamSearchDecoderCTC._LANGUAGE_MODEL_SERIALIZED_DIRECTORY, "*"),
+        BeamSearchDecoderCTC._ALPHABET_SERIALIZED_FILENAME
+    ]
+    return BeamSearchDecoderCTC.load_from_hf_hub(model_name, allow_regex=allow_regex)
+
+
+class LMDecoder:
+    """
+    Beam search CTC decoder with a KenLM language model (ARPA or binary),
+    or with an already loaded pyctcdecode decoder (decoder, e.g. the one
+    of model_decoder).
+
+    The decoder and the language model are loaded once. The worker pool is
+    created after them (with fork), so the processes share the loaded LM
+    instead of loading it again.
+    """
+
+    def __init__(self, tokenizer, lm_path=None, alpha=0.5, beta=1.0, beam_width=100, unigrams_path=None,
+                 processes=None, decoder=None):
+        if decoder is None:
+            from pyctcdecode import build_ctcdecoder
+
+            unigrams = None
+            if unigrams_path is not None:
+                with open(unigrams_path, encoding='utf8') as fp:
+                    unigrams = [line.strip() for line in fp if line.strip() != '']
+
+            logging.info(f"Loading language model {lm_path}")
+            decoder = build_ctcdecoder(
+                get_labels(tokenizer),
+                kenlm_model_path=lm_path,
+                unigrams=unigrams,
+                alpha=alpha,
+                beta=beta
+            )
+        self.tokenizer = tokenizer
+        self.blank_id = tokenizer.pad_token_id
+        self.beam_width = beam_width
+        self.decoder = decoder
+        self.pool = None
+        if processes is None or processes > 1:
+            self.pool = multiprocessing.get_context("fork").Pool(processes)
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+
+    def decode_batch(self, logits_list, time_per_frame, char_timestamps=False):
+        """
+        Decodes a batch of segments (in parallel when there is a pool).
+        Returns a list of {"word": ..., "char": ...} outputs in the pipeline
+        format ({"text", "chunks"}).
+        """
+        log_probs_list = [log_softmax(logits) for logits in logits_list]
+        if self.pool is not None:
+            beams_list = self.decoder.decode_beams_batch(self.pool, log_probs_list, beam_width=self.beam_width)
+        else:
+            beams_list = [self.decoder.decode_beams(lp, beam_width=self.beam_width) for lp in log_probs_list]
+
+        outputs = []
+        for log_probs, beams in zip(log_probs_list, beams_list):
+            text, _, text_frames, _, _ = beams[0]
+            output = {
+                "word": {
+                    "text": text,
+                    "chunks": [{
+                        "text": word,
+                        "timestamp": (start*time_per_frame, end*time_per_frame)
+                    } for word, (start, end) in text_frames]
+                },
+                "char": None
+            }
+            if char_timestamps:
+                output["char"] = {
+                    "text": text,
+                    "chunks": self.char_chunks(log_probs, text_frames, time_per_frame)
+                }
+            outputs.append(output)
+        return outputs
+
+    def char_chunks(self, log_probs, text_frames, time_per_frame):
+        """
+        Char timestamps of the LM words, aligned inside the frames of each
+        word with CTC forced alignment.
+        """
+        chunks = []
+        for word, (start, end) in text_frames:
+            chars = list(word)
+            ids = self.tokenizer.convert_tokens_to_ids(chars)
+            spans = None
+            if self.tokenizer.unk_token_id not in ids:
+                spans = ctc_align(log_probs[start:end], ids, self.blank_id)
+            if spans is None:
+                # Splits the word frames evenly
+                bounds = np.linspace(start, end, len(chars)+1)
+                spans = [(b - start, e - start) for b, e in zip(bounds[:-1], bounds[1:])]
+            for char, (char_start, char_end) in zip(chars, spans):
+                chunks.append({
+                    "text": char,
+                    "timestamp": ((start+char_start)*time_per_frame, (start+char_end)*time_per_frame)
+                })
+        return chunks
+
+
+def ctc_align(log_probs, tokens, blank_id):
+    """
+    Viterbi CTC alignment of a token sequence. Returns the (start, end)
+    frames (end exclusive) of each token, or None if the sequence does not
+    fit in the frames.
+    """
+    T, L = len(log_probs), len(tokens)
+    if L == 0 or T == 0:
+        return None
+    ext = np.full(2*L+1, blank_id)
+    ext[1::2] = tokens
+    S = len(ext)
+    can_skip = np.zeros(S, dtype=bool)
+    can_skip[2:] = (ext[2:] != blank_id) & (ext[2:] != ext[:-2])
+
+    dp = np.full(S, -np.inf)
+    dp[0] = log_probs[0, ext[0]]
+    dp[1] = log_probs[0, ext[1]]
+    back = np.zeros((T, S), dtype=np.int8)
+    for t in range(1, T):
+        prev1 = np.concatenate(([-np.inf], dp[:-1]))
+        prev2 = np.where(can_skip, np.concatenate(([-np.inf, -np.inf], dp[:-2])), -np.inf)
+        candidates = np.stack([dp, prev1, prev2])
+        back[t] = np.argmax(candidates, axis=0)
+        dp = candidates.max(axis=0) + log_probs[t, ext]
+
+    state = S-1 if S == 1 or dp[S-1] >= dp[S-2] else S-2
+    if not np.isfinite(dp[state]):
+        return None
+    states = np.empty(T, dtype=np.int64)
+    for t in range(T-1, -1, -1):
+        states[t] = state
+        state -= back[t, state]
+
+    spans = []
+    for i in range(L):
+        frames = np.flatnonzero(states == 2*i+1)
+        spans.append((int(frames[0]), int(frames[-1])+1))
+    return spans
@@ -0,0 +1,220 @@
+import os
+import json
+import logging
+
+import numpy as np
+
+
+class LogitWriter:
+    """
+    Appends the CTC logits of the segments of one inquiry to a single
+    binary file ({sample}.{name}.logits), indexed by an offset table
+    ({sample}.{name}.json).
+
+    dtype "float16" stores all the logits. dtype "topk" stores only the k
+    largest logits of each frame (float16 values + int16 token ids), which
+    is enough for greedy decoding and for beam search with small beams.
+    """
+
+    def __init__(self, store_dir, sample, name, time_per_frame, dtype="float16", k=8):
+        self.index_path = os.path.join(store_dir, f"{sample}.{name}.json")
+        self.index = {
+            "dtype": dtype,
+            "k": k,
+            "vocab_size": None,
+            "time_per_frame": time_per_frame,
+            "segments": {}
+        }
+        self._fp = open(os.path.join(store_dir, f"{sample}.{name}.logits"), 'wb')
+        self._offset = 0
+
+    def add(self, key, logits, pad_sec=0.0):
+        logits = np.asarray(logits, dtype=np.float32)
+        self.index["vocab_size"] = int(logits.shape[1])
+        if self.index["dtype"] == "topk":
+            k = min(self.index["k"], logits.shape[1])
+            ids = np.argpartition(-logits, k-1, axis=1)[:, :k]
+            values = np.take_along_axis(logits, ids, axis=1)
+            data = values.astype(np.float16).tobytes() + ids.astype(np.int16).tobytes()
+        else:
+            data = logits.astype(np.float16).tobytes()
+        self._fp.write(data)
+        self.index["segments"][key] = {
+            "offset": self._offset,
+            "frames": int(logits.shape[0]),
+            "pad_sec": pad_sec
+        }
+        self._offset += len(data)
+
+    def close(self):
+        self._fp.close()
+        with open(self.index_path, 'w', encoding='utf8') as fp:
+            json.dump(self.index, fp)
+
+
+class LogitReader:
+    """
+    Memory-mapped access to the logits saved by LogitWriter.
+    """
+
+    def __init__(self, store_dir, sample, name):
+        with open(os.path.join(store_dir, f"{sample}.{name}.json"), encoding='utf8') as fp:
+            self.index = json.load(fp)
+        self.time_per_frame = self.index["time_per_frame"]
+        logits_path = os.path.join(store_dir, f"{sample}.{name}.logits")
+        # Inquiries without transcribed segments have an empty file (which cannot be mapped)
+        self._data = np.memmap(logits_path, dtype=np.uint8, mode='r') if os.path.getsize(logits_path) > 0 \
+            else np.empty(0, dtype=np.uint8)
+
+    def __contains__(self, key):
+        return key in self.index["segments"]
+
+    def get(self, key):
+        """
+        Returns the (frames, vocab_size) float32 logits of a segment and the
+        padding added before it (in seconds).
+        """
+        segment = self.index["segments"][key]
+        frames = segment["frames"]
+        vocab_size = self.index["vocab_size"]
+        offset = segment["offset"]
+
+        if self.index["dtype"] == "topk":
+            k = min(self.index["k"], vocab_size)
+            size = frames*k*2
+            values = self._data[offset:offset+size].view(np.float16).reshape(frames, k)
+            ids = self._data[offset+size:offset+2*size].view(np.int16).reshape(frames, k)
+            # The discarded logits are set below the smallest stored one
+            logits = np.full((frames, vocab_size), float(values.min()) - 100.0 if frames else 0.0, dtype=np.float32)
+            np.put_along_axis(logits, ids.astype(np.int64), values.astype(np.float32), axis=1)
+        else:
+            size = frames*vocab_size*2
+            logits = self._data[offset:offset+size].view(np.float16).reshape(frames, vocab_size).astype(np.float32)
+        return logits, segment["pad_sec"]
+
+
+def get_time_per_frame(config, sampling_rate):
+    return config.inputs_to_logits_ratio / sampling_rate
+
+
+def fixed_windows(n_samples, sampling_rate, chunk_length_s, stride_length_s, align_to=1):
+    """
+    Windows of the pipeline chunking as (start, end, left, right) samples:
+    the model runs on audio[start:end] and the logits of the left and right
+    strides are dropped. Like the pipeline, the lengths are rounded to
+    multiples of align_to (the inputs_to_logits_ratio of the model), so the
+    strides cover whole logit frames.
+    """
+    chunk_len = int(round(chunk_length_s*sampling_rate/align_to))*align_to
+    stride_left = int(round(stride_length_s[0]*sampling_rate/align_to))*align_to
+    stride_right = int(round(stride_length_s[1]*sampling_rate/align_to))*align_to
+    step = chunk_len - stride_left - stride_right
+    windows = []
+    for i in range(0, n_samples, step):
+        end = min(i+chunk_len, n_samples)
+        is_last = i + step + stride_left >= n_samples
+        if end - i > (0 if i == 0 else stride_left):
+            windows.append((i, end, 0 if i == 0 else stride_left, 0 if is_last else stride_right))
+        if is_last:
+            break
+    return windows
+
+
+def stride_frames(input_n, left, right, inputs_to_logits_ratio):
+    """
+    Logit frames [first, last) kept from a window of input_n samples with
+    left and right strides, rounded like the pipeline (rescale_stride).
+    """
+    token_n = int(round(input_n/inputs_to_logits_ratio))
+    left = int(round(left/input_n*token_n))
+    right = int(round(right/input_n*token_n))
+    return left, token_n - right
+
+
+def same_features(feature_extractor, other):
+    """
+    Whether two Wav2Vec2 feature extractors produce the same input values,
+    so one extraction can be shared by their models.
+    """
+    return all(getattr(feature_extractor, attr, None) == getattr(other, attr, None)
+               for attr in ("sampling_rate", "feature_size", "padding_value", "do_normalize"))
+
+
+def compute_logits(asr, audio, chunk_length_s=None, stride_length_s=None, windows=None, batch_size=1):
+    """
+    CTC logits of a segment, using the model and feature extractor of a
+    Hugging Face pipeline. With chunk_length_s, the audio is windowed like
+    the pipeline does and the logits of the strides are dropped. Other
+    windows (e.g. from adaptive_chunking) can be passed in `windows`.
+    """
+    return compute_logits_shared([asr], audio, chunk_length_s, stride_length_s, windows, batch_size)[0]
+
+
+def compute_logits_shared(models, audio, chunk_length_s=None, stride_length_s=None, windows=None, batch_size=1):
+    """
+    compute_logits for several pipelines (e.g. the ASR and the phone model)
+    on the same windows. The input values are extracted once, with the
+    feature extractor of the first model, and given to every model whose
+    feature extractor is equivalent. Windows with the same length are run
+    in batches of batch_size (no padding is needed). Returns one logits
+    array per model.
+    """
+    import torch
+
+    main = models[0]
+    sampling_rate = main.feature_extractor.sampling_rate
+    if windows is None:
+        if chunk_length_s is None:
+            windows = [(0, len(audio), 0, 0)]
+        else:
+            windows = fixed_windows(len(audio), sampling_rate, chunk_length_s, stride_length_s,
+                                    main.model.config.inputs_to_logits_ratio)
+    shared = [same_features(main.feature_extractor, model.feature_extractor) for model in models]
+
+    groups = {}
+    for i, (start, end, _, _) in enumerate(windows):
+        groups.setdefault(end - start, []).append(i)
+
+    logits = [[None]*len(windows) for _ in models]
+    for indexes in groups.values():
+        for b in range(0, len(indexes), batch_size):
+            batch = indexes[b:b+batch_size]
+            chunks = [audio[windows[i][0]:windows[i][1]] for i in batch]
+            shared_inputs = None
+            for m, model in enumerate(models):
+                if shared[m] and shared_inputs is not None:
+                    inputs = shared_inputs
+                else:
+                    inputs = model.feature_extractor(chunks, sampling_rate=sampling_rate, return_tensors="pt")
+                    if shared[m]:
+                        shared_inputs = inputs
+                model_inputs = {"input_values": inputs["input_values"].to(model.model.device)}
+                if "attention_mask" in inputs and getattr(model.feature_extractor, "return_attention_mask", False):
+                    model_inputs["attention_mask"] = inputs["attention_mask"].to(model.model.device)
+                with torch.no_grad():
+                    batch_logits = model.model(**model_inputs).logits.float().cpu().numpy()
+                for j, i in enumerate(batch):
+                    start, end, left, right = windows[i]
+                    first, last = stride_frames(end-start, left, right, model.model.config.inputs_to_logits_ratio)
+                    logits[m][i] = batch_logits[j, first:last]
+    return [np.concatenate(model_logits) for model_logits in logits]
+
+
+def decode_logits(tokenizer, logits, time_per_frame, return_timestamps="word"):
+    """
+    Greedy CTC decoding of stored logits. Returns the same structure as the
+    pipeline ({"text", "chunks"}), with word or char timestamps.
+    """
+    ids = np.argmax(logits, axis=-1).tolist()
+    if return_timestamps == "char":
+        output = tokenizer.decode(ids, skip_special_tokens=False, output_char_offsets=True)
+        offsets = output["char_offsets"]
+    else:
+        output = tokenizer.decode(ids, skip_special_tokens=False, output_word_offsets=True)
+        offsets = output["word_offsets"]
+    chunks = [{
+        "text": item[return_timestamps],
+        "timestamp": (item["start_offset"]*time_per_frame, item["end_offset"]*time_per_frame)
+    } for item in offsets]
+    logging.debug(f"Decoded {len(ids)} frames into {len(chunks)} {return_timestamps} chunks")
+    return {"text": output["text"], "chunks": chunks}
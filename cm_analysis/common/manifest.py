@@ -0,0 +1,131 @@
+import os
+import json
+import hashlib
+import logging
+
+import pandas as pd
+
+
+def _tuples(output):
+    # JSON turns the timestamp tuples of the pipeline into lists
+    if output is None:
+        return None
+    return {
+        "text": output["text"],
+        "chunks": [{"text": tp["text"], "timestamp": tuple(tp["timestamp"])} for tp in output["chunks"]]
+    }
+
+
+class Manifest:
+    """
+    Per-inquiry manifest used by --incremental ({out_dir}/manifest/{sample}.json).
+
+    It stores a hash of each interval (time range, raw mark and mark
+    preprocessing options), the metrics of each hash and the outputs of
+    each transcribed segment (keyed by the segment file, i.e. by the time
+    range). A later run with the same model options only segments and
+    transcribes the new time ranges and only scores the intervals whose
+    hash (or prediction) changed. Inquiries without changes are skipped and
+    their rows of the last summary.csv are reused.
+
+    chunk_length is the target length of the adaptive windows actually
+    used (--chunk-length or the one chosen by --chunk-length auto).
+    """
+
+    def __init__(self, args, chunk_length=None):
+        self.manifest_dir = os.path.join(args.out_dir, "manifest")
+        os.makedirs(self.manifest_dir, exist_ok=True)
+        # Options that change the text of the sentences
+        self.preprocessing = json.dumps({
+            "accept_all": args.accept_all,
+            "ignore_all": args.ignore_all,
+            "ignore_sentences_with": sorted(args.ignore_sentences_with)
+        }, sort_keys=True)
+        # Options that change the transcriptions or metrics: a different value invalidates everything
+        self.config = json.dumps({
+            "model": args.model,
+            "phone_model": args.phone_model,
+            "sample_rate": args.sample_rate,
+            "max_duration": args.max_duration,
+            "chunking": args.chunking,
+            "chunk_length": chunk_length if args.chunking == "adaptive" else None,
+            "generate_char_timestamps": args.generate_char_timestamps,
+            "dedup_overlaps": args.dedup_overlaps,
+            # Options that change the audio of the segments
+            "resampling": None if args.load_full_audio else args.resampling,
+            "load_full_audio": args.load_full_audio,
+            "segment_archive": args.segment_archive,
+            "lm": args.lm,
+            "lm_alpha": args.lm_alpha,
+            "lm_beta": args.lm_beta,
+            "lm_beam_width": args.lm_beam_width,
+            "lm_unigrams": args.lm_unigrams,
+            "metrics": sorted(args.metrics) if isinstance(args.metrics, list) else args.metrics,
+            "average_from_sentences": args.average_from_sentences
+        }, sort_keys=True)
+        self.out_dir = args.out_dir
+        self.ptbr = args.ptbr
+
+    def interval_hash(self, r):
+        key = f"{r['start_sec']!r}|{r['end_sec']!r}|{r['mark']}|{self.preprocessing}"
+        return hashlib.sha1(key.encode("utf8")).hexdigest()
+
+    def hashes(self, sentences):
+        return [self.interval_hash(r) for r in sentences]
+
+    def load(self, sample):
+        """
+        Previous manifest of an inquiry. Empty if it does not exist or if
+        it was created with other model options.
+        """
+        empty = {"hashes": [], "metrics": {}, "outputs": {}}
+        path = os.path.join(self.manifest_dir, f"{sample}.json")
+        if not os.path.isfile(path):
+            return empty
+        with open(path, encoding='utf8') as fp:
+            previous = json.load(fp)
+        if previous.get("config") != self.config:
+            logging.info(f"The options changed since the last run of {sample}. Reprocessing everything.")
+            return empty
+        previous["outputs"] = {
+            key: {
+                "word": _tuples(outputs["word"]),
+                "char": _tuples(outputs["char"]),
+                "phones": _tuples(outputs["phones"]),
+                "pad_sec": outputs["pad_sec"]
+            } for key, outputs in previous["outputs"].items()
+        }
+        return previous
+
+    def diff(self, previous, hashes):
+        """
+        Returns the number of new or changed intervals and of the removed
+        ones.
+        """
+        previous_hashes = set(previous["hashes"])
+        current_hashes = set(hashes)
+        return len(current_hashes - previous_hashes), len(previous_hashes - current_hashes)
+
+    def load_summary(self):
+        """
+        Rows of the summary.csv of the last run by inquiry, reused for the
+        inquiries without changes.
+        """
+        path = os.path.join(self.out_dir, "summary.csv")
+        if not os.path.isfile(path):
+            return {}
+        summary_pd = pd.read_csv(path, sep=';' if self.ptbr else ',', decimal=',' if self.ptbr else '.')
+        # The last row (AVG) has no sample
+        summary_pd = summary_pd[summary_pd["SAMPLE"].notna()]
+        return {row["SAMPLE"]: row for row in summary_pd.to_dict("records")}
+
+    def save(self, sample, hashes, metrics, outputs):
+        path = os.path.join(self.manifest_dir, f"{sample}.json")
+        with open(path + ".tmp", 'w', encoding='utf8') as fp:
+            json.dump({
+                "config": self.config,
+                "hashes": hashes,
+                "metrics": metrics,
+                "outputs": outputs
+            }, fp, ensure_ascii=False)
+        os.replace(path + ".tmp", path)
@@ -0,0 +1,92 @@
+import os
+import json
+import logging
+
+from common.mark_preprocessing import MarkPreprocessing
+from common.tables import ColumnTable, MARK_SCHEMA
+
+# Incremented when the classification (flags or normalization) changes
+VERSION = 1
+
+
+class MarkCache:
+    """
+    Classification of every interval of the TextGrids (MarkPreprocessing.classify),
+    computed once per corpus. The tables are kept in a JSON file (path) keyed by
+    the TextGrid path and reused while the file is not modified, so each
+    configuration of sentences is only a mask over the flags.
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self.textgrids = {}
+        self._modified = False
+        self._preprocessing = MarkPreprocessing()
+        # The same marks repeat a lot (ex: empty intervals, "((risos))")
+        self._classified = {}
+        if path is not None and os.path.isfile(path):
+            with open(path, encoding='utf8') as fp:
+                cache = json.load(fp)
+            if cache.get("version") == VERSION:
+                self.textgrids = cache["textgrids"]
+            else:
+                logging.info(f"The marks cache {path} is from another version. It will be recomputed.")
+
+    def classify(self, mark):
+        if mark not in self._classified:
+            self._classified[mark] = self._preprocessing.classify(mark)
+        return self._classified[mark]
+
+    def marks(self, tf, tg):
+        """
+        Marks table of the TextGrid file tf (already read in tg).
+        """
+        key = os.path.abspath(tf)
+        stat = os.stat(tf)
+        entry = self.textgrids.get(key)
+        if entry is not None and entry["mtime_ns"] == stat.st_mtime_ns and entry["size"] == stat.st_size:
+            logging.debug(f"Using the cached marks of {tf}")
+            table = ColumnTable(MARK_SCHEMA)
+            table.extend(**entry["columns"])
+            return table
+
+        table = ColumnTable(MARK_SCHEMA)
+        for i, tier in enumerate(tg):
+            for it in tier:
+                flags, text, text_incomprehensible = self.classify(it.mark)
+                table.append(
+                    tier=i,
+                    start_sec=it.minTime,
+                    end_sec=it.maxTime,
+                    mark=it.mark,
+                    flags=flags,
+                    text=text,
+                    text_incomprehensible=text_incomprehensible
+                )
+        self.textgrids[key] = {
+            "mtime_ns": stat.st_mtime_ns,
+            "size": stat.st_size,
+            "columns": {name: table.column(name).tolist() for name in MARK_SCHEMA}
+        }
+        self._modified = True
+        return table
+
+    def save(self):
+        if self.path is None or not self._modified:
+            return
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        with open(self.path + ".tmp", 'w', encoding='utf8') as fp:
+            json.dump({"version": VERSION, "textgrids": self.textgrids}, fp, ensure_ascii=False)
+        os.replace(self.path + ".tmp", self.path)
+        self._modified = False
+        logging.info(f"Marks cache saved in {self.path}")
+
+
+def accepted_mask(marks, pre_process_nurcsp):
+    """
+    Boolean mask of the marks accepted by a MarkPreprocessing configuration
+    and the text of each mark in it.
+    """
+    flags = marks.column("flags").astype('int64')
+    texts = marks.column("text" if pre_process_nurcsp.remove_incomprehensible_parts else "text_incomprehensible")
+    return ((flags & pre_process_nurcsp.ignore_mask) == 0) & (texts != ''), texts
@@ -179,52 +179,73 @@ class MarkPreprocessing:
         return False    
 
 
-    def __call__(self, mark):
+    # Bit flags of the marks (see classify)
+    INCOMPREHENSIBLE = 1
+    HYPOTHESIS = 2
+    OVERLAP = 4
+    ANNOTATION = 8
+    ABBREVIATION = 16
+
+    flag_names = {
+        INCOMPREHENSIBLE: "Incomprehensible snippets",
+        HYPOTHESIS: "Excerpts with hypotheses",
+        OVERLAP: "Overlapping snippets",
+        ANNOTATION: "Annotated snippets",
+        ABBREVIATION: "Abbreviation"
+    }
+
+    @property
+    def ignore_mask(self):
         """
-        Marking pre-processing function.
-
-        Returns preprocessed or null (skipped) text based on the
-        object settings.
-
-        None == Ignored
+        Flags of the marks ignored by this configuration.
         """
-        logging.debug(f"Processando marcação \"{mark}\"")
-        mark = mark.replace('Doc.', '')
-        mark = mark.replace('L1', '')
-        mark = mark.replace('L2', '')
-        mark = mark.replace('Inf', '')
-
+        mask = 0
         if self._ignore_incomprehensible_sentences:
-            # Ignora trechos com (frase incompreensível)
-            if '( )' in mark:
-                logging.debug(f"\tIncomprehensible snippets detected. Ignoring \"{mark}\"")
-                return None
-
+            mask |= MarkPreprocessing.INCOMPREHENSIBLE
         if self._ignore_hypothesis_sentences:
-            # Ignora trechos com (frase incompreensível)
-            if re.search('\(.*\)', mark):
-                logging.debug(f"\tExcerpts with detected hypotheses. Ignoring \"{mark}\"")
-                return None
-
+            mask |= MarkPreprocessing.HYPOTHESIS
         if self._ignore_overlap_sentences:
-            # Ignora trechos com [fala com sobreposição...
-            if '[' in mark or ']' in mark:
-                logging.debug(f"\tOverlapping snippets detected. Ignoring \"{mark}\"")
-                return None
-
+            mask |= MarkPreprocessing.OVERLAP
         if self._ignore_sentences_with_annotation_parts:
-            # Ignora trechos com ((anotação))
-            if re.search('\(\(.*\)\)', mark):
-                logging.debug(f"\tAnnotated snippets detected. Ignoring \"{mark}\"")
-                return None
-        
+            mask |= MarkPreprocessing.ANNOTATION
         if self._ignore_abreviations:
-            # Ignora abreviações
-            if MarkPreprocessing.detect_abreviations(mark):
-                logging.debug(f"\tAbbreviation detected. Ignoring \"{mark}\"")
-                return None
+            mask |= MarkPreprocessing.ABBREVIATION
+        return mask
+
+    @property
+    def remove_incomprehensible_parts(self):
+        return self._remove_incomprehensible_parts
 
-        if self._remove_incomprehensible_parts:
+    def clean_mark(mark):
+        mark = mark.replace('Doc.', '')
+        mark = mark.replace('L1', '')
+        mark = mark.replace('L2', '')
+        mark = mark.replace('Inf', '')
+        return mark
+
+    def detect_flags(mark):
+        flags = 0
+        # Trechos com (frase incompreensível)
+        if '( )' in mark:
+            flags |= MarkPreprocessing.INCOMPREHENSIBLE
+        # Trechos com (hipótese)
+        if re.search('\(.*\)', mark):
+            flags |= MarkPreprocessing.HYPOTHESIS
+        # Trechos com [fala com sobreposição...
+        if '[' in mark or ']' in mark:
+            flags |= MarkPreprocessing.OVERLAP
+        # Trechos com ((anotação))
+        if re.search('\(\(.*\)\)', mark):
+            flags |= MarkPreprocessing.ANNOTATION
+        if MarkPreprocessing.detect_abreviations(mark):
+            flags |= MarkPreprocessing.ABBREVIATION
+        return flags
+
+    def is_empty(text):
+        return text == '###' or text == ' ' or text == ''
+
+    def _clean_text(self, mark, remove_incomprehensible_parts):
+        if remove_incomprehensible_parts:
             # Remove tudo entre (( ))
             text = re.sub('\(.*\)', '', mark)
             logging.debug(f"\tRemoval of incomprehensible parts: \"{text}\"")
@@ -245,12 +266,58 @@ class MarkPreprocessing:
             logging.debug(f"\tRemoving extra spaces: \"{text}\"")
 
         logging.debug(f"\tPre-processed text: \"{text}\"")
+        return text
 
+    def _normalize(self, text):
         if self._normalize_text:
             text = MarkPreprocessing.normalize(text)
             logging.debug(f"\tNormalized text: \"{text}\"")
+        return text
+
+    def classify(self, mark):
+        """
+        Classifies a mark in a single pass, independently of the ignore
+        options.
+
+        Returns its flags and its texts with and without the removal of the
+        incomprehensible parts ("" when the text is empty). A configuration
+        accepts the mark if `flags & ignore_mask == 0` and its text is not
+        empty.
+        """
+        mark = MarkPreprocessing.clean_mark(mark)
+        flags = MarkPreprocessing.detect_flags(mark)
+        removed = self._clean_text(mark, True)
+        kept = self._clean_text(mark, False)
+        text = self._normalize(removed)
+        text_incomprehensible = text if kept == removed else self._normalize(kept)
+        return (
+            flags,
+            '' if MarkPreprocessing.is_empty(text) else text,
+            '' if MarkPreprocessing.is_empty(text_incomprehensible) else text_incomprehensible
+        )
+
+    def __call__(self, mark):
+        """
+        Marking pre-processing function.
+
+        Returns preprocessed or null (skipped) text based on the
+        object settings.
+
+        None == Ignored
+        """
+        logging.debug(f"Processando marcação \"{mark}\"")
+        mark = MarkPreprocessing.clean_mark(mark)
+
+        ignored = MarkPreprocessing.detect_flags(mark) & self.ignore_mask
+        if ignored:
+            for flag, name in MarkPreprocessing.flag_names.items():
+                if ignored & flag:
+                    logging.debug(f"\t{name} detected. Ignoring \"{mark}\"")
+                    return None
+
+        text = self._normalize(self._clean_text(mark, self._remove_incomprehensible_parts))
 
-        if text == '###' or text == ' ' or text == '':  # Vazio
+        if MarkPreprocessing.is_empty(text):  # Vazio
             if self._ignore_empty_sentences:
                 logging.debug(f"\tEmpty text detected: \"{text}\"")
                 return None
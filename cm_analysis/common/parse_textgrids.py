@@ -4,10 +4,11 @@ import logging
 import json
 
 import textgrid
-import pandas as pd
 from tabulate import tabulate
  
 from common.mark_preprocessing import MarkPreprocessing
+from common.mark_flags import MarkCache, accepted_mask
+from common.tables import ColumnTable, SENTENCE_SCHEMA, SKIPPED_SENTENCE_SCHEMA
 
 
 def parse_textgrids(args, save_textgrids=False):
@@ -29,53 +30,53 @@ def parse_textgrids(args, save_textgrids=False):
     sentences = {}
     skipped_sentences = {}
     new_textgrids = {}
+    marks_cache = MarkCache(args.marks_cache)
 
     for tf in args.textgrids:
         sample = os.path.splitext(os.path.basename(tf))[0]
 
         logging.debug(f"Reading TextGrid file: {tf}")
 
-        tg = textgrid.TextGrid.fromFile(tf)
         new_tg = textgrid.TextGrid.fromFile(tf)
-        
-        sentences[sample] = []
-        skipped_sentences[sample] = []
-
-        for tier in tg:
+        tiers = list(new_tg.tiers)
+
+        # Flags and texts of all intervals, the configuration is only a mask
+        marks = marks_cache.marks(tf, new_tg)
+        accepted, texts = accepted_mask(marks, pre_process_nurcsp)
+        start_sec = marks.column("start_sec")
+        end_sec = marks.column("end_sec")
+        duration = end_sec - start_sec
+        mark = marks.column("mark")
+
+        sentences[sample] = ColumnTable(SENTENCE_SCHEMA)
+        sentences[sample].extend(
+            start_sec=start_sec[accepted],
+            end_sec=end_sec[accepted],
+            mark=mark[accepted],
+            text=texts[accepted],
+            duration=duration[accepted]
+        )
+        skipped_sentences[sample] = ColumnTable(SKIPPED_SENTENCE_SCHEMA)
+        skipped_sentences[sample].extend(
+            start_sec=start_sec[~accepted],
+            end_sec=end_sec[~accepted],
+            mark=mark[~accepted],
+            duration=duration[~accepted]
+        )
 
+        tier_ids = marks.column("tier").astype('int64')
+        for i, tier in enumerate(tiers):
+            if "NTB" in tier.name:
+                continue
             new_tier = textgrid.IntervalTier(
                 name="N-"+tier.name,
                 minTime=tier.minTime,
                 maxTime=tier.maxTime
             )
-            
-            for it in tier:
-                start_sec = it.minTime
-                end_sec = it.maxTime
-                mark = it.mark
-                text = pre_process_nurcsp(mark)
-
-                if text is not None:
-                    sentences[sample].append({
-                        "start_sec": start_sec,
-                        "end_sec": end_sec,
-                        "mark": mark,
-                        "text": text,
-                        "duration": end_sec-start_sec
-                    })
-                else:  # Ignorado
-                    text = ""
-                    skipped_sentences[sample].append({
-                        "start_sec": start_sec,
-                        "end_sec": end_sec,
-                        "mark": mark,
-                        "duration": end_sec-start_sec
-                    })
-                
-                new_tier.add(minTime=start_sec, maxTime=end_sec, mark=text)
-            
-            if not "NTB" in tier.name:
-                new_tg.tiers.append(new_tier)
+            in_tier = tier_ids == i
+            for start, end, text, ok in zip(start_sec[in_tier], end_sec[in_tier], texts[in_tier], accepted[in_tier]):
+                new_tier.add(minTime=float(start), maxTime=float(end), mark=text if ok else "")
+            new_tg.tiers.append(new_tier)
 
         logging.info(f"Total sentences in the file {tf}: {len(sentences[sample])}")
         logging.info(f"Total skipped sentences from the file {tf}: {len(skipped_sentences[sample])}")
@@ -84,26 +85,28 @@ def parse_textgrids(args, save_textgrids=False):
         if save_textgrids:
             new_tg.write(os.path.join(args.out_dir, sample + '.TextGrid'))
 
+    marks_cache.save()
+
     if args.save_sentences_json_dir is not None:
         logging.debug("Exporting JSON file sentences.json")
         with open(
             os.path.join(args.save_sentences_json_dir, "sentences.json"), 'w', encoding='utf8'
         ) as fp:
-            json.dump(sentences, fp, ensure_ascii=False, indent=4)
+            json.dump({k: v.to_records() for k, v in sentences.items()}, fp, ensure_ascii=False, indent=4)
         
     if args.save_skipped_sentences_json_dir is not None:
         logging.debug("Exporting JSON file skipped_sentences.json")
         with open(
             os.path.join(args.save_skipped_sentences_json_dir, "skipped_sentences.json"), 'w', encoding='utf8'
         ) as fp:
-            json.dump(skipped_sentences, fp, ensure_ascii=False, indent=4)
+            json.dump({k: v.to_records() for k, v in skipped_sentences.items()}, fp, ensure_ascii=False, indent=4)
 
     if args.save_sentences_csv_dir is not None and len(sentences[sample]) > 0:
         for tf in args.textgrids:
             sample = os.path.splitext(os.path.basename(tf))[0]
             logging.debug(f"Exporting CSV file of sentences from {sample}")
 
-            sentences_pd = pd.DataFrame(sentences[sample])
+            sentences_pd = sentences[sample].to_frame()
             sentences_pd.to_csv(
                 os.path.join(args.save_sentences_csv_dir, f"sentences_{sample}.csv"),
                 sep=';' if args.ptbr else ',',
@@ -120,7 +123,7 @@ def parse_textgrids(args, save_textgrids=False):
             sample = os.path.splitext(os.path.basename(tf))[0]
             logging.debug(f"Exporting CSV file of skipped sentences from {sample}")
 
-            skipped_sentences_pd = pd.DataFrame(skipped_sentences[sample])
+            skipped_sentences_pd = skipped_sentences[sample].to_frame()
             skipped_sentences_pd.to_csv(
                 os.path.join(args.save_skipped_sentences_csv_dir, f"skipped_sentences_{sample}.csv"),
                 sep=';' if args.ptbr else ',',
@@ -0,0 +1,232 @@
+import os
+import math
+import logging
+
+import numpy as np
+import soundfile as sf
+from numpy.lib.stride_tricks import sliding_window_view
+
+# Zero crossings on each side of the filter and beta of its Kaiser window.
+# "high" is the filter of scipy.signal.resample_poly.
+QUALITIES = {
+    "fast": (4, 5.0),
+    "medium": (8, 5.0),
+    "high": (10, 5.0),
+    "best": (32, 8.6)
+}
+
+
+class PolyphaseFilter:
+    """
+    Windowed-sinc low-pass filter of a rational resampling (up/down),
+    applied in polyphase form: each output sample is the dot product of a
+    window of Q input samples with one of the `up` phases of the filter.
+    Any range of the output can be computed from the matching range of the
+    input, so long files can be resampled block by block.
+    """
+
+    def __init__(self, up, down, quality="high"):
+        zero_crossings, beta = QUALITIES[quality]
+        self.up = up
+        self.down = down
+        if up == down:
+            h = np.ones(1)
+        else:
+            half = zero_crossings*max(up, down)
+            cutoff = 1/max(up, down)
+            k = np.arange(-half, half+1)
+            h = cutoff*np.sinc(cutoff*k)*np.kaiser(2*half+1, beta)
+            h = h/h.sum()*up
+        self.delay = (len(h) - 1)//2
+        self.Q = -(-len(h)//up)
+        phases = np.zeros(up*self.Q)
+        phases[:len(h)] = h
+        # phases[p, j] multiplies the input window of an output with phase p
+        self.phases = np.ascontiguousarray(phases.reshape(self.Q, up).T[:, ::-1], dtype=np.float32)
+
+    def output_length(self, n_in):
+        return -(-n_in*self.up//self.down)
+
+    def input_range(self, n0, n1):
+        """
+        Input samples [lo, hi) needed for the outputs [n0, n1).
+        """
+        return (n0*self.down + self.delay)//self.up - self.Q + 1, ((n1-1)*self.down + self.delay)//self.up + 1
+
+    def apply(self, x, lo, n0, n1):
+        """
+        Outputs [n0, n1), given the inputs x = input[lo:hi] of input_range.
+        """
+        windows = sliding_window_view(np.asarray(x, dtype=np.float32), self.Q)
+        y = np.empty(n1 - n0, dtype=np.float32)
+        # Outputs up samples apart use the same phase, with inputs down samples apart
+        for r in range(min(self.up, n1 - n0)):
+            count = -(-(n1 - n0 - r)//self.up)
+            t = (n0 + r)*self.down + self.delay
+            start = t//self.up - self.Q + 1 - lo
+            y[r::self.up] = windows[start:start + self.down*(count-1) + 1:self.down] @ self.phases[t % self.up]
+        return y
+
+
+class StreamingResampler:
+    """
+    Reads an audio file (mixed to mono, like librosa.load) and returns
+    ranges of it resampled to target_sr. The file is read sequentially:
+    ranges requested in increasing order reuse the samples already read and
+    gaps are skipped with a seek.
+    """
+
+    def __init__(self, path, target_sr, quality="high", read_block_s=10):
+        self._file = sf.SoundFile(path)
+        orig_sr = self._file.samplerate
+        gcd = math.gcd(orig_sr, target_sr)
+        self.filter = PolyphaseFilter(target_sr//gcd, orig_sr//gcd, quality)
+        self.n_in = self._file.frames
+        self.n_out = self.filter.output_length(self.n_in)
+        self._read_block = int(read_block_s*orig_sr)
+        self._buf = np.empty(0, dtype=np.float32)
+        self._buf_start = 0
+
+    def _input(self, lo, hi):
+        lo_file, hi_file = max(lo, 0), min(hi, self.n_in)
+        buf_end = self._buf_start + len(self._buf)
+        if lo_file < self._buf_start or lo_file > buf_end:
+            self._file.seek(lo_file)
+            self._buf = np.empty(0, dtype=np.float32)
+            self._buf_start = lo_file
+        else:
+            self._buf = self._buf[lo_file - self._buf_start:]
+            self._buf_start = lo_file
+        while self._buf_start + len(self._buf) < hi_file:
+            data = self._file.read(max(hi_file - self._buf_start - len(self._buf), self._read_block),
+                                   dtype='float32', always_2d=True)
+            if len(data) == 0:
+                break
+            self._buf = np.concatenate([self._buf, data.mean(axis=1)])
+
+        x = np.zeros(hi - lo, dtype=np.float32)
+        available = self._buf[:max(hi_file - lo_file, 0)]
+        x[lo_file - lo:lo_file - lo + len(available)] = available
+        return x
+
+    def read(self, n0, n1):
+        if n1 <= n0:
+            return np.empty(0, dtype=np.float32)
+        lo, hi = self.filter.input_range(n0, n1)
+        return self.filter.apply(self._input(lo, hi), lo, n0, n1)
+
+    def close(self):
+        self._file.close()
+
+
+def stream_segments(path, target_sr, ranges, quality="high", block_s=30):
+    """
+    Resamples the parts of a file covered by ranges [(start_sec, end_sec)]
+    in a single pass and yields (i, audio) for each range as soon as it is
+    complete (not in the order of `ranges`). Each range has the samples
+    [int(target_sr*start_sec), int(target_sr*end_sec)) of the resampled file,
+    the same ones of slicing the whole file resampled at once.
+    """
+    resampler = StreamingResampler(path, target_sr, quality)
+    samples = []
+    for start_sec, end_sec in ranges:
+        end = min(int(target_sr*end_sec), resampler.n_out)
+        samples.append((min(int(target_sr*start_sec), end), end))
+
+    # Overlapping or adjacent ranges are resampled together
+    merged = []
+    for i in sorted(range(len(samples)), key=lambda i: samples[i]):
+        start, end = samples[i]
+        if merged and start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], end)
+            merged[-1][2].append(i)
+        else:
+            merged.append([start, end, [i]])
+
+    block = int(block_s*target_sr)
+    try:
+        for u0, u1, pending in merged:
+            buf = np.empty(0, dtype=np.float32)
+            buf_start = u0
+            for n0 in range(u0, max(u1, u0+1), block):
+                n1 = min(n0 + block, u1)
+                buf = np.concatenate([buf, resampler.read(n0, n1)])
+                remaining = []
+                for i in pending:
+                    start, end = samples[i]
+                    if end <= n1:
+                        yield i, buf[start - buf_start:end - buf_start].copy()
+                    else:
+                        remaining.append(i)
+                pending = remaining
+                keep = min((samples[i][0] for i in pending), default=n1)
+                buf = buf[keep - buf_start:]
+                buf_start = keep
+    finally:
+        resampler.close()
+
+
+if __name__ == "__main__":
+    import time
+    import argparse
+
+    import librosa
+    import textgrid
+    from tabulate import tabulate
+
+    parser = argparse.ArgumentParser("Compara o tempo e a qualidade da segmentação com librosa.load por segmento "
+                                     "e com o reamostrador polifásico em streaming. A referência é o áudio inteiro "
+                                     "reamostrado pelo librosa (--load-full-audio).")
+    parser.add_argument("audio_file",
+                        help="Arquivo de áudio (ex: um inquérito longo)")
+    parser.add_argument("--textgrid", "-t",
+                        help="TextGrid com os intervalos a segmentar. Padrão: segmentos consecutivos de "
+                             "--segment-length segundos")
+    parser.add_argument("--segment-length",
+                        help="Duração dos segmentos sem --textgrid",
+                        type=float,
+                        default=5.0)
+    parser.add_argument("--sample-rate", "-sr",
+                        type=int,
+                        default=16000)
+    parser.add_argument("--qualities",
+                        nargs="+",
+                        choices=list(QUALITIES),
+                        default=list(QUALITIES))
+    args = parser.parse_args()
+
+    if args.textgrid is not None:
+        ranges = sorted({(it.minTime, it.maxTime) for tier in textgrid.TextGrid.fromFile(args.textgrid)
+                         for it in tier if it.mark.strip() != ''})
+    else:
+        total = sf.info(args.audio_file).duration
+        ranges = [(start, min(start + args.segment_length, total))
+                  for start in np.arange(0, total, args.segment_length)]
+    logging.basicConfig(level="INFO")
+    logging.info(f"{len(ranges)} segments of {args.audio_file}")
+
+    start = time.perf_counter()
+    reference, _ = librosa.load(os.path.abspath(args.audio_file), sr=args.sample_rate)
+    full_time = time.perf_counter() - start
+    reference = [reference[int(args.sample_rate*s):int(args.sample_rate*e)] for s, e in ranges]
+
+    def snr(segments):
+        signal = noise = 0.0
+        for ref, seg in zip(reference, segments):
+            n = min(len(ref), len(seg))
+            signal += float(np.sum(np.square(ref[:n], dtype=np.float64)))
+            noise += float(np.sum(np.square(ref[:n] - seg[:n], dtype=np.float64)))
+        return 10*np.log10(signal/noise) if noise > 0 else np.inf
+
+    rows = [{"method": "librosa (full audio, reference)", "time (s)": full_time, "SNR (dB)": np.inf}]
+    start = time.perf_counter()
+    segments = [librosa.load(os.path.abspath(args.audio_file), sr=args.sample_rate, offset=s, duration=e-s)[0]
+                for s, e in ranges]
+    rows.append({"method": "librosa (per segment)", "time (s)": time.perf_counter() - start, "SNR (dB)": snr(segments)})
+    for quality in args.qualities:
+        start = time.perf_counter()
+        segments = [None]*len(ranges)
+        for i, audio in stream_segments(args.audio_file, args.sample_rate, ranges, quality):
+            segments[i] = audio
+        rows.append({"method": f"stream ({quality})", "time (s)": time.perf_counter() - start, "SNR (dB)": snr(segments)})
+    print(tabulate(rows, headers='keys', tablefmt='psql'))
@@ -0,0 +1,145 @@
+import os
+import json
+import time
+import logging
+import threading
+import concurrent.futures
+
+import numpy as np
+
+# Used until a model has finished jobs
+DEFAULT_RTF = 0.1
+DEFAULT_OVERHEAD_S = 30.0
+
+
+def format_seconds(seconds):
+    seconds = int(max(seconds, 0))
+    return f"{seconds//3600}h{seconds%3600//60:02d}m{seconds%60:02d}s"
+
+
+class RuntimeEstimator:
+    """
+    Estimates the wall time of a job as overhead + rtf*duration (duration
+    is the total duration of the segments). When the jobs measure their
+    overhead (e.g. the model loading of each test_asr.py process), it is the
+    mean of the measures and rtf is fitted on the remaining time; otherwise
+    both are fitted by least squares on the jobs recorded for the same
+    model. The observations are kept in a JSON file, so later sweeps start
+    with the real-time factors of the previous ones.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.observations = {}
+        if os.path.isfile(path):
+            with open(path, encoding='utf8') as fp:
+                self.observations = json.load(fp)
+        self._lock = threading.Lock()
+        self._fits = {}
+
+    def _fit(self, observations):
+        if len(observations) == 0:
+            return DEFAULT_OVERHEAD_S, DEFAULT_RTF
+        durations = np.array([o[0] for o in observations], dtype=np.float64)
+        elapsed = np.array([o[1] for o in observations], dtype=np.float64)
+        measured = [o[2] for o in observations if len(o) > 2]
+        if len(measured) > 0:
+            overhead = float(np.mean(measured))
+            return overhead, float(max(np.maximum(elapsed - overhead, 0).sum(), 1e-6)/max(durations.sum(), 1e-6))
+        if len(observations) == 1 or np.ptp(durations) == 0:
+            return 0.0, float(elapsed.sum()/max(durations.sum(), 1e-6))
+        rtf, overhead = np.polyfit(durations, elapsed, 1)
+        if overhead < 0 or rtf <= 0:
+            return 0.0, float(elapsed.sum()/max(durations.sum(), 1e-6))
+        return float(overhead), float(rtf)
+
+    def estimate(self, model, duration):
+        with self._lock:
+            if model not in self._fits:
+                observations = self.observations.get(model)
+                if not observations:
+                    # Models without jobs use all the observations
+                    observations = [o for model_obs in self.observations.values() for o in model_obs]
+                self._fits[model] = self._fit(observations)
+            overhead, rtf = self._fits[model]
+        return overhead + rtf*duration
+
+    def record(self, model, duration, elapsed, overhead=None):
+        with self._lock:
+            observation = [duration, elapsed] if overhead is None else [duration, elapsed, overhead]
+            self.observations.setdefault(model, []).append(observation)
+            self._fits.clear()
+            with open(self.path + ".tmp", 'w', encoding='utf8') as fp:
+                json.dump(self.observations, fp, indent=4)
+            os.replace(self.path + ".tmp", self.path)
+            overhead, rtf = self._fit(self.observations[model])
+        logging.info(f"{model}: RTF {rtf:.4f}, overhead {overhead:.1f}s")
+
+
+def run_jobs(jobs, workers, estimator, run_job, on_finish=None):
+    """
+    Runs the jobs (dicts with at least "model" and "duration") in `workers`
+    threads, calling run_job(job, worker). The pending job with the longest
+    estimated time is always started first, and the estimates (and the ETA)
+    are updated after each finished job. run_job returns whether the job
+    succeeded, or (ok, overhead) with the overhead measured by the job (see
+    RuntimeEstimator). on_finish(job) is called after each job. Returns the
+    number of failed jobs.
+    """
+    pending = list(jobs)
+    running = {}
+    lock = threading.Lock()
+    state = {"done": 0, "failed": 0}
+    start = time.perf_counter()
+
+    def next_job():
+        with lock:
+            if len(pending) == 0:
+                return None
+            pending.sort(key=lambda j: estimator.estimate(j["model"], j["duration"]))
+            job = pending.pop()
+            running[id(job)] = (job, time.perf_counter())
+            return job
+
+    def report(job, elapsed, ok):
+        with lock:
+            state["done"] += 1
+            state["failed"] += 0 if ok else 1
+            now = time.perf_counter()
+            remaining = sum(estimator.estimate(j["model"], j["duration"]) for j in pending)
+            remaining += sum(max(estimator.estimate(j["model"], j["duration"]) - (now - t), 0)
+                             for j, t in running.values())
+            eta = remaining / max(min(workers, len(pending) + len(running)), 1)
+            print(f"[{state['done']}/{len(jobs)}] {job['name']} {'finished' if ok else 'FAILED'} in "
+                  f"{format_seconds(elapsed)} | elapsed {format_seconds(now - start)} | ETA {format_seconds(eta)}",
+                  flush=True)
+
+    def worker_loop(worker):
+        while True:
+            job = next_job()
+            if job is None:
+                return
+            job_start = time.perf_counter()
+            ok = False
+            overhead = None
+            try:
+                ok = run_job(job, worker)
+                if isinstance(ok, tuple):
+                    ok, overhead = ok
+            except Exception as e:
+                logging.error(f"Error running {job['name']}: {str(e)}")
+            elapsed = time.perf_counter() - job_start
+            with lock:
+                del running[id(job)]
+            if ok:
+                estimator.record(job["model"], job["duration"], elapsed, overhead)
+            report(job, elapsed, ok)
+            if on_finish is not None:
+                on_finish(job)
+
+    total = sum(estimator.estimate(j["model"], j["duration"]) for j in jobs)
+    print(f"{len(jobs)} jobs, {workers} workers, estimated time {format_seconds(total/max(workers, 1))}", flush=True)
+    with concurrent.futures.ThreadPoolExecutor(workers) as executor:
+        for f in [executor.submit(worker_loop, w) for w in range(workers)]:
+            f.result()
+    return state["failed"]
@@ -0,0 +1,148 @@
+import os
+import json
+import glob
+import logging
+
+import numpy as np
+import soundfile as sf
+
+
+def segment_key(sample, start_sec, end_sec):
+    """
+    Key of a segment in the archive: the name of the WAV file it replaces.
+    """
+    return f"{sample}_{start_sec}_{end_sec}.wav"
+
+
+def archive_exists(archive_dir, sample):
+    return os.path.isfile(os.path.join(archive_dir, f"{sample}.segments.json"))
+
+
+class SegmentArchiveWriter:
+    """
+    Packs the segments of one inquiry in a single file of 16-bit PCM
+    samples ({sample}.segments.pcm) indexed by an offset table
+    ({sample}.segments.json), instead of one WAV file per segment.
+
+    An existing archive is extended (only new segments are appended) unless
+    overwrite is set.
+    """
+
+    def __init__(self, archive_dir, sample, sample_rate, overwrite=False):
+        self.index_path = os.path.join(archive_dir, f"{sample}.segments.json")
+        self.index = {"sample_rate": sample_rate, "segments": {}}
+        pcm_path = os.path.join(archive_dir, f"{sample}.segments.pcm")
+        if not overwrite and os.path.isfile(self.index_path) and os.path.isfile(pcm_path):
+            with open(self.index_path, encoding='utf8') as fp:
+                index = json.load(fp)
+            if index["sample_rate"] == sample_rate:
+                self.index = index
+            else:
+                logging.warning(f"The archive {pcm_path} has another sample rate. It will be overwritten.")
+        self._offset = sum(s["samples"] for s in self.index["segments"].values())
+        if self._offset > 0:
+            # Drops samples of an interrupted run that are not in the index
+            self._fp = open(pcm_path, 'r+b')
+            self._fp.truncate(self._offset*2)
+            self._fp.seek(self._offset*2)
+        else:
+            self._fp = open(pcm_path, 'wb')
+
+    def __contains__(self, key):
+        return key in self.index["segments"]
+
+    def add(self, key, start_sec, end_sec, audio):
+        # Same conversion of soundfile when writing 16-bit WAV files
+        samples = np.clip(np.round(np.asarray(audio, dtype=np.float64)*32767), -32768, 32767).astype(np.int16)
+        self._fp.write(samples.tobytes())
+        self.index["segments"][key] = {
+            "start_sec": start_sec,
+            "end_sec": end_sec,
+            "offset": self._offset,
+            "samples": len(samples)
+        }
+        self._offset += len(samples)
+
+    def close(self):
+        self._fp.close()
+        # Index sorted by the time of the segments
+        self.index["segments"] = dict(sorted(
+            self.index["segments"].items(), key=lambda item: (item[1]["start_sec"], item[1]["end_sec"])
+        ))
+        with open(self.index_path + ".tmp", 'w', encoding='utf8') as fp:
+            json.dump(self.index, fp)
+        os.replace(self.index_path + ".tmp", self.index_path)
+
+
+class SegmentArchiveReader:
+    """
+    Memory-mapped random access to the segments saved by
+    SegmentArchiveWriter.
+    """
+
+    def __init__(self, archive_dir, sample):
+        with open(os.path.join(archive_dir, f"{sample}.segments.json"), encoding='utf8') as fp:
+            self.index = json.load(fp)
+        self.sample_rate = self.index["sample_rate"]
+        pcm_path = os.path.join(archive_dir, f"{sample}.segments.pcm")
+        self._data = np.memmap(pcm_path, dtype=np.int16, mode='r') if os.path.getsize(pcm_path) > 0 \
+            else np.empty(0, dtype=np.int16)
+
+    def __contains__(self, key):
+        return key in self.index["segments"]
+
+    def keys(self):
+        return list(self.index["segments"])
+
+    def get(self, key):
+        """
+        Samples of a segment in [-1, 1] (float32), like librosa.load of the
+        WAV file.
+        """
+        segment = self.index["segments"][key]
+        offset = segment["offset"]
+        return self._data[offset:offset+segment["samples"]].astype(np.float32) / 32768.0
+
+    def export_wav(self, key, out_dir):
+        path = os.path.join(out_dir, key)
+        sf.write(path, self.get(key), self.sample_rate)
+        return path
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser("Exporta segmentos de um arquivo de segmentos (--segment-archive do test_asr.py) "
+                                     "como arquivos WAV.")
+    parser.add_argument("--archive-dir", "-a",
+                        help="Diretório com os arquivos {amostra}.segments.pcm e {amostra}.segments.json "
+                             "(--audio-out-dir do test_asr.py)",
+                        required=True)
+    parser.add_argument("--samples", "-s",
+                        nargs="+",
+                        help="Amostras a exportar (padrão: todas do diretório)")
+    parser.add_argument("--segments",
+                        nargs="+",
+                        help="Nomes dos segmentos a exportar (ex: SP_D2_255_12.5_15.25.wav). Padrão: todos")
+    parser.add_argument("--list",
+                        help="Apenas lista os segmentos de cada amostra",
+                        action="store_true")
+    parser.add_argument("--out-dir", "-o",
+                        help="Diretório de saída dos arquivos WAV",
+                        default="./")
+    args = parser.parse_args()
+
+    samples = args.samples
+    if samples is None:
+        samples = sorted(os.path.basename(f)[:-len(".segments.json")]
+                         for f in glob.glob(os.path.join(args.archive_dir, "*.segments.json")))
+    os.makedirs(args.out_dir, exist_ok=True)
+    for sample in samples:
+        reader = SegmentArchiveReader(args.archive_dir, sample)
+        for key in reader.keys():
+            if args.segments is not None and key not in args.segments:
+                continue
+            if args.list:
+                print(key)
+            else:
+                print(reader.export_wav(key, args.out_dir))
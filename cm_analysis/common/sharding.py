@@ -0,0 +1,93 @@
+import os
+import copy
+import heapq
+import logging
+import multiprocessing
+import concurrent.futures
+
+
+def balance_inquiries(audio_files, corpus_sentences, n_shards):
+    """
+    Splits the inquiries into n_shards lists with similar total duration
+    (longest inquiries first, each one to the least loaded shard).
+    """
+    durations = []
+    for audio_file in audio_files:
+        sample = os.path.splitext(os.path.basename(audio_file))[0]
+        durations.append((float(corpus_sentences[sample].column("duration").sum()), audio_file))
+
+    shards = [[] for _ in range(n_shards)]
+    loads = [(0.0, i) for i in range(n_shards)]
+    for duration, audio_file in sorted(durations, key=lambda d: -d[0]):
+        load, i = heapq.heappop(loads)
+        shards[i].append(audio_file)
+        heapq.heappush(loads, (load + duration, i))
+
+    for i, shard in enumerate(shards):
+        logging.info(f"Shard {i}: {len(shard)} inquiries")
+    return shards
+
+
+def default_threads(n_shards):
+    """
+    CPU cores of each shard process when they are not set, so the shards
+    (and their LM decoding pools) do not oversubscribe the machine.
+    """
+    return max((os.cpu_count() or 1) // max(n_shards, 1), 1)
+
+
+def _init_worker(args, shard, threads):
+    log_file = f"{args.log_file}.shard{shard}" if args.log_file is not None else None
+    logging.basicConfig(format=f"%(levelname)s:shard{shard}:%(filename)s:%(lineno)s:%(message)s",
+                        level=args.log_level,
+                        filename=log_file,
+                        filemode='w')
+    try:
+        import torch
+    except ImportError:
+        # Workers that do not run models (e.g. only decoding) do not need it
+        logging.debug("PyTorch is not installed. The number of threads was not set.")
+        return
+    torch.set_num_threads(threads)
+
+
+def _run_shard(worker, args, shard, threads, *worker_args):
+    _init_worker(args, shard, threads)
+    return worker(args, *worker_args)
+
+
+def run_sharded(args, worker, corpus_sentences, corpus_new_textgrids, devices, threads=None):
+    """
+    Runs `worker(args, corpus_sentences, corpus_new_textgrids)` in one
+    process per device, each with a length-balanced subset of the inquiries
+    (args.audio_files) and args.device set to its device. Device -1 is the
+    CPU, so several CPU workers can be used by repeating it. Without
+    `threads`, the CPU cores are split between the shards (PyTorch threads
+    and, without --lm-processes, the LM decoding processes). Returns the
+    list of values returned by the workers.
+    """
+    shards = balance_inquiries(args.audio_files, corpus_sentences, len(devices))
+    n_shards = sum(1 for shard in shards if len(shard) > 0)
+    if threads is None:
+        threads = default_threads(n_shards)
+        logging.info(f"{threads} threads per shard")
+
+    # CUDA cannot be used in forked processes
+    context = multiprocessing.get_context("spawn")
+    with concurrent.futures.ProcessPoolExecutor(len(devices), mp_context=context) as executor:
+        futures = []
+        for i, (device, audio_files) in enumerate(zip(devices, shards)):
+            if len(audio_files) == 0:
+                continue
+            shard_args = copy.copy(args)
+            shard_args.audio_files = audio_files
+            shard_args.device = int(device)
+            if args.lm_processes is None:
+                shard_args.lm_processes = threads
+            samples = [os.path.splitext(os.path.basename(f))[0] for f in audio_files]
+            futures.append(executor.submit(
+                _run_shard, worker, shard_args, i, threads,
+                {sample: corpus_sentences[sample] for sample in samples},
+                {sample: corpus_new_textgrids[sample] for sample in samples}
+            ))
+        return [f.result() for f in futures]
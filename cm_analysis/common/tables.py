@@ -0,0 +1,139 @@
+import sys
+import array
+
+import numpy as np
+import pandas as pd
+
+
+# Column types: numeric columns are stored in typed arrays ("d" for
+# floats and "q" for integers, 8 bytes per value), "str" columns in lists of interned strings (repeated marks,
+# paths and words share the same object) and "obj" columns in plain lists
+SENTENCE_SCHEMA = {
+    "start_sec": "d",
+    "end_sec": "d",
+    "mark": "str",
+    "text": "str",
+    "duration": "d"
+}
+
+SKIPPED_SENTENCE_SCHEMA = {
+    "start_sec": "d",
+    "end_sec": "d",
+    "mark": "str",
+    "duration": "d"
+}
+
+# One row per interval of a TextGrid (all tiers), see mark_flags
+MARK_SCHEMA = {
+    "tier": "q",
+    "start_sec": "d",
+    "end_sec": "d",
+    "mark": "str",
+    "flags": "q",
+    "text": "str",
+    "text_incomprehensible": "str"
+}
+
+RESULT_SCHEMA = {
+    "path": "str",
+    "start_sec": "d",
+    "end_sec": "d",
+    "mark": "str",
+    "sentence": "str",
+    "duration": "d",
+    "prediction": "str",
+    "phones": "str",
+    "timestamps": "obj",
+    "wer": "d",
+    "mer": "d",
+    "wil": "d",
+    "cer": "d"
+}
+
+WORD_TIMESTAMP_SCHEMA = {
+    "path": "str",
+    "tp_text": "str",
+    "tp_start": "d",
+    "tp_end": "d",
+    "ts_start_sec": "d",
+    "ts_end_sec": "d"
+}
+
+
+class ColumnTable:
+    """
+    Append-only columnar table used for the sentences, the results and the
+    timestamps instead of lists of dicts.
+
+    Iterating over the table (or indexing it) returns one dict per row, so
+    it can be read like the previous lists of dicts, but the rows are only
+    stored as columns.
+    """
+
+    def __init__(self, schema):
+        self.schema = schema
+        self._columns = {}
+        for name, kind in schema.items():
+            self._columns[name] = [] if kind in ("str", "obj") else array.array(kind)
+
+    def __len__(self):
+        return len(self._columns[next(iter(self.schema))])
+
+    def __getitem__(self, i):
+        return {name: column[i] for name, column in self._columns.items()}
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    @staticmethod
+    def _convert(kind, value):
+        if kind == "str":
+            return sys.intern(str(value))
+        return value
+
+    def append(self, **row):
+        for name, kind in self.schema.items():
+            self._columns[name].append(self._convert(kind, row[name]))
+
+    def extend(self, **columns):
+        """
+        Appends several rows at once, given one sequence per column.
+        """
+        for name, kind in self.schema.items():
+            values = columns[name]
+            if kind == "str":
+                self._columns[name].extend(sys.intern(str(v)) for v in values)
+            elif kind == "obj":
+                self._columns[name].extend(values)
+            else:
+                self._columns[name].extend(np.asarray(values, dtype=np.float64 if kind == "d" else None).tolist())
+
+    def set(self, i, **values):
+        for name, value in values.items():
+            self._columns[name][i] = self._convert(self.schema[name], value)
+
+    def column(self, name):
+        """
+        Column as a NumPy array (a copy, the table can keep growing).
+        """
+        column = self._columns[name]
+        if self.schema[name] in ("str", "obj"):
+            values = np.empty(len(column), dtype=object)
+            for i, value in enumerate(column):
+                values[i] = value
+            return values
+        return np.frombuffer(column, dtype=column.typecode).copy() if len(column) > 0 else np.empty(0)
+
+    def to_frame(self):
+        columns = {}
+        for name, kind in self.schema.items():
+            values = self.column(name)
+            if kind == "d" and len(values) > 0 and np.all(values == -1):
+                # Only the -1 marker (e.g. metrics not selected): written as integers, like the lists of dicts
+                values = values.astype(np.int64)
+            columns[name] = values
+        return pd.DataFrame(columns)
+
+    def to_records(self):
+        return list(self)
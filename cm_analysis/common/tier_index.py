@@ -0,0 +1,112 @@
+import logging
+
+import numpy as np
+import textgrid
+
+
+class TierIndex:
+    """
+    Sorted, array-backed interval index of an output tier.
+
+    Intervals are collected in bulk and only sorted and checked for overlaps
+    once, in `resolve`, instead of searching the tier on every
+    `IntervalTier.add`. Overlaps are resolved deterministically: after
+    sorting by (start, end, insertion order), the start of each interval is
+    moved to the largest end seen so far and intervals left empty are
+    dropped. Conflicts are reported as counts instead of exceptions.
+    """
+
+    epsilon = 0.000000000001
+    # Overlaps up to this size (float rounding of the shifted timestamps and
+    # the epsilon clamps) are resolved but not counted as conflicts
+    overlap_tolerance = 0.000001
+
+    def __init__(self, name, min_time, max_time):
+        self.name = name
+        self.min_time = min_time
+        self.max_time = max_time
+        self._starts = []
+        self._ends = []
+        self._marks = []
+        self.conflicts = {}
+
+    def __len__(self):
+        return len(self._marks)
+
+    def add(self, start_sec, end_sec, mark):
+        self._starts.append(np.array([start_sec], dtype=np.float64))
+        self._ends.append(np.array([end_sec], dtype=np.float64))
+        self._marks.append(mark)
+
+    def add_chunks(self, chunks, offset_sec, end_sec):
+        """
+        Adds the timestamps of a pipeline output (`chunks`) shifted by
+        `offset_sec`. Timestamps past `end_sec` are clamped to the end of
+        the sentence, and so are missing (None) end timestamps.
+        """
+        chunks = [tp for tp in chunks if tp["text"].strip() != '' and tp["timestamp"][0] is not None]
+        if len(chunks) == 0:
+            return
+        ts = np.array([
+            (tp["timestamp"][0], tp["timestamp"][1] if tp["timestamp"][1] is not None else np.inf)
+            for tp in chunks
+        ], dtype=np.float64) + offset_sec
+        ts = np.minimum(ts, end_sec - self.epsilon)
+        self._starts.append(ts[:, 0])
+        self._ends.append(ts[:, 1])
+        self._marks.extend(tp["text"] for tp in chunks)
+
+    def resolve(self):
+        """
+        Returns the sorted, non-overlapping (starts, ends, marks) of the tier.
+        """
+        if len(self._marks) == 0:
+            self.conflicts = {"out_of_bounds": 0, "trimmed": 0, "dropped": 0}
+            return np.empty(0), np.empty(0), []
+
+        starts = np.concatenate(self._starts)
+        ends = np.concatenate(self._ends)
+        # A NaN would be carried by the running maximum and drop the rest of the tier
+        valid = ~(np.isnan(starts) | np.isnan(ends))
+
+        # Clamps to the tier bounds (the same epsilon used for the sentences)
+        out_of_bounds = (starts <= self.min_time) | (ends >= self.max_time)
+        starts = np.maximum(starts, self.min_time + self.epsilon)
+        ends = np.minimum(ends, self.max_time - self.epsilon)
+
+        order = np.flatnonzero(valid)
+        order = order[np.lexsort((order, ends[order], starts[order]))]
+        starts = starts[order]
+        ends = ends[order]
+
+        prev_ends = np.full_like(ends, -np.inf)
+        if len(ends) > 0:
+            prev_ends[1:] = np.maximum.accumulate(ends)[:-1]
+        overlap = prev_ends - starts > self.overlap_tolerance
+        starts = np.maximum(starts, prev_ends)
+        keep = starts < ends
+
+        self.conflicts = {
+            "out_of_bounds": int((out_of_bounds & valid).sum()),
+            "trimmed": int((overlap & keep).sum()),
+            "dropped": int((~keep).sum() + (~valid).sum())
+        }
+        marks = [self._marks[i] for i in order[keep]]
+        return starts[keep], ends[keep], marks
+
+    def to_tier(self):
+        starts, ends, marks = self.resolve()
+        if self.conflicts["trimmed"] or self.conflicts["dropped"]:
+            logging.warning(f"Tier {self.name}: {self.conflicts['trimmed']} overlapping intervals trimmed, "
+                            f"{self.conflicts['dropped']} dropped, "
+                            f"{self.conflicts['out_of_bounds']} clamped to the tier bounds")
+        tier = textgrid.IntervalTier(
+            name=self.name,
+            minTime=self.min_time,
+            maxTime=self.max_time
+        )
+        # Already sorted and without overlaps: skips the per-item search of IntervalTier.add
+        tier.intervals = [
+            textgrid.Interval(float(s), float(e), m) for s, e, m in zip(starts, ends, marks)
+        ]
+        return tier
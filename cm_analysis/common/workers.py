@@ -0,0 +1,62 @@
+import logging
+import threading
+import concurrent.futures
+
+
+class BoundedExecutor:
+    """
+    Thread pool with a bounded number of pending jobs.
+
+    `submit` blocks while `max_pending` jobs are queued or running, so the
+    producer (the inference loop) cannot get too far ahead of the workers.
+    Failed jobs are logged and counted. With `max_workers=0` the jobs run
+    synchronously in the caller's thread.
+    """
+
+    def __init__(self, max_workers=2, max_pending=64):
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers) if max_workers > 0 else None
+        self._slots = threading.BoundedSemaphore(max(max_pending, 1))
+        self._lock = threading.Lock()
+        self._pending = set()
+        self.errors = 0
+
+    def _done(self, future):
+        with self._lock:
+            self._pending.discard(future)
+            if future.exception() is not None:
+                self.errors += 1
+                logging.error(f"Background job failed: {str(future.exception())}")
+        if self._executor is not None:
+            self._slots.release()
+
+    def submit(self, fn, *args, **kwargs):
+        if self._executor is None:
+            future = concurrent.futures.Future()
+            try:
+                future.set_result(fn(*args, **kwargs))
+            except Exception as e:
+                future.set_exception(e)
+            self._done(future)
+            return future
+
+        self._slots.acquire()
+        future = self._executor.submit(fn, *args, **kwargs)
+        with self._lock:
+            self._pending.add(future)
+        future.add_done_callback(self._done)
+        return future
+
+    def join(self):
+        """
+        Waits for all the submitted jobs. Returns the number of failed jobs.
+        """
+        with self._lock:
+            pending = list(self._pending)
+        concurrent.futures.wait(pending)
+        return self.errors
+
+    def shutdown(self):
+        self.join()
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+        return self.errors
@@ -0,0 +1,268 @@
+import os
+import sys
+import json
+import logging
+import argparse
+import threading
+import subprocess
+
+import pandas as pd
+
+from common import parse_textgrids, aggregate_results, scheduler
+
+
+# Same configurations of run_tests.sh ({out_root}/{config}/{model})
+CONFIGS = {
+    "accept_all": ["--accept-all"],
+    "ignore_all": ["--ignore-all"],
+    "ignore_incomprehensible_sentences_hypothesis_sentences":
+        ["--ignore-sentences-with", "incomprehensible_sentences", "hypothesis_sentences"],
+    "ignore_sentences_with_annotation_parts":
+        ["--ignore-sentences-with", "sentences_with_annotation_parts"],
+    "ignore_overlap_sentences":
+        ["--ignore-sentences-with", "overlap_sentences"],
+    "ignore_incomprehensible_sentences_sentences_with_annotation_parts_overlap_sentences":
+        ["--ignore-sentences-with", "incomprehensible_sentences", "sentences_with_annotation_parts", "overlap_sentences"]
+}
+
+
+def config_sentences(args, config, config_dir):
+    """
+    Sentences of a configuration (parsed once, also saving the sentences
+    JSONs and CSVs in the configuration directory).
+    """
+    ignore = CONFIGS[config][1:] if CONFIGS[config][0] == "--ignore-sentences-with" else []
+    parse_args = argparse.Namespace(
+        textgrids=args.textgrids,
+        accept_all="--accept-all" in CONFIGS[config],
+        ignore_all="--ignore-all" in CONFIGS[config],
+        ignore_sentences_with=ignore,
+        out_dir=config_dir,
+        save_sentences_json_dir=config_dir,
+        save_skipped_sentences_json_dir=config_dir,
+        save_sentences_csv_dir=config_dir,
+        save_skipped_sentences_csv_dir=config_dir,
+        ptbr=args.ptbr,
+        marks_cache=args.marks_cache,
+        log_level="WARNING"
+    )
+    sentences, _ = parse_textgrids.parse_textgrids(parse_args)
+    return sentences
+
+
+def merge_summaries(args, out_dir, model, samples):
+    """
+    Joins the partial summaries of the jobs of a (model, config) in the
+    summary.csv and writes the aggregate.csv, like a single run of
+    test_asr.py.
+    """
+    sep = ';' if args.ptbr else ','
+    decimal = ',' if args.ptbr else '.'
+    summary_pd = pd.concat([
+        pd.read_csv(os.path.join(out_dir, "summaries", f"{sample}.csv"), sep=sep, decimal=decimal)
+        for sample in samples
+    ], ignore_index=True)
+    summary_pd.loc["AVG"] = summary_pd.mean(numeric_only=True)
+    summary_pd.to_csv(os.path.join(out_dir, "summary.csv"), sep=sep, decimal=decimal, index=False)
+
+    results_files = [os.path.join(out_dir, f"{sample}_results_{model.replace('/', '_')}.csv") for sample in samples]
+    aggregation_pd = aggregate_results.aggregate_results(results_files, ptbr=args.ptbr)
+    aggregate_results.export_aggregation(aggregation_pd, out_dir, ptbr=args.ptbr, print_table=False)
+    logging.info(f"Summary of {out_dir} exported")
+
+
+def main(args):
+    audio_files = {os.path.splitext(os.path.basename(f))[0]: f for f in args.audio_files}
+    textgrids = {os.path.splitext(os.path.basename(f))[0]: f for f in args.textgrids}
+    samples = list(textgrids)
+
+    jobs = []
+    groups = {}
+    # Segment durations of each inquiry in each configuration with pending jobs
+    segmentation = {}
+    for config in args.configs:
+        config_dir = os.path.join(args.out_root, config)
+        os.makedirs(os.path.join(config_dir, "logs"), exist_ok=True)
+        logging.info(f"Parsing TextGrids of {config}")
+        sentences = config_sentences(args, config, config_dir)
+        for model in args.models:
+            out_dir = os.path.join(config_dir, model)
+            if os.path.isfile(os.path.join(out_dir, "summary.csv")):
+                logging.info(f"{out_dir}/summary.csv exists. Skipping.")
+                continue
+            os.makedirs(os.path.join(out_dir, "summaries"), exist_ok=True)
+            os.makedirs(os.path.join(out_dir, "logs"), exist_ok=True)
+            group = {"out_dir": out_dir, "model": model, "remaining": 0, "failed": 0}
+            groups[(config, model)] = group
+            for sample in samples:
+                if os.path.isfile(os.path.join(out_dir, "summaries", f"{sample}.csv")):
+                    continue
+                group["remaining"] += 1
+                duration = float(sentences[sample].column("duration").sum())
+                jobs.append({
+                    "name": f"{config}/{model}/{sample}",
+                    "model": model,
+                    "config": config,
+                    "sample": sample,
+                    "out_dir": out_dir,
+                    "duration": duration
+                })
+                segmentation.setdefault(sample, {})[config] = duration
+            if group["remaining"] == 0:
+                merge_summaries(args, out_dir, model, samples)
+
+    def test_asr_command(sample, config, out_dir, log_name):
+        return [
+            sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), "test_asr.py"),
+            "-t", textgrids[sample],
+            "-f", audio_files[sample],
+            "-o", out_dir,
+            "--marks-cache", args.marks_cache,
+            "--log-file", os.path.join(out_dir, "logs", f"{log_name}.log")
+        ] + CONFIGS[config] + args.test_args
+
+    def run_segmentation(job, worker):
+        # The configurations of an inquiry are segmented in sequence in the same --audio-out-dir
+        # (each one only adds the segments that do not exist)
+        job["ok"] = True
+        for config in job["configs"]:
+            config_dir = os.path.join(args.out_root, config)
+            command = test_asr_command(job["sample"], config, config_dir, f"segmentation_{job['sample']}")
+            command.append("--segment-only")
+            logging.debug(" ".join(command))
+            with open(os.path.join(config_dir, "logs", f"segmentation_{job['sample']}.txt"), 'w') as fp:
+                if subprocess.run(command, stdout=fp, stderr=subprocess.STDOUT).returncode != 0:
+                    job["ok"] = False
+                    break
+        return job["ok"]
+
+    def run_job(job, worker):
+        out_dir = job["out_dir"]
+        runtime_file = os.path.join(out_dir, "logs", f"{job['sample']}.runtime.json")
+        command = test_asr_command(job["sample"], job["config"], out_dir, job["sample"]) + [
+            "-m", job["model"],
+            "--partial-summary", os.path.join(out_dir, "summaries", f"{job['sample']}.csv"),
+            "--runtime-file", runtime_file,
+            "--skip-audio-segmentation"
+        ]
+        if args.devices is not None:
+            command += ["-d", str(args.devices[worker % len(args.devices)])]
+        logging.debug(" ".join(command))
+        with open(os.path.join(out_dir, "logs", f"{job['sample']}.txt"), 'w') as fp:
+            if subprocess.run(command, stdout=fp, stderr=subprocess.STDOUT).returncode != 0:
+                return False
+        # The model loading time of the job is recorded apart from its inference time
+        with open(runtime_file, encoding='utf8') as fp:
+            return True, json.load(fp)["load_s"]
+
+    groups_lock = threading.Lock()
+
+    def on_finish(job):
+        with groups_lock:
+            group = groups[(job["config"], job["model"])]
+            group["remaining"] -= 1
+            if not os.path.isfile(os.path.join(job["out_dir"], "summaries", f"{job['sample']}.csv")):
+                group["failed"] += 1
+            if group["remaining"] > 0:
+                return
+        if group["failed"] > 0:
+            logging.error(f"{group['failed']} jobs of {group['out_dir']} failed. The summary was not generated.")
+        else:
+            merge_summaries(args, group["out_dir"], group["model"], samples)
+
+    runtimes_file = args.runtimes_file or os.path.join(args.out_root, "runtimes.json")
+    estimator = scheduler.RuntimeEstimator(runtimes_file)
+    # Each inquiry is segmented once before its jobs, which then run in parallel reading the segments
+    segmentation_jobs = [{
+        "name": f"segmentation/{sample}",
+        "model": "segmentation",
+        "sample": sample,
+        "configs": list(configs),
+        "duration": sum(configs.values())
+    } for sample, configs in segmentation.items()]
+    print("Segmenting the audios", flush=True)
+    # Kept apart, so the segmentation times are not used to estimate models without jobs
+    segmentation_estimator = scheduler.RuntimeEstimator(os.path.splitext(runtimes_file)[0] + "_segmentation.json")
+    scheduler.run_jobs(segmentation_jobs, args.workers, segmentation_estimator, run_segmentation)
+    failed = 0
+    for job in segmentation_jobs:
+        if job["ok"]:
+            continue
+        logging.error(f"The segmentation of {job['sample']} failed. Its jobs will not be executed.")
+        for asr_job in [j for j in jobs if j["sample"] == job["sample"]]:
+            jobs.remove(asr_job)
+            group = groups[(asr_job["config"], asr_job["model"])]
+            group["remaining"] -= 1
+            group["failed"] += 1
+            failed += 1
+            if group["remaining"] == 0:
+                logging.error(f"{group['failed']} jobs of {group['out_dir']} failed. The summary was not generated.")
+
+    print("Running the tests", flush=True)
+    failed += scheduler.run_jobs(jobs, args.workers, estimator, run_job, on_finish)
+    if failed > 0:
+        logging.error(f"{failed} jobs failed. See the logs directory of each output directory.")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser("Executa o test_asr.py para vários modelos e configurações de sentenças. "
+                                     "Cada (modelo, áudio, configuração) é um job. Os jobs com maior tempo estimado "
+                                     "(duração das sentenças x fator de tempo real de cada modelo) são executados "
+                                     "primeiro em --workers processos, e as estimativas e o ETA são atualizados a "
+                                     "cada job concluído. Cada áudio é segmentado uma única vez em --audio-out-dir antes "
+                                     "dos seus jobs. Cada job é um processo do test_asr.py que carrega o modelo "
+                                     "novamente, e esse tempo é medido e separado do tempo de inferência nas "
+                                     "estimativas. "
+                                     "Argumentos desconhecidos são repassados ao test_asr.py.")
+    parser.add_argument("--audio-files", "-f",
+                        nargs="+",
+                        help="Arquivos de áudio para processar",
+                        required=True)
+    parser.add_argument("--textgrids", "-t",
+                        nargs="+",
+                        help="Arquivos de textgrid para processar",
+                        required=True)
+    parser.add_argument("--models",
+                        nargs="+",
+                        help="Modelos de ASR",
+                        required=True)
+    parser.add_argument("--configs",
+                        nargs="+",
+                        help="Configurações de sentenças (padrão: todas as do run_tests.sh)",
+                        choices=list(CONFIGS),
+                        default=list(CONFIGS))
+    parser.add_argument("--out-root", "-o",
+                        help="Diretório de saída ({out-root}/{configuração}/{modelo})",
+                        default="./output")
+    parser.add_argument("--workers", "-w",
+                        help="Número de jobs executados ao mesmo tempo",
+                        type=int,
+                        default=1)
+    parser.add_argument("--devices",
+                        nargs="+",
+                        type=int,
+                        help="Device de cada worker (distribuídos em ordem, ex: \"0 1\" para duas GPUs)")
+    parser.add_argument("--runtimes-file",
+                        help="Arquivo JSON com os tempos dos jobs concluídos, usado nas estimativas "
+                             "(padrão: {out-root}/runtimes.json)")
+    parser.add_argument("--log-level", "-L",
+                        help="Nível de log",
+                        choices=["DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL"],
+                        default="INFO")
+    parser.add_argument("--ptbr",
+                        help="Usa o separador de ponto-e-virgula (;) e o formato de número em PT-BR (XX,XX)",
+                        action="store_true")
+    args, test_args = parser.parse_known_args()
+    args.test_args = test_args + (["--ptbr"] if args.ptbr else [])
+    # Marks of the TextGrids classified once for all the configurations
+    args.marks_cache = os.path.join(args.out_root, "marks.json")
+
+    logging.basicConfig(format="%(levelname)s:%(filename)s:%(lineno)s:%(message)s",
+                        level=args.log_level)
+    assert len(args.audio_files) == len(args.textgrids), (
+        "The list of audio files and textgrids must be the same size. "
+        f"audio_files={len(args.audio_files)}, textgrids={len(args.textgrids)}"
+    )
+
+    main(args)
@@ -1,3 +1,9 @@
+# Runs every model and sentence configuration sequentially, one test_asr.py per (configuration, model).
+# run_sweep.py runs the same configurations as one job per (configuration, model, inquiry), in parallel
+# workers and longest first, e.g.:
+#   python run_sweep.py -t $TEXTGRIDS -f $AUDIO_FILES --models $MODELS --workers 2 --devices 0 1 --ptbr \
+#       --metrics wer mer wil cer --average-from-sentences --generate-word-timestamps --generate-char-timestamps
+
 TEXTGRIDS="
     NURCSP_CM_v3/SP_D2_062.TextGrid
     NURCSP_CM_v3/SP_D2_255.TextGrid
@@ -60,6 +66,7 @@ run() {
             python3 test_asr.py \
                 -t $TEXTGRIDS \
                 -f $AUDIO_FILES \
+                --marks-cache ./output/marks.json \
                 -o ./output/accept_all/${model}/ \
                 --save-sentences-json-dir ./output/accept_all \
                 --save-skipped-sentences-json-dir ./output/accept_all \
@@ -80,6 +87,7 @@ run() {
             python3 test_asr.py \
                 -t $TEXTGRIDS \
                 -f $AUDIO_FILES \
+                --marks-cache ./output/marks.json \
                 -o ./output/ignore_all/${model}/ \
                 --save-sentences-json-dir ./output/ignore_all \
                 --save-skipped-sentences-json-dir ./output/ignore_all \
@@ -104,6 +112,7 @@ run() {
                 python3 test_asr.py \
                     -t $TEXTGRIDS \
                     -f $AUDIO_FILES \
+                    --marks-cache ./output/marks.json \
                     -o "./output/ignore_${ignop// /_}/${model}" \
                     --save-sentences-json-dir "./output/ignore_${ignop// /_}" \
                     --save-skipped-sentences-json-dir "./output/ignore_${ignop// /_}" \
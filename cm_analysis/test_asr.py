@@ -1,9 +1,10 @@
 import os
 import json
+import time
 import logging
+import concurrent.futures
 
 import jiwer 
-import textgrid
 import pandas as pd
 import numpy as np
 from tqdm import tqdm
@@ -17,373 +18,780 @@ from transformers import (
     Wav2Vec2CTCTokenizer
 )
 
-from common import parse_textgrids, audio_segmentation, audio_preprocessing
+from common.workers import BoundedExecutor
+from common.manifest import Manifest
+from common.tables import ColumnTable, RESULT_SCHEMA, WORD_TIMESTAMP_SCHEMA
+from common import parse_textgrids, audio_segmentation, audio_preprocessing, audio_regions, tier_index, aggregate_results, sharding, logit_store, lm_decoding, segment_archive, adaptive_chunking
 
 
 def main(args):
     logging.info("Analysing TextGrid files")
     corpus_sentences, corpus_new_textgrids = parse_textgrids.parse_textgrids(args)
-    logging.info("Starting audio segmentation")
-    audio_segmentation.segment_raw_audios(args, corpus_sentences)
-    run_test(args, corpus_sentences, corpus_new_textgrids)
+    if args.decode_from_logits is None and not args.skip_audio_segmentation:
+        logging.info("Starting audio segmentation")
+        audio_segmentation.segment_raw_audios(args, corpus_sentences)
+    if args.segment_only:
+        return
+    if args.models is not None:
+        run_comparison(args, corpus_sentences)
+    elif args.devices is not None:
+        logging.info(f"Running {len(args.devices)} shards on the devices {args.devices}")
+        summary = []
+        results_files = []
+        for shard_summary, shard_results_files in sharding.run_sharded(
+            args, run_shard, corpus_sentences, corpus_new_textgrids, args.devices, args.threads_per_worker
+        ):
+            summary += shard_summary
+            results_files += shard_results_files
+        report_results(args, summary, results_files)
+    else:
+        run_test(args, corpus_sentences, corpus_new_textgrids)
 
-def run_test(args, corpus_sentences, corpus_new_textgrids):
+
+def pad_audio(audio, sample_rate):
+    """
+    Pads segments shorter than one second. Returns the audio and the
+    padding added before it (in seconds).
+    """
+    if len(audio) < sample_rate:
+        audio = np.pad(audio, 
+                       pad_width=sample_rate, 
+                       constant_values=0)  # Evita problemas de alocação se o áudio for muito curto
+        return audio, 1.0
+    return audio, 0.0
+
+
+def infer(asr, audio, duration, args, return_timestamps="word"):
+    if duration > args.max_duration:
+        return asr(audio, 
+                   chunk_length_s=10, 
+                   stride_length_s=(4, 2), 
+                   return_timestamps=return_timestamps)
+    return asr(audio, 
+               return_timestamps=return_timestamps)
+
+
+def calculate_metrics(args, sentence, prediction):
+    """
+    Metrics selected in args.metrics (-1 for the others). Accepts a single
+    sentence or lists of sentences and predictions.
+    """
+    metrics = {"wer": -1, "mer": -1, "wil": -1, "cer": -1}
+    for metric, function in (("wer", jiwer.wer), ("mer", jiwer.mer), ("wil", jiwer.wil), ("cer", jiwer.cer)):
+        if 'all' in args.metrics or metric in args.metrics:
+            metrics[metric] = function(sentence, prediction)
+    return metrics
+
+
+def score_sentence(args, sample_results, i):
+    result = sample_results[i]
+    sentence_audio_path = result["path"]
+    try:
+        logging.info(f"Calculating metrics {sentence_audio_path}")
+        metrics = calculate_metrics(args, result["sentence"], result["prediction"])
+        sample_results.set(i, **metrics)
+        logging.debug(
+            f"{sentence_audio_path}:"
+            f"\n\tGT: {result['sentence']}"
+            f"\n\tPR: {result['prediction']}"
+            f"\n\tWER: {metrics['wer']}"
+            f"\n\tMER: {metrics['mer']}"
+            f"\n\tWIL: {metrics['wil']}"
+            f"\n\tCER: {metrics['cer']}"
+        )
+    except Exception as e:
+        logging.error(f"Error calculating metrics {sentence_audio_path}: {str(e)}")
+
+
+def export_sample(args, sample, sample_results, sentence_jobs, timestamps_word, tiers, new_textgrid,
+                  incremental=None):
+    """
+    Summarizes and exports the results of an inquiry (CSVs and TextGrid)
+    once all of its sentences are scored and returns its summary row. With
+    --incremental, `incremental` is (manifest, interval hashes, segment
+    outputs) and the manifest of the inquiry is updated after the export.
+    """
+    concurrent.futures.wait(sentence_jobs)
+
+    sentences = sample_results.column("sentence").tolist()
+    predictions = sample_results.column("prediction").tolist()
+    totals = {"wer": -1, "mer": -1, "wil": -1, "cer": -1}
+    try:
+        logging.info(f"Calculating metrics of {sample}")
+        totals = calculate_metrics(args, sentences, predictions)
+    except Exception as e:
+        logging.error(f"Unable to calculate metrics for {sample}: {str(e)}")
+
+    if args.average_from_sentences:
+        total_audio_sentences = len(sample_results)
+        row = {"SAMPLE": sample}
+        for metric in ("wer", "mer", "wil", "cer"):
+            values = sample_results.column(metric)
+            avg = values[values >= 0].sum()/total_audio_sentences
+            row[f"AVG {metric.upper()}"] = avg
+            logging.info(f"AVG   {metric.upper()} {sample}: {avg}")
+            logging.info(f"TOTAL {metric.upper()} {sample}: {totals[metric]}")
+        for metric in ("wer", "mer", "wil", "cer"):
+            row[f"TOTAL {metric.upper()}"] = totals[metric]
+    else:
+        row = {
+            "SAMPLE": sample,
+            "WER": totals["wer"],
+            "MER": totals["mer"],
+            "WIL": totals["wil"],
+            "CER": totals["cer"]
+        }
+
+    logging.info(f"Exporting results of {sample}")
+    sample_results_pd = sample_results.to_frame()
+    sample_results_pd.to_csv(
+        os.path.join(args.out_dir, f"{sample}_results_{args.model.replace('/', '_')}.csv"),
+        sep=';' if args.ptbr else ',',
+        decimal=',' if args.ptbr else None,
+        index=False
+    )
+    timestamps_word.to_frame().to_csv(
+        os.path.join(args.out_dir, f"{sample}_timestamps_word_dicts_{args.model.replace('/', '_')}.csv"),
+        sep=';' if args.ptbr else ',',
+        decimal=',' if args.ptbr else None,
+        index=False
+    )
+    # Char timestamps are exported only in the TextGrid (a CSV requires to much space!)
+    if args.log_level in ('INFO', 'DEBUG') and not args.no_tables:
+        print(f"Results of {sample}:")
+        print(tabulate(
+            sample_results_pd.drop("timestamps", axis=1), headers='keys', tablefmt='psql', maxcolwidths=45)
+        )
+
+    for tier in tiers:
+        new_textgrid.tiers.append(tier.to_tier())
+    logging.info(f"Exporting texgrid of {sample}: {os.path.join(args.out_dir, sample + '.TextGrid')}")
+    new_textgrid.write(os.path.join(args.out_dir, sample + '.TextGrid'))
+
+    if incremental is not None:
+        manifest, hashes, outputs = incremental
+        metrics = {}
+        for interval_hash, result in zip(hashes, sample_results):
+            metrics[interval_hash] = {
+                "prediction": result["prediction"],
+                "wer": result["wer"],
+                "mer": result["mer"],
+                "wil": result["wil"],
+                "cer": result["cer"]
+            }
+        logging.info(f"Updating manifest of {sample}")
+        manifest.save(sample, hashes, metrics, outputs)
+    return row
+
+
+def run_test(args, corpus_sentences, corpus_new_textgrids, report=True):
     logging.info("Starting tests...")
-    test_results = {}
+    results_files = []
     summary = []
+    # (sample, results file, future) of the export jobs
+    exports = []
 
-    logging.info(f"Loading model {args.model}")
-    asr = pipeline(model=args.model, device=args.device)
-    if args.phone_model is not None:  # TODO: this is a workaround to get the model to work
-        feature_extractor =  Wav2Vec2FeatureExtractor.from_pretrained(
-            "facebook/wav2vec2-large-960h"
+    asr = phone_model = lm_decoder = None
+    load_start = time.perf_counter()
+    # Created before the acoustic models: the decoder processes are forked with the LM already loaded
+    if args.lm is not None:
+        lm_decoder = lm_decoding.LMDecoder(
+            Wav2Vec2CTCTokenizer.from_pretrained(args.model),
+            args.lm,
+            alpha=args.lm_alpha,
+            beta=args.lm_beta,
+            beam_width=args.lm_beam_width,
+            unigrams_path=args.lm_unigrams,
+            processes=args.lm_processes
         )
-        processor = Wav2Vec2Processor.from_pretrained(args.phone_model)
-        phone_model = Wav2Vec2ForCTC.from_pretrained(args.phone_model)
-        tokenizer = Wav2Vec2CTCTokenizer.from_pretrained(args.phone_model)
-        phone_model = AutomaticSpeechRecognitionPipeline(model=phone_model, tokenizer=tokenizer, feature_extractor=feature_extractor, processor=processor, device=args.device)
+    else:
+        # Models with a language model (ctc_with_lm pipelines) keep it when the
+        # transcriptions are decoded from the logits
+        model_decoder = lm_decoding.model_decoder(args.model)
+        if model_decoder is not None:
+            lm_decoder = lm_decoding.LMDecoder(
+                Wav2Vec2CTCTokenizer.from_pretrained(args.model),
+                beam_width=args.lm_beam_width,
+                processes=args.lm_processes,
+                decoder=model_decoder
+            )
+    if args.decode_from_logits is not None:
+        # Only the tokenizers are needed to decode the stored logits
+        logging.info(f"Loading tokenizer of {args.model}")
+        asr_tokenizer = Wav2Vec2CTCTokenizer.from_pretrained(args.model)
+        if args.phone_model is not None:
+            phone_tokenizer = Wav2Vec2CTCTokenizer.from_pretrained(args.phone_model)
+    else:
+        logging.info(f"Loading model {args.model}")
+        if lm_decoder is not None:
+            # All the segments are decoded by lm_decoder: the pipeline is loaded without the LM of the model
+            asr = pipeline(model=args.model, device=args.device,
+                           feature_extractor=Wav2Vec2FeatureExtractor.from_pretrained(args.model))
+        else:
+            asr = pipeline(model=args.model, device=args.device)
+        asr_tokenizer = asr.tokenizer
+        if args.phone_model is not None:  # TODO: this is a workaround to get the model to work
+            feature_extractor =  Wav2Vec2FeatureExtractor.from_pretrained(
+                "facebook/wav2vec2-large-960h"
+            )
+            processor = Wav2Vec2Processor.from_pretrained(args.phone_model)
+            phone_model = Wav2Vec2ForCTC.from_pretrained(args.phone_model)
+            tokenizer = Wav2Vec2CTCTokenizer.from_pretrained(args.phone_model)
+            phone_model = AutomaticSpeechRecognitionPipeline(model=phone_model, tokenizer=tokenizer, feature_extractor=feature_extractor, processor=processor, device=args.device)
+            phone_tokenizer = tokenizer
+    load_s = time.perf_counter() - load_start
 
     pre_process_audio = audio_preprocessing.get_preprocessing_function(args.model, args.sample_rate)
+    chunk_length_s = None
+    if asr is not None and (args.chunking == "adaptive" or args.compare_chunking):
+        chunk_length_s = adaptive_chunking.efficient_chunk_length(asr) if args.chunk_length == "auto" \
+            else args.chunk_length
+    # Scoring and file export run in background threads, between the inferences
+    workers = BoundedExecutor(args.export_workers, args.export_queue_size)
+
+    # Interval hashes and outputs of the last run (--incremental)
+    manifest = Manifest(args, chunk_length_s) if args.incremental else None
+    previous_summary = manifest.load_summary() if manifest is not None else {}
+
+    # Logit store of the current inquiry ({"model": ..., "phones": ...})
+    logits_files = {}
+    # Packed segments of the current inquiry (--segment-archive)
+    archive = {}
+
+    def load_segment(sentence_audio_path):
+        key = os.path.basename(sentence_audio_path)
+        if "segments" not in archive or key not in archive["segments"]:
+            # Without --segment-archive, or segments that are not in the archive (WAV files)
+            return pre_process_audio(sentence_audio_path)
+        audio = archive["segments"].get(key)
+        if audio_preprocessing.needs_gain_normalization(args.model):
+            audio = audio_preprocessing.normalize_gain(audio)
+        return audio
+
+    def frame_duration(name):
+        if name in logits_files:
+            return logits_files[name].index["time_per_frame"]
+        model = asr if name == "model" else phone_model
+        return logit_store.get_time_per_frame(model.model.config, model.feature_extractor.sampling_rate)
+
+    def get_windows(audio, duration, chunking):
+        if duration <= args.max_duration:
+            return None
+        if chunking == "adaptive":
+            return adaptive_chunking.adaptive_windows(audio, int(args.sample_rate), chunk_length_s,
+                                                      align_to=asr.model.config.inputs_to_logits_ratio)
+        return logit_store.fixed_windows(len(audio), int(args.sample_rate), 10, (4, 2),
+                                         asr.model.config.inputs_to_logits_ratio)
+
+    def get_logits(sentence_audio_path, duration):
+        key = os.path.basename(sentence_audio_path)
+        phone_logits = None
+        if args.decode_from_logits is not None:
+            logging.debug(f"Loading stored logits of {key}")
+            logits, pad_sec = logits_files["model"].get(key)
+            if "phones" in logits_files:
+                phone_logits, _ = logits_files["phones"].get(key)
+            return logits, phone_logits, pad_sec
+
+        logging.debug(f"Preprocessing segment {sentence_audio_path}")
+        audio, pad_sec = pad_audio(load_segment(sentence_audio_path), args.sample_rate)
+        # A single forward pass gives both the word and the char timestamps, and the
+        # phone model runs on the same windows and input values
+        windows = get_windows(audio, duration, args.chunking)
+        models = [asr]
+        if args.phone_model is not None and (args.save_logits is not None or args.generate_char_timestamps):
+            models.append(phone_model)
+        models_logits = logit_store.compute_logits_shared(models, audio, windows=windows, batch_size=args.chunk_batch_size)
+        logits = models_logits[0]
+        if len(models_logits) > 1:
+            phone_logits = models_logits[1]
+        if args.save_logits is not None:
+            logits_files["model"].add(key, logits, pad_sec)
+            if phone_logits is not None:
+                logits_files["phones"].add(key, phone_logits, pad_sec)
+        return logits, phone_logits, pad_sec
+
+    def decode(logits, phone_logits, pad_sec, lm_output=None):
+        output_char_ts = output_phones_ts = None
+        if lm_output is not None:
+            output_word_ts = lm_output["word"]
+            output_char_ts = lm_output["char"]
+        else:
+            output_word_ts = logit_store.decode_logits(asr_tokenizer, logits, frame_duration("model"), "word")
+            if args.generate_char_timestamps:
+                output_char_ts = logit_store.decode_logits(asr_tokenizer, logits, frame_duration("model"), "char")
+        if args.generate_char_timestamps and phone_logits is not None:
+            output_phones_ts = logit_store.decode_logits(phone_tokenizer, phone_logits, frame_duration("phones"), "char")
+        return {
+            "word": output_word_ts,
+            "char": output_char_ts,
+            "phones": output_phones_ts,
+            "pad_sec": pad_sec
+        }
+
+    def transcribe(sentence_audio_path, duration):
+        if duration > args.max_duration:
+            logging.debug(f"Maximum duration detected in the segment: {sentence_audio_path}"
+                          f"({duration} seconds). Using windowing technique.")
+        # The word and char timestamps are decoded from the same logits (the windows
+        # and strides are the ones of the pipeline), so the model runs only once
+        if args.save_logits is not None or args.decode_from_logits is not None \
+                or (args.chunking == "adaptive" and duration > args.max_duration) \
+                or args.generate_char_timestamps:
+            return decode(*get_logits(sentence_audio_path, duration))
+
+        logging.debug(f"Preprocessing segment {sentence_audio_path}")
+        audio, pad_sec = pad_audio(load_segment(sentence_audio_path), args.sample_rate)
+        return {
+            "word": infer(asr, audio, duration, args, return_timestamps="word"),
+            "char": None,
+            "phones": None,
+            "pad_sec": pad_sec
+        }
+
+    def compare_chunking(sentence_audio_path, duration, sentence):
+        """
+        Transcribes a long segment with the fixed and the adaptive windows
+        and returns the audio processed, the time and the WER of each one.
+        """
+        audio, _ = pad_audio(load_segment(sentence_audio_path), args.sample_rate)
+        row = {"path": sentence_audio_path, "duration": duration}
+        for chunking in ("fixed", "adaptive"):
+            windows = get_windows(audio, duration, chunking)
+            start = time.perf_counter()
+            logits = logit_store.compute_logits(asr, audio, windows=windows)
+            row[f"time {chunking}"] = time.perf_counter() - start
+            row[f"processed {chunking}"] = adaptive_chunking.processed_ratio(windows, len(audio))
+            if lm_decoder is not None:
+                output = lm_decoder.decode_batch([logits], frame_duration("model"))[0]["word"]
+            else:
+                output = logit_store.decode_logits(asr_tokenizer, logits, frame_duration("model"), "word")
+            row[f"prediction {chunking}"] = output["text"]
+            try:
+                row[f"wer {chunking}"] = jiwer.wer(sentence, row[f"prediction {chunking}"])
+            except Exception as e:
+                logging.error(f"Error calculating metrics {sentence_audio_path} ({chunking} chunking): {str(e)}")
+                row[f"wer {chunking}"] = -1
+        return row
+
+    def lm_transcribe(sample, cached_outputs):
+        """
+        Transcribes all the segments of an inquiry (except the ones in
+        cached_outputs) with the language model: the logits are computed (or
+        loaded) first and then decoded as one batch in the decoder processes.
+        """
+        if args.dedup_overlaps:
+            segments = [(audio_regions.region_audio_path(args.audio_out_dir, sample, region), region["duration"])
+                        for region in audio_regions.index_regions(corpus_sentences[sample])]
+        else:
+            segments = [(os.path.join(args.audio_out_dir, f"{sample}_{r['start_sec']}_{r['end_sec']}.wav"), r["duration"])
+                        for r in corpus_sentences[sample]]
+        segments = [(path, duration) for path, duration in segments if os.path.basename(path) not in cached_outputs]
+        segments_logits = [get_logits(path, duration) for path, duration in segments]
+        logging.info(f"Decoding {len(segments)} segments of {sample} with the language model")
+        lm_outputs = lm_decoder.decode_batch(
+            [logits for logits, _, _ in segments_logits], frame_duration("model"), args.generate_char_timestamps
+        )
+        return {
+            path: decode(*segment_logits, lm_output=lm_output)
+            for (path, _), segment_logits, lm_output in zip(segments, segments_logits, lm_outputs)
+        }
+
+    def open_logits_files(sample):
+        logits_files.clear()
+        models = {"model": asr}
+        if args.phone_model is not None:
+            models["phones"] = phone_model
+        for name, model in models.items():
+            if args.decode_from_logits is not None:
+                logits_files[name] = logit_store.LogitReader(args.decode_from_logits, sample, name)
+            else:
+                logits_files[name] = logit_store.LogitWriter(
+                    args.save_logits, sample, name,
+                    logit_store.get_time_per_frame(model.model.config, model.feature_extractor.sampling_rate),
+                    dtype=args.logits_dtype,
+                    k=args.logits_topk
+                )
 
     for audio_file in tqdm(args.audio_files):
         sample = os.path.splitext(os.path.basename(audio_file))[0]
         logging.info(f"Processing audio {sample}")
-        
-        predictions = []
-        sentences = []
-        wers = cers = mers = wils = 0
-        test_results[sample] = []
+        results_file = os.path.join(args.out_dir, f"{sample}_results_{args.model.replace('/', '_')}.csv")
 
-        timestamps_word_dicts = []
-        timestamps_char_dicts = []
+        hashes = None
+        cached_outputs = {}
+        cached_metrics = {}
+        if manifest is not None:
+            previous = manifest.load(sample)
+            hashes = manifest.hashes(corpus_sentences[sample])
+            if hashes == previous["hashes"] and sample in previous_summary and os.path.isfile(results_file) \
+                    and os.path.isfile(os.path.join(args.out_dir, sample + '.TextGrid')):
+                logging.info(f"{sample} did not change since the last run. Reusing its results.")
+                summary.append(previous_summary[sample])
+                results_files.append(results_file)
+                continue
+            changed, removed = manifest.diff(previous, hashes)
+            logging.info(f"{sample}: {changed} new or changed intervals, {removed} removed intervals")
+            cached_outputs = previous["outputs"]
+            cached_metrics = previous["metrics"]
+            new_outputs = {}
+
+        sample_results = ColumnTable(RESULT_SCHEMA)
+        sentence_jobs = []
+        if args.save_logits is not None or args.decode_from_logits is not None:
+            open_logits_files(sample)
+        archive.clear()
+        if args.segment_archive:
+            if segment_archive.archive_exists(args.audio_out_dir, sample):
+                archive["segments"] = segment_archive.SegmentArchiveReader(args.audio_out_dir, sample)
+            else:
+                logging.warning(f"There is no segment archive of {sample} in {args.audio_out_dir}. "
+                                f"Reading the WAV files of the segments.")
+
+        sample_timestamps_word = ColumnTable(WORD_TIMESTAMP_SCHEMA)
 
         sample_start_sec = corpus_new_textgrids[sample].minTime
         sample_end_sec = corpus_new_textgrids[sample].maxTime
 
-        transcription_tier = textgrid.IntervalTier(
-            name="Transcription",
-            minTime=sample_start_sec,
-            maxTime=sample_end_sec
-        )
-        timestamps_word_tier = textgrid.IntervalTier(
-            name="TimestampsWords",
-            minTime=sample_start_sec,
-            maxTime=sample_end_sec
-        )
-        timestamps_char_tier = textgrid.IntervalTier(
-            name="TimestampsChar",
-            minTime=sample_start_sec,
-            maxTime=sample_end_sec
-        )
+        transcription_tier = tier_index.TierIndex("Transcription", sample_start_sec, sample_end_sec)
+        timestamps_word_tier = tier_index.TierIndex("TimestampsWords", sample_start_sec, sample_end_sec)
+        timestamps_char_tier = tier_index.TierIndex("TimestampsChar", sample_start_sec, sample_end_sec)
         if args.phone_model is not None:
-            phones_tier = textgrid.IntervalTier(
-                name="Phones",
-                minTime=sample_start_sec,
-                maxTime=sample_end_sec
-            )
-            timestamps_phones_tier = textgrid.IntervalTier(
-                name="TimestampsPhones",
-                minTime=sample_start_sec,
-                maxTime=sample_end_sec
-            )
+            phones_tier = tier_index.TierIndex("Phones", sample_start_sec, sample_end_sec)
+            timestamps_phones_tier = tier_index.TierIndex("TimestampsPhones", sample_start_sec, sample_end_sec)
+
+        chunking_rows = []
+        if args.dedup_overlaps:
+            # Identical or nested ranges (e.g. overlapping speakers) are transcribed once
+            sentence_regions = audio_regions.sentence_regions(corpus_sentences[sample])
+            region_outputs = {}
+        lm_outputs = lm_transcribe(sample, cached_outputs) if lm_decoder is not None else {}
 
-        for r in tqdm(corpus_sentences[sample], leave=False) if not args.log_level == "DEBUG" else corpus_sentences[sample]:
+        for i, r in enumerate(tqdm(corpus_sentences[sample], leave=False) if not args.log_level == "DEBUG" else corpus_sentences[sample]):
             start_sec = r["start_sec"]
             end_sec = r["end_sec"]
             duration = r["duration"]
-                   
-            sentence_audio_path = os.path.join(
-                args.audio_out_dir, 
-                f"{sample}_{start_sec}_{end_sec}.wav"
-            )
-            logging.debug(f"Preprocessing segment {sentence_audio_path}")
-            audio = pre_process_audio(sentence_audio_path)
-            if len(audio) < args.sample_rate:
-                logging.debug(f"Adding padding to the segment {sentence_audio_path}")
-                audio = np.pad(audio, 
-                               pad_width=args.sample_rate, 
-                               constant_values=0)  # Evita problemas de alocação se o áudio for muito curto
+
+            if args.dedup_overlaps:
+                region = sentence_regions[i]
+                sentence_audio_path = audio_regions.region_audio_path(args.audio_out_dir, sample, region)
+            else:
+                sentence_audio_path = os.path.join(
+                    args.audio_out_dir, 
+                    f"{sample}_{start_sec}_{end_sec}.wav"
+                )
             sentence = r["text"]
-            sentences.append(sentence)
             mark = r["mark"]
 
-            if duration > args.max_duration:
-                logging.debug(f"Maximum duration detected in the segment: {sentence_audio_path}"
-                              f"({duration} seconds). Using windowing technique.")
-                output_word_ts = asr(audio, 
-                                     chunk_length_s=10, 
-                                     stride_length_s=(4, 2), 
-                                     return_timestamps="word")
-                if args.generate_char_timestamps:  # TODO: we need to infer another time just to get the char timestamps?
-                    output_char_ts = asr(audio, 
-                                        chunk_length_s=10, 
-                                        stride_length_s=(4, 2), 
-                                        return_timestamps="char")
-                    if args.phone_model is not None:
-                        output_phones_ts = phone_model(audio, 
-                                                    chunk_length_s=10, 
-                                                    stride_length_s=(4, 2), 
-                                                    return_timestamps="char")
-            elif duration > 0:
-                output_word_ts = asr(audio, 
-                                     return_timestamps="word")
-                if args.generate_char_timestamps:
-                    output_char_ts = asr(audio, 
-                                        return_timestamps="char")
-                    if args.phone_model is not None:
-                        output_phones_ts = phone_model(audio, 
-                                                    return_timestamps="char")
-                                     
+            segment_key = os.path.basename(sentence_audio_path)
+            if sentence_audio_path in lm_outputs:
+                outputs = lm_outputs[sentence_audio_path]
+            elif args.dedup_overlaps and sentence_audio_path in region_outputs:
+                logging.debug(f"Reusing transcription of region {sentence_audio_path}")
+                outputs = region_outputs[sentence_audio_path]
+            elif segment_key in cached_outputs:
+                logging.debug(f"Reusing transcription of {sentence_audio_path} from the last run")
+                outputs = cached_outputs[segment_key]
+            else:
+                outputs = transcribe(sentence_audio_path, region["duration"] if args.dedup_overlaps else duration)
+                if args.dedup_overlaps:
+                    region_outputs[sentence_audio_path] = outputs
+            if manifest is not None:
+                new_outputs[segment_key] = outputs
+
+            if args.dedup_overlaps and not audio_regions.is_same_range(region, start_sec, end_sec):
+                # Sentence nested in a larger region: keeps only its own chunks
+                offset_start = start_sec - region["start_sec"] + outputs["pad_sec"]
+                offset_end = end_sec - region["start_sec"] + outputs["pad_sec"]
+                outputs = {
+                    "word": audio_regions.slice_output(outputs["word"], offset_start, offset_end),
+                    "char": audio_regions.slice_output(outputs["char"], offset_start, offset_end, separator="")
+                            if outputs["char"] is not None else None,
+                    "phones": audio_regions.slice_output(outputs["phones"], offset_start, offset_end, separator="")
+                              if outputs["phones"] is not None else None,
+                    "pad_sec": 0.0
+                }
+
+            if chunk_length_s is not None and args.compare_chunking and duration > args.max_duration \
+                    and (not args.dedup_overlaps or audio_regions.is_same_range(region, start_sec, end_sec)):
+                chunking_rows.append(compare_chunking(sentence_audio_path, duration, sentence))
+
+            output_word_ts = outputs["word"]
+            output_char_ts = outputs["char"]
+            output_phones_ts = outputs["phones"]
+
             timestamps_word = output_word_ts["chunks"]
             if args.generate_char_timestamps:
                 timestamps_char = output_char_ts["chunks"]
-                timestamps_phones = output_phones_ts["chunks"]
+                if args.phone_model is not None:
+                    timestamps_phones = output_phones_ts["chunks"]
            
             output = output_word_ts
             prediction = output["text"]
-            predictions.append(prediction)
 
             if args.phone_model is not None and args.generate_char_timestamps:
                 phones = output_phones_ts["text"]
             else:
                 phones = ""
 
-            if start_sec == sample_start_sec:
-                start_sec += 0.000000000001
-            if end_sec == sample_end_sec:
-                end_sec -= 0.000000000001
-            try:
-                transcription_tier.add(minTime=start_sec, maxTime=end_sec, mark=prediction)
-                if args.phone_model is not None:
-                    phones_tier.add(minTime=start_sec, maxTime=end_sec, mark=phones)
-            except Exception as e:
-                logging.error(f"Could not add textgrid item ({r}): {str(e)}")
+            # Bounds and overlaps are resolved when the tiers are built
+            transcription_tier.add(start_sec, end_sec, prediction)
+            if args.phone_model is not None:
+                phones_tier.add(start_sec, end_sec, phones)
 
-            try:
-                logging.info(f"Calculating metrics {sentence_audio_path}")
-
-                wer = cer = mer = wil = -1
-                if 'all' in args.metrics or 'wer' in args.metrics:
-                    wer = jiwer.wer(sentence, prediction)
-                    wers += wer
-                if 'all' in args.metrics or 'mer' in args.metrics:
-                    mer = jiwer.mer(sentence, prediction)
-                    mers += mer
-                if 'all' in args.metrics or 'wil' in args.metrics:
-                    wil = jiwer.wil(sentence, prediction)
-                    wils += wil
-                if 'all' in args.metrics or 'cer' in args.metrics:
-                    cer = jiwer.cer(sentence, prediction)
-                    cers += cer
-
-                logging.debug(
-                    f"{sentence_audio_path}:"
-                    f"\n\tGT: {sentence}"
-                    f"\n\tPR: {prediction}"
-                    f"\n\tWER: {wer}"
-                    f"\n\tMER: {mer}"
-                    f"\n\tWIL: {wil}"
-                    f"\n\tCER: {cer}"
-                )
-            except Exception as e:
-                logging.error(f"Error calculating metrics {sentence_audio_path}: {str(e)}")
-            
-            test_results[sample].append({
-                "path": sentence_audio_path,
-                "start_sec": start_sec,
-                "end_sec": end_sec,
-                "mark": mark,
-                "sentence": sentence,
-                "duration": end_sec-start_sec,
-                "prediction": prediction,
-                "phones": phones,
-                "timestamps": timestamps_word,
-                "wer": wer,
-                "mer": mer,
-                "wil": wil,
-                "cer": cer
-            })
-
-            for tp in timestamps_word:
-                if tp["text"].strip() == '':
-                    logging.info(f"Empty timestamp word/char in {sentence_audio_path} at {tp['timestamp'][0]} sec")
-                    continue
-                ts_start_sec = start_sec+tp["timestamp"][0]
-                ts_end_sec = start_sec+tp["timestamp"][1]
-                timestamps_word_dicts.append({
-                    "path": sentence_audio_path,
-                    "tp_text": tp["text"],
-                    "tp_start": tp["timestamp"][0],
-                    "tp_end": tp["timestamp"][1],
-                    "ts_start_sec": ts_start_sec,
-                    "ts_end_sec": ts_end_sec
-                })
-                if ts_start_sec >= end_sec:
-                    logging.debug(f"Timestamp start sec ({ts_end_sec}) is higher than audio ({sentence_audio_path}) end sec: {end_sec}")
-                    ts_start_sec = end_sec-0.000000000001
-                    logging.debug(f"\tNew start sec: {ts_start_sec}")
-                if ts_end_sec >= end_sec:
-                    logging.debug(f"Timestamp end sec ({ts_end_sec}) is higher than audio ({sentence_audio_path}) end sec: {end_sec}")
-                    ts_end_sec = end_sec-0.000000000001
-                    logging.debug(f"\tNew end sec: {ts_end_sec}")
-                try:
-                    timestamps_word_tier.add(minTime=ts_start_sec, maxTime=ts_end_sec, mark=tp["text"])
-                except:
-                    logging.error(f"Trying to add a tier: {timestamps_word_dicts[-1]}")
+            # Unchanged intervals with the same prediction keep the metrics of the last run
+            metrics = {"wer": -1, "mer": -1, "wil": -1, "cer": -1}
+            cached = cached_metrics.get(hashes[i]) if manifest is not None else None
+            if cached is not None and cached["prediction"] == prediction:
+                metrics = {metric: cached[metric] for metric in metrics}
+            sample_results.append(
+                path=sentence_audio_path,
+                start_sec=start_sec,
+                end_sec=end_sec,
+                mark=mark,
+                sentence=sentence,
+                duration=end_sec-start_sec,
+                prediction=prediction,
+                phones=phones,
+                timestamps=str(timestamps_word),  # Same representation written in the CSV
+                **metrics
+            )
+            if cached is None or cached["prediction"] != prediction:
+                sentence_jobs.append(workers.submit(score_sentence, args, sample_results, len(sample_results)-1))
 
+            word_chunks = [tp for tp in timestamps_word if tp["text"].strip() != '']
+            word_ts = np.array([tp["timestamp"] for tp in word_chunks], dtype=np.float64).reshape(-1, 2)
+            sample_timestamps_word.extend(
+                path=[sentence_audio_path]*len(word_chunks),
+                tp_text=[tp["text"] for tp in word_chunks],
+                tp_start=word_ts[:, 0],
+                tp_end=word_ts[:, 1],
+                ts_start_sec=start_sec+word_ts[:, 0],
+                ts_end_sec=start_sec+word_ts[:, 1]
+            )
+            timestamps_word_tier.add_chunks(timestamps_word, start_sec, end_sec)
             if args.generate_char_timestamps:
-                for tp in timestamps_char:
-                    if tp["text"].strip() == '':
-                        logging.info(f"Empty timestamp word/char in {sentence_audio_path} at {tp['timestamp'][0]} sec")
-                        continue
-                    ts_start_sec = start_sec+tp["timestamp"][0]
-                    ts_end_sec = start_sec+tp["timestamp"][1]
-                    timestamps_char_dicts.append({
-                        "path": sentence_audio_path,
-                        "tp_text": tp["text"],
-                        "tp_start": tp["timestamp"][0],
-                        "tp_end": tp["timestamp"][1],
-                        "ts_start_sec": ts_start_sec,
-                        "ts_end_sec": ts_end_sec
-                    })
-                    if ts_start_sec >= end_sec:
-                        logging.debug(f"Timestamp start sec ({ts_end_sec}) is higher than audio ({sentence_audio_path}) end sec: {end_sec}")
-                        ts_start_sec = end_sec-0.000000000001
-                        logging.debug(f"\tNew start sec: {ts_start_sec}")
-                    if ts_end_sec >= end_sec:
-                        logging.debug(f"Timestamp end sec ({ts_end_sec}) is higher than audio ({sentence_audio_path}) end sec: {end_sec}")
-                        ts_end_sec = end_sec-0.000000000001
-                        logging.debug(f"\tNew end sec: {ts_end_sec}")
-                    try:
-                        timestamps_char_tier.add(minTime=ts_start_sec, maxTime=ts_end_sec, mark=tp["text"])
-                    except:
-                        logging.error(f"Trying to add a tier: {timestamps_char_dicts[-1]}")
-
+                timestamps_char_tier.add_chunks(timestamps_char, start_sec, end_sec)
                 if args.phone_model is not None:
-                    for tp in timestamps_phones:
-                        if tp["text"].strip() == '':
-                            logging.info(f"Empty timestamp word/char in {sentence_audio_path} at {tp['timestamp'][0]} sec")
-                            continue
-                        ts_start_sec = start_sec+tp["timestamp"][0]
-                        ts_end_sec = start_sec+tp["timestamp"][1]
-                        if ts_start_sec >= end_sec:
-                            logging.debug(f"Timestamp start sec ({ts_end_sec}) is higher than audio ({sentence_audio_path}) end sec: {end_sec}")
-                            ts_start_sec = end_sec-0.000000000001
-                            logging.debug(f"\tNew start sec: {ts_start_sec}")
-                        if ts_end_sec >= end_sec:
-                            logging.debug(f"Timestamp end sec ({ts_end_sec}) is higher than audio ({sentence_audio_path}) end sec: {end_sec}")
-                            ts_end_sec = end_sec-0.000000000001
-                            logging.debug(f"\tNew end sec: {ts_end_sec}")
-                        try:
-                            timestamps_phones_tier.add(minTime=ts_start_sec, maxTime=ts_end_sec, mark=tp["text"])
-                        except Exception as e:
-                            logging.error(f"Trying to add a timestamps_phones_tier: {str(e)}")
-
-            sample_timestamps_word_pd = pd.DataFrame(timestamps_word_dicts)
-            sample_timestamps_word_pd.to_csv(
-                os.path.join(args.out_dir, f"{sample}_timestamps_word_dicts_{args.model.replace('/', '_')}.csv"),
+                    timestamps_phones_tier.add_chunks(timestamps_phones, start_sec, end_sec)
+
+        logging.info(f"{sample} audio successfully processed")
+        if len(chunking_rows) > 0:
+            chunking_pd = pd.DataFrame(chunking_rows)
+            chunking_pd.to_csv(
+                os.path.join(args.out_dir, f"{sample}_chunking_comparison.csv"),
                 sep=';' if args.ptbr else ',',
                 decimal=',' if args.ptbr else None,
-                index=False,
-                mode='a'
+                index=False
             )
-            # Requires to much space!
-            # sample_timestamps_char_pd = pd.DataFrame(timestamps_char_dicts)
-            # sample_timestamps_char_pd.to_csv(
-            #     os.path.join(args.out_dir, f"{sample}_timestamps_char_dicts_{args.model.replace('/', '_')}.csv"),
-            #     sep=';' if args.ptbr else ',',
-            #     decimal=',' if args.ptbr else None,
-            #     index=False,
-            #     mode='a'
-            # )
+            for chunking in ("fixed", "adaptive"):
+                logging.info(f"{chunking.capitalize()} chunking of {sample}: "
+                             f"{chunking_pd[f'time {chunking}'].sum():.2f}s, "
+                             f"{(chunking_pd[f'processed {chunking}']*chunking_pd['duration']).sum():.2f}s of audio processed "
+                             f"for {chunking_pd['duration'].sum():.2f}s of segments, "
+                             f"average WER {chunking_pd[f'wer {chunking}'].mean():.4f}")
+        if args.save_logits is not None:
+            for writer in logits_files.values():
+                writer.close()
 
-        logging.info(f"{sample} audio successfully processed")
+        tiers = [transcription_tier, timestamps_word_tier, timestamps_char_tier]
+        if args.phone_model is not None:
+            tiers += [phones_tier, timestamps_phones_tier]
+        exports.append((sample, results_file, workers.submit(
+            export_sample, args, sample, sample_results, sentence_jobs,
+            sample_timestamps_word, tiers, corpus_new_textgrids[sample],
+            (manifest, hashes, new_outputs) if manifest is not None else None
+        )))
 
-        try:
-            logging.info(f"Calculating metrics of {sample}")
-            if 'all' in args.metrics or 'wer' in args.metrics:
-                total_sample_wer = jiwer.wer(sentences, predictions)
-                wers += wer
-            if 'all' in args.metrics or 'mer' in args.metrics:
-                total_sample_mer = jiwer.mer(sentences, predictions)
-            if 'all' in args.metrics or 'wil' in args.metrics:
-                total_sample_wil = jiwer.wil(sentences, predictions)
-            if 'all' in args.metrics or 'cer' in args.metrics:
-                total_sample_cer = jiwer.cer(sentences, predictions)
-        except Exception as e:
-            logging.error(f"Unable to calculate metrics for {sample}: {str(e)}")
-
-        total_audio_sentences = len(test_results[sample])
-        
-        if args.average_from_sentences:
-            avg_sample_wer = wers/total_audio_sentences
-            avg_sample_mer = mers/total_audio_sentences
-            avg_sample_wil = wils/total_audio_sentences
-            avg_sample_cer = cers/total_audio_sentences
-            summary.append({
-                "SAMPLE": sample,
-                "AVG WER": avg_sample_wer,
-                "AVG MER": avg_sample_mer,
-                "AVG WIL": avg_sample_wil,
-                "AVG CER": avg_sample_cer,
-                "TOTAL WER": total_sample_wer,
-                "TOTAL MER": total_sample_mer,
-                "TOTAL WIL": total_sample_wil,
-                "TOTAL CER": total_sample_cer
-            })
-            logging.info(f"AVG   WER {sample}: {avg_sample_wer}")
-            logging.info(f"TOTAL WER {sample}: {total_sample_wer}")
-            logging.info(f"AVG   MER {sample}: {avg_sample_mer}")
-            logging.info(f"TOTAL MER {sample}: {total_sample_mer}")
-            logging.info(f"AVG   WIL {sample}: {avg_sample_wil}")
-            logging.info(f"TOTAL WIL {sample}: {total_sample_wil}")
-            logging.info(f"AVG   CER {sample}: {avg_sample_cer}")
-            logging.info(f"TOTAL CER {sample}: {total_sample_cer}")
-        else:
-            summary.append({
-                "SAMPLE": sample,
-                "WER": total_sample_wer,
-                "MER": total_sample_mer,
-                "WIL": total_sample_wil,
-                "CER": total_sample_cer
-            })
-    
-        logging.info(f"Exporting results of {sample}")
-        sample_results_pd = pd.DataFrame(test_results[sample])
-        sample_results_pd.to_csv(
-            os.path.join(args.out_dir, f"{sample}_results_{args.model.replace('/', '_')}.csv"),
+    logging.info("Waiting for the scoring and export workers")
+    workers.shutdown()
+    # Inquiries whose export failed are left out of the summary and the aggregation
+    for sample, results_file, future in exports:
+        if future.exception() is not None:
+            logging.error(f"The results of {sample} were not exported and are not in the summary")
+            continue
+        summary.append(future.result())
+        results_files.append(results_file)
+    if lm_decoder is not None:
+        lm_decoder.close()
+    if report and args.runtime_file is not None:
+        # Model loading time of this process (run_sweep.py separates it from the inference time)
+        with open(args.runtime_file, 'w', encoding='utf8') as fp:
+            json.dump({"load_s": load_s}, fp)
+    if report:
+        report_results(args, summary, results_files)
+    return summary, results_files
+
+
+def run_shard(args, corpus_sentences, corpus_new_textgrids):
+    return run_test(args, corpus_sentences, corpus_new_textgrids, report=False)
+
+
+def report_results(args, summary, results_files):
+    order = {os.path.splitext(os.path.basename(f))[0]: i for i, f in enumerate(args.audio_files)}
+    summary.sort(key=lambda row: order[row["SAMPLE"]])
+    results_files.sort(key=lambda f: order[os.path.basename(f).split("_results_")[0]])
+
+    summary_pd = pd.DataFrame(summary)
+    if args.partial_summary is not None:
+        # Merged with the summaries of the other jobs by run_sweep.py
+        summary_pd.to_csv(
+            args.partial_summary,
             sep=';' if args.ptbr else ',',
             decimal=',' if args.ptbr else None,
             index=False
         )
-        if args.log_level in ('INFO', 'DEBUG'):
-            print(f"Results of {sample}:")
-            print(tabulate(
-                sample_results_pd.drop("timestamps", axis=1), headers='keys', tablefmt='psql', maxcolwidths=45)
-            )
+        return
+    summary_pd.loc["AVG"] = summary_pd.mean(numeric_only=True)
+    summary_pd.to_csv(
+        os.path.join(args.out_dir, f"summary.csv"),  # os.path.join(args.out_dir, f"summary_{args.model.replace('/', '_')}.csv"),
+        sep=';' if args.ptbr else ',',
+        decimal=',' if args.ptbr else None,
+        index=False
+    )
 
-        corpus_new_textgrids[sample].tiers.append(transcription_tier)
-        corpus_new_textgrids[sample].tiers.append(timestamps_word_tier)
-        corpus_new_textgrids[sample].tiers.append(timestamps_char_tier)
-        if args.phone_model is not None:
-            corpus_new_textgrids[sample].tiers.append(phones_tier)
-            corpus_new_textgrids[sample].tiers.append(timestamps_phones_tier)
-        logging.info(f"Exporting texgrid of {sample}: {os.path.join(args.out_dir, sample + '.TextGrid')}")
-        corpus_new_textgrids[sample].write(os.path.join(args.out_dir, sample + '.TextGrid'))
+    logging.info("Aggregating results by corpus, genre and duration")
+    aggregation_pd = aggregate_results.aggregate_results(results_files, ptbr=args.ptbr)
+    print(f"{'='*20} FINAL RESULTS {'='*20}")
+    print(f"{args}")
+    aggregate_results.export_aggregation(aggregation_pd, args.out_dir, ptbr=args.ptbr, print_table=not args.no_tables)
+    if not args.no_tables:
+        print(tabulate(summary_pd, headers='keys', tablefmt='psql', maxcolwidths=45))
+
+
+def run_comparison(args, corpus_sentences):
+    """
+    Compares several models on the same segments. Each segment is decoded
+    once and gain-normalized once (only if some model needs it), then
+    transcribed by every model and scored in a single pass. Writes one
+    table per inquiry with the predictions and metrics of all models side
+    by side.
+    """
+    logging.info("Starting model comparison...")
+    models = {}
+    for model in args.models:
+        logging.info(f"Loading model {model}")
+        models[model] = pipeline(model=model, device=args.device)
+    gain_models = {m for m in args.models if audio_preprocessing.needs_gain_normalization(m)}
+    comparison_schema = {
+        "path": "str",
+        "start_sec": "d",
+        "end_sec": "d",
+        "mark": "str",
+        "sentence": "str",
+        "duration": "d"
+    }
+    for model in args.models:
+        comparison_schema[f"prediction {model}"] = "str"
+        for metric in ("wer", "mer", "wil", "cer"):
+            comparison_schema[f"{metric} {model}"] = "d"
+    summary = []
+
+    for audio_file in tqdm(args.audio_files):
+        sample = os.path.splitext(os.path.basename(audio_file))[0]
+        logging.info(f"Processing audio {sample}")
+
+        comparison = ColumnTable(comparison_schema)
+        archive = None
+        if args.segment_archive:
+            if segment_archive.archive_exists(args.audio_out_dir, sample):
+                archive = segment_archive.SegmentArchiveReader(args.audio_out_dir, sample)
+            else:
+                logging.warning(f"There is no segment archive of {sample} in {args.audio_out_dir}. "
+                                f"Reading the WAV files of the segments.")
+
+        def load_audio(path):
+            if archive is not None and os.path.basename(path) in archive:
+                return archive.get(os.path.basename(path))
+            return audio_preprocessing.load_audio(path, args.sample_rate)
+
+        if args.dedup_overlaps:
+            sentence_regions = audio_regions.sentence_regions(corpus_sentences[sample])
+            # Only the audio of the current region is kept in memory
+            region_audio = {"path": None, "audio": None}
+
+        for i, r in enumerate(tqdm(corpus_sentences[sample], leave=False) if not args.log_level == "DEBUG" else corpus_sentences[sample]):
+            if args.dedup_overlaps:
+                region = sentence_regions[i]
+                sentence_audio_path = audio_regions.region_audio_path(args.audio_out_dir, sample, region)
+                if region_audio["path"] != sentence_audio_path:
+                    # Regions are sorted by time within a tier, so a region is
+                    # only read again for nested sentences of another tier
+                    region_audio["audio"] = None
+                    region_audio["audio"] = load_audio(sentence_audio_path)
+                    region_audio["path"] = sentence_audio_path
+                offset = int(args.sample_rate*(r["start_sec"] - region["start_sec"]))
+                audio = region_audio["audio"][offset:offset+int(args.sample_rate*r["duration"])]
+            else:
+                sentence_audio_path = os.path.join(
+                    args.audio_out_dir, 
+                    f"{sample}_{r['start_sec']}_{r['end_sec']}.wav"
+                )
+                audio = load_audio(sentence_audio_path)
+
+            buffers = {False: audio}
+            if len(gain_models) > 0:
+                buffers[True] = audio_preprocessing.normalize_gain(audio)
+
+            sentence = r["text"]
+            row = {
+                "path": sentence_audio_path,
+                "start_sec": r["start_sec"],
+                "end_sec": r["end_sec"],
+                "mark": r["mark"],
+                "sentence": sentence,
+                "duration": r["duration"]
+            }
+            for model, asr in models.items():
+                model_audio, _ = pad_audio(buffers[model in gain_models], args.sample_rate)
+                prediction = infer(asr, model_audio, r["duration"], args)["text"]
+                row[f"prediction {model}"] = prediction
+                metrics = {"wer": -1, "mer": -1, "wil": -1, "cer": -1}
+                try:
+                    metrics = calculate_metrics(args, sentence, prediction)
+                except Exception as e:
+                    logging.error(f"Error calculating metrics {sentence_audio_path} ({model}): {str(e)}")
+                for metric, value in metrics.items():
+                    row[f"{metric} {model}"] = value
+            comparison.append(**row)
+
+        logging.info(f"Exporting comparison of {sample}")
+        comparison_pd = comparison.to_frame()
+        comparison_pd.to_csv(
+            os.path.join(args.out_dir, f"{sample}_comparison.csv"),
+            sep=';' if args.ptbr else ',',
+            decimal=',' if args.ptbr else None,
+            index=False
+        )
+
+        for model in args.models:
+            try:
+                totals = calculate_metrics(args, comparison.column("sentence").tolist(),
+                                           comparison.column(f"prediction {model}").tolist())
+            except Exception as e:
+                logging.error(f"Unable to calculate metrics for {sample} ({model}): {str(e)}")
+                continue
+            result = {"SAMPLE": sample, "MODEL": model}
+            for metric, value in totals.items():
+                if value == -1:
+                    continue
+                if args.average_from_sentences:
+                    values = comparison.column(f"{metric} {model}")
+                    result[f"AVG {metric.upper()}"] = values[values >= 0].sum()/len(values)
+                result[f"TOTAL {metric.upper()}"] = value
+            summary.append(result)
 
     summary_pd = pd.DataFrame(summary)
-    summary_pd.loc["AVG"] = summary_pd.mean()
     summary_pd.to_csv(
-        os.path.join(args.out_dir, f"summary.csv"),  # os.path.join(args.out_dir, f"summary_{args.model.replace('/', '_')}.csv"),
+        os.path.join(args.out_dir, "comparison_summary.csv"),
         sep=';' if args.ptbr else ',',
         decimal=',' if args.ptbr else None,
         index=False
     )
     print(f"{'='*20} FINAL RESULTS {'='*20}")
     print(f"{args}")
-    print(tabulate(summary_pd, headers='keys', tablefmt='psql', maxcolwidths=45))
-    summary_pd = pd.DataFrame(summary)
-    print(tabulate(summary_pd.describe(), headers='keys', tablefmt='psql', maxcolwidths=45))
+    if not args.no_tables:
+        print(tabulate(summary_pd.groupby("MODEL").mean(numeric_only=True), headers='keys', tablefmt='psql', maxcolwidths=45))
 
 
 def prepare_output_dirs(args):
@@ -406,6 +814,10 @@ def prepare_output_dirs(args):
                           "Audio files will not be overwritten.")
     os.makedirs(args.audio_out_dir, exist_ok=True)
 
+    if args.save_logits is not None:
+        logging.info(f"Creating logits directory: {args.save_logits}")
+        os.makedirs(args.save_logits, exist_ok=True)
+
 
 def check_files_list(args):
     assert len(args.audio_files) == len(args.textgrids), (
@@ -421,7 +833,42 @@ def check_files_list(args):
             logging.warning("The names of the files passed are different. "
                             f"Is this correct? Áudio={af}, Texgrid={tf}")
 
+def chunk_length_type(value):
+    return value if value == "auto" else float(value)
+
+
 def check_args(args):
+    assert args.segment_only or (args.model is None) != (args.models is None), (
+        "Pass a single model (--model) or a list of models to compare (--models)."
+    )
+    assert not (args.segment_only and args.skip_audio_segmentation), (
+        "--segment-only and --skip-audio-segmentation cannot be used together."
+    )
+    assert args.save_logits is None or args.decode_from_logits is None, (
+        "--save-logits and --decode-from-logits cannot be used together."
+    )
+    if args.models is not None and (args.save_logits is not None or args.decode_from_logits is not None or args.lm is not None):
+        logging.warning("The comparison mode (--models) does not support the logit store and the LM decoder. "
+                        "--save-logits, --decode-from-logits and --lm will be discarded.")
+        args.save_logits = args.decode_from_logits = args.lm = None
+    if args.models is not None and args.devices is not None:
+        logging.warning("The comparison mode (--models) does not support --devices. "
+                        "The models will run on --device.")
+        args.devices = None
+    if args.models is not None and (args.generate_char_timestamps or args.phone_model is not None):
+        logging.warning("The comparison mode (--models) only exports the transcriptions and metrics. "
+                        "Timestamps, phone transcriptions and TextGrids will not be generated.")
+    if args.incremental and (args.models is not None or args.save_logits is not None or args.decode_from_logits is not None):
+        logging.warning("--incremental does not support --models, --save-logits and --decode-from-logits "
+                        "(the stored results and logits would be incomplete). All intervals will be processed.")
+        args.incremental = False
+    if args.models is not None and args.chunking == "adaptive":
+        logging.warning("The comparison mode (--models) only supports the fixed chunking. "
+                        "--chunking adaptive will be discarded.")
+        args.chunking = "fixed"
+    if args.compare_chunking and (args.models is not None or args.decode_from_logits is not None):
+        logging.warning("--compare-chunking requires a model (--model) and is not supported with --models "
+                        "and --decode-from-logits. The comparison will not be generated.")
     if args.accept_all and len(args.ignore_sentences_with) > 0:
         logging.warning("The accept_all argument is set to true, "
                         "but you passed arguments to ignore sentences: "
@@ -471,7 +918,8 @@ if __name__ == "__main__":
                         help="Generate word timespamps of transcribed audios", 
                         action="store_true")
     parser.add_argument("--generate-char-timestamps", 
-                        help="Generate char timespamps of transcribed audios. Note: models with LM does not support this option.", 
+                        help="Generate char timespamps of transcribed audios. Note: models with LM does not support this option "
+                             "(use --lm to decode with a language model).", 
                         action="store_true")
     text_norm_parser = parser.add_argument_group('Opções de normalização de texto')
     text_norm_parser.add_argument("--accept-all", 
@@ -499,6 +947,11 @@ if __name__ == "__main__":
                                        "configurado com nenhuma das opções. Caso ignore-all seja passado, esse argumento será "
                                        "automaticamente configurado com todas as opções.",
                                   default=[])
+    text_norm_parser.add_argument("--marks-cache",
+                                  help="Arquivo JSON com a classificação (anotação, incompreensão, sobreposição, etc.) "
+                                       "e o texto normalizado de cada intervalo dos TextGrids. É calculado uma única "
+                                       "vez e reaproveitado por todas as configurações de sentenças enquanto os "
+                                       "TextGrids não forem modificados (ex: ./output/marks.json)")
     audio_parser = parser.add_argument_group('Opções de pré-processamento de áudio')
     audio_parser.add_argument("--audio-out-dir", 
                               help="Diretório de saída", 
@@ -511,27 +964,91 @@ if __name__ == "__main__":
                                    "que a definida, o áudio será transcrito usando a técnica de janelamento "
                                    "automaticamente", 
                               default=20)
-    # audio_parser.add_argument("--skip-audio-segmentation", 
-    #                           help="Ignora a etapa de pré-processamento de áudio", 
-    #                           action="store_true")
+    audio_parser.add_argument("--chunking",
+                              help="Janelamento dos segmentos maiores que --max-duration: fixed (janelas de 10s com "
+                                   "strides de 4s e 2s) ou adaptive (cortes nos trechos de menor energia, com strides "
+                                   "mínimos quando o corte é em silêncio)",
+                              choices=["fixed", "adaptive"],
+                              default="fixed")
+    audio_parser.add_argument("--chunk-length",
+                              help="Duração alvo (em segundos) das janelas de --chunking adaptive, ou auto para "
+                                   "escolher a duração com menor tempo de inferência por segundo de áudio no modelo "
+                                   "e device usados (medida a cada execução)",
+                              type=chunk_length_type,
+                              default=10.0)
+    audio_parser.add_argument("--compare-chunking",
+                              help="Transcreve os segmentos maiores que --max-duration também com os dois janelamentos "
+                                   "e salva o tempo, o áudio processado e o WER de cada um em "
+                                   "{amostra}_chunking_comparison.csv",
+                              action="store_true")
+    audio_parser.add_argument("--skip-audio-segmentation", 
+                              help="Ignora a etapa de pré-processamento de áudio. Os segmentos devem existir em "
+                                   "--audio-out-dir (ex: gerados antes com --segment-only)", 
+                              action="store_true")
+    audio_parser.add_argument("--segment-only",
+                              help="Apenas segmenta os áudios em --audio-out-dir, sem carregar modelos",
+                              action="store_true")
     audio_parser.add_argument("--overwrite-audios-dir", 
                               help="Executa o pré-processamento dos áudios mesmo se a pasta de áudios existir. "
                                    "Caso o diretório de áudios exista e esta opção não for ativada, o "
                                    "pré-processamento será pulado automaticamente.", 
                               action="store_true")
+    audio_parser.add_argument("--dedup-overlaps",
+                              help="Agrupa sentenças com intervalos idênticos ou aninhados (ex: sobreposição de falantes "
+                                   "em camadas diferentes). Cada região de áudio é segmentada e transcrita uma única vez "
+                                   "e o resultado é repassado a todas as sentenças da região.",
+                              action="store_true")
+    audio_parser.add_argument("--segment-archive",
+                              help="Salva os segmentos de cada áudio em um único arquivo ({amostra}.segments.pcm, PCM de "
+                                   "16 bits) com um índice de offsets ({amostra}.segments.json) em --audio-out-dir, em vez "
+                                   "de um arquivo WAV por sentença. Os segmentos podem ser exportados como WAV com "
+                                   "python common/segment_archive.py.",
+                              action="store_true")
+    audio_parser.add_argument("--resampling",
+                              help="Leitura dos segmentos sem --load-full-audio: librosa (padrão, librosa.load de "
+                                   "cada segmento) ou um reamostrador polifásico que lê o áudio uma única vez e corta "
+                                   "os segmentos nas mesmas amostras do áudio inteiro reamostrado, com a qualidade "
+                                   "fast, medium, high (filtro do scipy.signal.resample_poly) ou best. O áudio dos "
+                                   "segmentos muda em relação ao librosa, e portanto as transcrições e métricas. "
+                                   "Compare com python common/resampling.py AUDIO.",
+                              choices=["librosa", "fast", "medium", "high", "best"],
+                              default="librosa")
     audio_parser.add_argument("--load-full-audio", 
                               help="Carrega todo o áudio para segmentar. Opção mais rápida, mas consome mais memória.", 
                               action="store_true")
     test_parser = parser.add_argument_group('Opções de teste')
     test_parser.add_argument("--model", "-m",
-                             help="Path ou nome do modelo de ASR para realizar o teste", 
-                             required=True)
+                             help="Path ou nome do modelo de ASR para realizar o teste")
+    test_parser.add_argument("--models",
+                             nargs="+",
+                             help="Compara vários modelos de ASR na mesma execução. Cada segmento é lido e "
+                                  "pré-processado uma única vez e transcrito por todos os modelos. Gera uma tabela "
+                                  "por áudio com as predições e métricas de cada modelo lado a lado "
+                                  "({amostra}_comparison.csv) e o comparison_summary.csv. Não pode ser usado com --model.")
     test_parser.add_argument("--phone-model", "-mf",
                              help="Path ou nome do modelo de ASR para transcrição fonética (não será usado para teste)")
     test_parser.add_argument("--device", "-d",
                              help="Device a ser passado como argumento para o framework de transcrição do Hugging Face."
                                   "-1 para usar a CPU.", 
                              default=0)
+    test_parser.add_argument("--devices",
+                             nargs="+",
+                             type=int,
+                             help="Distribui os áudios entre vários processos, um por device (ex: \"0 1\" para duas GPUs "
+                                  "ou \"-1 -1 -1 -1\" para quatro processos na CPU). Os áudios são divididos pela duração "
+                                  "total das sentenças e os resultados são reunidos no mesmo diretório de saída. "
+                                  "Substitui --device. Não suportado com --models.")
+    test_parser.add_argument("--threads-per-worker",
+                             type=int,
+                             help="Número de threads do PyTorch em cada processo de --devices. Padrão: os núcleos "
+                                  "da CPU divididos entre os processos (também usado como --lm-processes de cada "
+                                  "processo, se não for passado)")
+    test_parser.add_argument("--chunk-batch-size",
+                             help="Número de janelas de mesmo tamanho de um segmento longo processadas em um único "
+                                  "lote pelos modelos. Com --phone-model, o modelo de ASR e o fonético usam as mesmas "
+                                  "janelas e a mesma extração de características.",
+                             type=int,
+                             default=4)
     test_parser.add_argument("--metrics",
                              nargs="+", 
                              help="Métricas de teste. Opções disponíveis: wer mer wil cer all",
@@ -540,6 +1057,78 @@ if __name__ == "__main__":
                              help="O resultado das métricas será realizado a partir da média das sentenças de cada áudio."
                                   "Por padrão, todas as sentenças e as predições são usadas para calcular as métricas.",
                              action="store_true")
+    test_parser.add_argument("--incremental",
+                             help="Reprocessa apenas os intervalos alterados desde a última execução no mesmo diretório "
+                                  "de saída. Um manifesto por áudio ({out-dir}/manifest) guarda um hash de cada intervalo "
+                                  "(tempos, marcação e opções de normalização de texto), as métricas e as transcrições. "
+                                  "Apenas os novos trechos são segmentados e transcritos, apenas os intervalos alterados "
+                                  "são avaliados e os áudios sem alterações reaproveitam sua linha do summary.csv.",
+                             action="store_true")
+    test_parser.add_argument("--partial-summary",
+                             help="Salva apenas as linhas do resumo destes áudios no arquivo indicado, sem gerar o "
+                                  "summary.csv e o aggregate.csv (usado pelo run_sweep.py, que junta os resumos)")
+    test_parser.add_argument("--runtime-file",
+                             help="Salva o tempo de carregamento dos modelos (em segundos) no arquivo JSON indicado "
+                                  "(usado pelo run_sweep.py nas estimativas de tempo)")
+    test_parser.add_argument("--no-tables",
+                             help="Não imprime as tabelas de resultados no console. Os resultados continuam "
+                                  "sendo exportados nos arquivos CSV (incluindo o aggregate.csv).",
+                             action="store_true")
+    test_parser.add_argument("--export-workers",
+                             help="Número de threads que calculam as métricas e exportam os resultados (CSVs e "
+                                  "TextGrids) em paralelo à inferência. 0 executa tudo na thread principal.",
+                             type=int,
+                             default=2)
+    test_parser.add_argument("--export-queue-size",
+                             help="Máximo de sentenças aguardando cálculo de métricas/exportação. Quando a fila "
+                                  "está cheia, a inferência espera os workers.",
+                             type=int,
+                             default=64)
+    logits_parser = parser.add_argument_group('Opções de armazenamento dos logits')
+    logits_parser.add_argument("--save-logits",
+                               help="Diretório onde os logits CTC de cada segmento serão salvos (um arquivo por áudio "
+                                    "com um índice de offsets). As transcrições e timestamps de palavras e caracteres "
+                                    "são obtidos de uma única inferência.")
+    logits_parser.add_argument("--logits-dtype",
+                               help="Formato dos logits salvos: float16 (todos os logits) ou topk (apenas os k maiores "
+                                    "logits de cada frame)",
+                               choices=["float16", "topk"],
+                               default="float16")
+    logits_parser.add_argument("--logits-topk",
+                               help="Número de logits salvos por frame com --logits-dtype topk",
+                               type=int,
+                               default=8)
+    logits_parser.add_argument("--decode-from-logits",
+                               help="Diretório com logits salvos por --save-logits. Apenas decodifica os logits "
+                                    "(predições, timestamps e TextGrids) sem executar o modelo acústico e sem "
+                                    "segmentar os áudios. Os mesmos TextGrids, opções de sentenças e --dedup-overlaps "
+                                    "da execução que salvou os logits devem ser usados.")
+    lm_parser = parser.add_argument_group('Opções de decodificação com modelo de linguagem')
+    lm_parser.add_argument("--lm",
+                           help="Modelo de linguagem KenLM (ARPA ou binário) para decodificação CTC com beam search. "
+                                "O decodificador é carregado uma vez e os segmentos de cada áudio são decodificados em "
+                                "lote em vários processos. Pode ser combinado com --decode-from-logits. Sem --lm, "
+                                "modelos que incluem um modelo de linguagem (Wav2Vec2ProcessorWithLM) são decodificados "
+                                "da mesma forma com o seu próprio modelo de linguagem.")
+    lm_parser.add_argument("--lm-alpha",
+                           help="Peso do modelo de linguagem",
+                           type=float,
+                           default=0.5)
+    lm_parser.add_argument("--lm-beta",
+                           help="Bônus por palavra (word insertion)",
+                           type=float,
+                           default=1.0)
+    lm_parser.add_argument("--lm-beam-width",
+                           help="Tamanho do beam (também usado com o modelo de linguagem do modelo)",
+                           type=int,
+                           default=100)
+    lm_parser.add_argument("--lm-unigrams",
+                           help="Arquivo com o vocabulário do modelo de linguagem (uma palavra por linha). "
+                                "Recomendado para modelos KenLM binários.")
+    lm_parser.add_argument("--lm-processes",
+                           help="Número de processos de decodificação (padrão: número de CPUs, ou os núcleos de "
+                                "cada processo com --devices)",
+                           type=int)
     csv_parser = parser.add_argument_group('Opções dos arquivos CSV de saída')
     csv_parser.add_argument("--ptbr",
                             help="Usa o separador de ponto-e-virgula (;) e o formato de número em PT-BR (XX,XX)", 
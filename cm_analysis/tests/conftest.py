@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The scripts import the modules as `common.*` from the cm_analysis directory
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,54 @@
+import numpy as np
+
+from common import adaptive_chunking, logit_store
+
+SAMPLING_RATE = 16000
+# inputs_to_logits_ratio of the wav2vec2 models
+RATIO = 320
+
+
+def speech_with_pauses(seconds, seed=0):
+    """
+    Noise ("speech") with a 300 ms pause every 7.3 s.
+    """
+    rng = np.random.default_rng(seed)
+    audio = 0.3*rng.standard_normal(int(seconds*SAMPLING_RATE) + 123)
+    for pause in np.arange(7.3, seconds, 7.3):
+        start = int(pause*SAMPLING_RATE)
+        audio[start:start + int(0.3*SAMPLING_RATE)] *= 1e-3
+    return audio
+
+
+def test_adaptive_windows_are_aligned_to_logit_frames():
+    audio = speech_with_pauses(61)
+    windows = adaptive_chunking.adaptive_windows(audio, SAMPLING_RATE, 10, align_to=RATIO)
+    assert len(windows) > 3
+    assert windows[0][0] == 0 and windows[-1][1] == len(audio) and windows[-1][3] == 0
+    kept_end = 0
+    for start, end, left, right in windows:
+        assert start % RATIO == 0 and left % RATIO == 0 and right % RATIO == 0
+        if end != len(audio):
+            assert end % RATIO == 0
+        first, last = logit_store.stride_frames(end - start, left, right, RATIO)
+        # The kept frames are the audio between the cuts, without gaps or repetitions
+        assert start + left == kept_end
+        assert first == left // RATIO
+        if end != len(audio):
+            assert last - first == (end - right - start - left) // RATIO
+        kept_end = end - right
+    assert kept_end == len(audio)
+
+
+def test_adaptive_windows_cut_in_the_pauses():
+    audio = speech_with_pauses(40)
+    windows = adaptive_chunking.adaptive_windows(audio, SAMPLING_RATE, 10, align_to=RATIO)
+    for start, end, left, right in windows[:-1]:
+        cut = (end - right)/SAMPLING_RATE
+        # Nearest pause (7.3 s period) and a short stride in silence
+        assert abs(cut - round(cut/7.3)*7.3) < 0.35
+        assert right == 0.1*SAMPLING_RATE
+
+
+def test_short_segment_is_a_single_window():
+    audio = speech_with_pauses(12)
+    assert adaptive_chunking.adaptive_windows(audio, SAMPLING_RATE, 10, align_to=RATIO) == [(0, len(audio), 0, 0)]
@@ -0,0 +1,56 @@
+import wave
+
+import numpy as np
+import pytest
+
+pytest.importorskip("librosa")
+from common import audio_preprocessing  # noqa: E402
+
+
+def dbfs(audio):
+    return 20*np.log10(np.sqrt(np.mean(np.square(audio, dtype=np.float64))))
+
+
+def test_needs_gain_normalization():
+    assert audio_preprocessing.needs_gain_normalization(
+        "alefiury/wav2vec2-large-xlsr-53-coraa-brazilian-portuguese-plus-gain-normalization"
+    )
+    assert not audio_preprocessing.needs_gain_normalization("lgris/bp400-xlsr")
+
+
+def test_normalize_gain_reaches_the_target_level():
+    rng = np.random.default_rng(0)
+    audio = (0.01*rng.standard_normal(16000)).astype(np.float32)
+    normalized = audio_preprocessing.normalize_gain(audio)
+    assert normalized.dtype == np.float32
+    assert dbfs(normalized) == pytest.approx(audio_preprocessing.TARGET_DBFS, abs=0.05)
+
+
+def test_normalize_gain_keeps_silence_and_saturates():
+    silence = np.zeros(100, dtype=np.float32)
+    assert np.array_equal(audio_preprocessing.normalize_gain(silence), silence)
+
+    # A quiet signal with one spike: the spike is clipped to the 16-bit range
+    audio = np.full(16000, 0.001, dtype=np.float32)
+    audio[0] = 0.5
+    normalized = audio_preprocessing.normalize_gain(audio)
+    assert normalized.max() <= 32767/32768
+    assert normalized[0] == pytest.approx(32767/32768)
+
+
+def test_normalize_gain_matches_the_file_preprocessing(tmp_path):
+    pytest.importorskip("pydub")
+    rng = np.random.default_rng(1)
+    samples = np.round(0.05*rng.standard_normal(8000)*32767).astype(np.int16)
+    path = str(tmp_path / "segment.wav")
+    with wave.open(path, 'wb') as fp:
+        fp.setnchannels(1)
+        fp.setsampwidth(2)
+        fp.setframerate(16000)
+        fp.writeframes(samples.tobytes())
+
+    expected = audio_preprocessing.get_preprocessing_function("x-gain-normalization", 16000)(path)
+    normalized = audio_preprocessing.normalize_gain(samples.astype(np.float32)/32768.0)
+    # pydub measures the level with an integer RMS and floors the samples:
+    # a difference of a few LSBs
+    assert np.abs(normalized - expected).max() <= 3/32768
@@ -0,0 +1,78 @@
+import pytest
+
+from common import audio_regions
+from common.tables import ColumnTable, SENTENCE_SCHEMA
+
+
+def make_sentences(ranges):
+    sentences = ColumnTable(SENTENCE_SCHEMA)
+    for start_sec, end_sec in ranges:
+        sentences.append(start_sec=start_sec, end_sec=end_sec, mark="", text="", duration=end_sec-start_sec)
+    return sentences
+
+
+def region_ranges(regions):
+    return [(r["start_sec"], r["end_sec"], r["sentences"]) for r in regions]
+
+
+def test_identical_ranges_share_a_region():
+    # Same interval in the tiers of two speakers
+    sentences = make_sentences([(1.0, 4.0), (5.0, 6.0), (1.0, 4.0)])
+    regions = audio_regions.index_regions(sentences)
+    assert region_ranges(regions) == [(1.0, 4.0, [0, 2]), (5.0, 6.0, [1])]
+
+    mapping = audio_regions.sentence_regions(sentences)
+    assert mapping[0] is mapping[2]
+    assert audio_regions.is_same_range(mapping[2], 1.0, 4.0)
+
+
+def test_nested_ranges_use_the_outer_region():
+    sentences = make_sentences([(2.0, 3.0), (1.0, 4.0), (3.5, 4.0)])
+    regions = audio_regions.index_regions(sentences)
+    assert region_ranges(regions) == [(1.0, 4.0, [1, 0, 2])]
+    assert not audio_regions.is_same_range(regions[0], 2.0, 3.0)
+
+
+def test_partially_overlapping_ranges_are_separate_regions():
+    sentences = make_sentences([(0.0, 5.0), (3.0, 8.0)])
+    regions = audio_regions.index_regions(sentences)
+    assert region_ranges(regions) == [(0.0, 5.0, [0]), (3.0, 8.0, [1])]
+
+
+def test_region_audio_path():
+    region = {"start_sec": 1.5, "end_sec": 4.25}
+    assert audio_regions.region_audio_path("audios", "SP_D2_255", region) == "audios/SP_D2_255_1.5_4.25.wav"
+
+
+def test_slice_output_of_identical_range_keeps_everything():
+    output = {"text": "eu acho", "chunks": [
+        {"text": "eu", "timestamp": (0.0, 0.5)},
+        {"text": "acho", "timestamp": (0.6, 1.2)}
+    ]}
+    sliced = audio_regions.slice_output(output, 0.0, 3.0)
+    assert sliced == output
+
+
+def test_slice_output_of_nested_sentence():
+    # Region [1, 4]: sentence [2, 3] is the offsets [1, 2] of the region
+    output = {"text": "a b c d", "chunks": [
+        {"text": "a", "timestamp": (0.1, 0.6)},
+        {"text": "b", "timestamp": (0.9, 1.3)},   # midpoint 1.1: inside
+        {"text": "c", "timestamp": (1.8, 2.4)},   # midpoint 2.1: outside
+        {"text": "d", "timestamp": (2.5, 2.9)}
+    ]}
+    sliced = audio_regions.slice_output(output, 1.0, 2.0)
+    assert sliced["text"] == "b"
+    # Shifted to the start of the sentence and clamped to its bounds
+    assert [tp["text"] for tp in sliced["chunks"]] == ["b"]
+    assert sliced["chunks"][0]["timestamp"] == pytest.approx((0.0, 0.3))
+
+
+def test_slice_output_chars_and_missing_end():
+    output = {"text": "oi", "chunks": [
+        {"text": "o", "timestamp": (1.0, 1.1)},
+        {"text": "i", "timestamp": (1.2, None)}
+    ]}
+    sliced = audio_regions.slice_output(output, 0.5, 1.5, separator="")
+    assert sliced["text"] == "oi"
+    assert sliced["chunks"][1]["timestamp"] == pytest.approx((0.7, 0.7))
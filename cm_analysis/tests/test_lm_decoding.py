@@ -0,0 +1,105 @@
+import numpy as np
+import pytest
+
+from common import lm_decoding
+
+BLANK = 0
+VOCAB = {"<pad>": 0, "|": 1, "a": 2, "b": 3, "c": 4, "<unk>": 5}
+
+
+def peaked(path, vocab_size=len(VOCAB), low=-10.0):
+    """
+    Log-probabilities where each frame is confident on one token.
+    """
+    logits = np.full((len(path), vocab_size), low)
+    logits[np.arange(len(path)), path] = 0.0
+    return lm_decoding.log_softmax(logits)
+
+
+def test_log_softmax():
+    logits = np.array([[1.0, 2.0, 3.0], [1000.0, 1000.0, 1000.0]])
+    log_probs = lm_decoding.log_softmax(logits)
+    assert np.all(np.isfinite(log_probs))
+    assert np.allclose(np.exp(log_probs).sum(axis=-1), 1.0)
+    assert np.allclose(log_probs[1], np.log(1/3))
+    # Invariant to a shift of the logits
+    assert np.allclose(lm_decoding.log_softmax(logits[:1] + 50), log_probs[:1])
+
+
+def test_ctc_align_spans():
+    log_probs = peaked([BLANK, 2, 2, BLANK, 3, BLANK])
+    assert lm_decoding.ctc_align(log_probs, [2, 3], BLANK) == [(1, 3), (4, 5)]
+
+
+def test_ctc_align_repeated_tokens_need_a_blank():
+    log_probs = peaked([2, BLANK, 2])
+    assert lm_decoding.ctc_align(log_probs, [2, 2], BLANK) == [(0, 1), (2, 3)]
+    # Two frames cannot hold "aa" (the blank between them is mandatory)
+    assert lm_decoding.ctc_align(peaked([2, 2]), [2, 2], BLANK) is None
+
+
+def test_ctc_align_empty():
+    assert lm_decoding.ctc_align(peaked([BLANK]), [], BLANK) is None
+    assert lm_decoding.ctc_align(np.empty((0, len(VOCAB))), [2], BLANK) is None
+
+
+class FakeTokenizer:
+    unk_token_id = VOCAB["<unk>"]
+    pad_token_id = BLANK
+
+    def convert_tokens_to_ids(self, tokens):
+        return [VOCAB.get(token, self.unk_token_id) for token in tokens]
+
+
+def make_decoder():
+    # Only the attributes used by char_chunks (no pyctcdecode / KenLM)
+    decoder = object.__new__(lm_decoding.LMDecoder)
+    decoder.tokenizer = FakeTokenizer()
+    decoder.blank_id = BLANK
+    return decoder
+
+
+def test_char_chunks_aligns_the_chars_of_each_word():
+    log_probs = peaked([BLANK, 2, 3, BLANK, 1, 4, 4, BLANK])
+    chunks = make_decoder().char_chunks(log_probs, [("ab", (0, 4)), ("c", (5, 8))], 0.02)
+    assert [tp["text"] for tp in chunks] == ["a", "b", "c"]
+    assert [tp["timestamp"] for tp in chunks] == pytest.approx([(0.02, 0.04), (0.04, 0.06), (0.1, 0.14)])
+
+
+def test_char_chunks_splits_words_with_unknown_chars_evenly():
+    log_probs = peaked([2, 2, 2, 2])
+    chunks = make_decoder().char_chunks(log_probs, [("aé", (0, 4))], 0.02)
+    assert [tp["text"] for tp in chunks] == ["a", "é"]
+    assert [tp["timestamp"] for tp in chunks] == pytest.approx([(0.0, 0.04), (0.04, 0.08)])
+
+
+class FakeBeamDecoder:
+    """
+    pyctcdecode decoder (e.g. the one of a model with a language model)
+    that returns a fixed beam.
+    """
+
+    def __init__(self, text_frames):
+        self.text_frames = text_frames
+        self.inputs = []
+
+    def decode_beams(self, log_probs, beam_width=100):
+        self.inputs.append((log_probs, beam_width))
+        text = " ".join(word for word, _ in self.text_frames)
+        return [(text, None, self.text_frames, -1.0, -1.0)]
+
+
+def test_decode_batch_with_a_loaded_decoder():
+    beam_decoder = FakeBeamDecoder([("ab", (0, 4)), ("c", (5, 8))])
+    decoder = lm_decoding.LMDecoder(FakeTokenizer(), beam_width=8, processes=1, decoder=beam_decoder)
+    logits = np.log(np.exp(peaked([BLANK, 2, 3, BLANK, 1, 4, 4, BLANK])) + 1.0)
+    output, = decoder.decode_batch([logits], 0.02, char_timestamps=True)
+
+    # The beam search gets log-probabilities, not the raw logits
+    log_probs, beam_width = beam_decoder.inputs[0]
+    assert beam_width == 8
+    assert np.allclose(np.exp(log_probs).sum(axis=-1), 1.0)
+    assert output["word"]["text"] == "ab c"
+    assert [tp["timestamp"] for tp in output["word"]["chunks"]] == pytest.approx([(0.0, 0.08), (0.1, 0.16)])
+    assert [tp["text"] for tp in output["char"]["chunks"]] == ["a", "b", "c"]
+    decoder.close()
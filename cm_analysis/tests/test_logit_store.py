@@ -0,0 +1,101 @@
+import numpy as np
+import pytest
+
+from common import logit_store
+
+SAMPLING_RATE = 16000
+# inputs_to_logits_ratio of the wav2vec2 models
+RATIO = 320
+
+
+class FakeFeatureExtractor:
+    sampling_rate = SAMPLING_RATE
+
+    def __call__(self, chunk, sampling_rate=None, return_tensors=None):
+        return {"input_values": chunk}
+
+
+def pipeline_windows(n_samples, chunk_length_s, stride_length_s):
+    """
+    Windows and kept logit frames of the transformers pipeline chunking.
+    """
+    asr_pipeline = pytest.importorskip("transformers.pipelines.automatic_speech_recognition")
+    align_to = RATIO
+    chunk_len = int(round(chunk_length_s*SAMPLING_RATE/align_to))*align_to
+    stride_left = int(round(stride_length_s[0]*SAMPLING_RATE/align_to))*align_to
+    stride_right = int(round(stride_length_s[1]*SAMPLING_RATE/align_to))*align_to
+    audio = np.arange(n_samples, dtype=np.float32)
+    windows = []
+    for item in asr_pipeline.chunk_iter(audio, FakeFeatureExtractor(), chunk_len, stride_left, stride_right):
+        chunk = item["input_values"]
+        input_n, left, right = item["stride"]
+        start = int(chunk[0])
+        # rescale_stride(tokens_or_logits, stride, ratio) in transformers 4.19
+        token_n, left_n, right_n = asr_pipeline.rescale_stride(None, [(input_n, left, right)], 1/RATIO)[0]
+        windows.append(((start, start + input_n, left, right), (left_n, token_n - right_n)))
+    return windows
+
+
+@pytest.mark.parametrize("n_samples", [
+    11*SAMPLING_RATE + 123,
+    25*SAMPLING_RATE,
+    37*SAMPLING_RATE + 4321,
+    60*SAMPLING_RATE + 1
+])
+def test_fixed_windows_match_pipeline(n_samples):
+    expected = pipeline_windows(n_samples, 10, (4, 2))
+    windows = logit_store.fixed_windows(n_samples, SAMPLING_RATE, 10, (4, 2), RATIO)
+    assert windows == [window for window, _ in expected]
+    for (start, end, left, right), (_, frames) in zip(windows, expected):
+        assert logit_store.stride_frames(end - start, left, right, RATIO) == frames
+
+
+def test_fixed_windows_are_aligned_to_logit_frames():
+    n_samples = 37*SAMPLING_RATE + 4321
+    # 10.01 s and 4.01 s are not multiples of a frame
+    windows = logit_store.fixed_windows(n_samples, SAMPLING_RATE, 10.01, (4.01, 2), RATIO)
+    assert len(windows) > 2
+    chunk_len = windows[0][1]
+    kept_end = 0
+    for start, end, left, right in windows:
+        assert start % RATIO == 0 and left % RATIO == 0 and right % RATIO == 0
+        first, last = logit_store.stride_frames(end - start, left, right, RATIO)
+        assert first == left // RATIO
+        if end - start == chunk_len:
+            # The kept parts of full windows are contiguous and have exactly the
+            # frames between the strides (a shorter window before the last one
+            # keeps its right stride, as in the pipeline)
+            assert start + left == kept_end
+            assert last - first == (end - right - start - left) // RATIO
+        kept_end = end - right
+    assert windows[-1][1] == n_samples and windows[-1][3] == 0
+
+
+@pytest.mark.parametrize("dtype", ["float16", "topk"])
+def test_logit_store_roundtrip(tmp_path, dtype):
+    rng = np.random.default_rng(0)
+    segments = {f"S1_{i}.0_{i+1}.0.wav": rng.standard_normal((20 + i, 12)).astype(np.float32) for i in range(3)}
+    writer = logit_store.LogitWriter(str(tmp_path), "S1", "model", 0.02, dtype=dtype, k=4)
+    for key, logits in segments.items():
+        writer.add(key, logits, pad_sec=1.0)
+    writer.close()
+
+    reader = logit_store.LogitReader(str(tmp_path), "S1", "model")
+    assert reader.time_per_frame == 0.02
+    for key in reversed(list(segments)):
+        logits, pad_sec = reader.get(key)
+        assert pad_sec == 1.0 and logits.shape == segments[key].shape
+        # The greedy path is kept in both formats
+        assert np.array_equal(logits.argmax(axis=1), segments[key].argmax(axis=1))
+        if dtype == "float16":
+            assert np.allclose(logits, segments[key], atol=1e-2)
+
+
+def test_empty_logit_store(tmp_path):
+    # Inquiry without transcribable sentences
+    logit_store.LogitWriter(str(tmp_path), "S1", "model", 0.02).close()
+    assert (tmp_path / "S1.model.logits").stat().st_size == 0
+
+    reader = logit_store.LogitReader(str(tmp_path), "S1", "model")
+    assert "S1_0.0_1.0.wav" not in reader
+    assert reader.index["segments"] == {}
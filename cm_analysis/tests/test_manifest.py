@@ -0,0 +1,86 @@
+import argparse
+
+from common.manifest import Manifest
+
+
+def make_args(out_dir, **options):
+    args = dict(
+        out_dir=str(out_dir),
+        accept_all=False,
+        ignore_all=False,
+        ignore_sentences_with=["incomprehensible_sentences"],
+        model="model",
+        phone_model=None,
+        sample_rate=16000,
+        max_duration=10.0,
+        chunking="fixed",
+        chunk_length=None,
+        generate_char_timestamps=False,
+        dedup_overlaps=False,
+        resampling="librosa",
+        load_full_audio=False,
+        segment_archive=False,
+        lm=None,
+        lm_alpha=0.5,
+        lm_beta=1.5,
+        lm_beam_width=100,
+        lm_unigrams=None,
+        metrics=["wer", "cer"],
+        average_from_sentences=True,
+        ptbr=False
+    )
+    args.update(options)
+    return argparse.Namespace(**args)
+
+
+def save_run(manifest):
+    sentences = [{"start_sec": 1.0, "end_sec": 2.5, "mark": "tudo bem"}]
+    hashes = manifest.hashes(sentences)
+    outputs = {"S1_1.0_2.5.wav": {
+        "word": {"text": "tudo bem", "chunks": [{"text": "tudo", "timestamp": (0.0, 0.4)}]},
+        "char": None,
+        "phones": None,
+        "pad_sec": 0.0
+    }}
+    metrics = {hashes[0]: {"prediction": "tudo bem", "wer": 0.0, "mer": 0.0, "wil": 0.0, "cer": 0.0}}
+    manifest.save("S1", hashes, metrics, outputs)
+    return hashes
+
+
+def test_same_options_reuse_the_manifest(tmp_path):
+    hashes = save_run(Manifest(make_args(tmp_path)))
+    previous = Manifest(make_args(tmp_path)).load("S1")
+    assert previous["hashes"] == hashes
+    assert previous["outputs"]["S1_1.0_2.5.wav"]["word"]["chunks"][0]["timestamp"] == (0.0, 0.4)
+
+
+def test_resampling_invalidates_the_manifest(tmp_path):
+    save_run(Manifest(make_args(tmp_path)))
+    previous = Manifest(make_args(tmp_path, resampling="high")).load("S1")
+    assert previous == {"hashes": [], "metrics": {}, "outputs": {}}
+
+
+def test_resampling_is_ignored_with_load_full_audio(tmp_path):
+    save_run(Manifest(make_args(tmp_path, load_full_audio=True)))
+    previous = Manifest(make_args(tmp_path, load_full_audio=True, resampling="high")).load("S1")
+    assert len(previous["hashes"]) == 1
+
+
+def test_segment_archive_invalidates_the_manifest(tmp_path):
+    save_run(Manifest(make_args(tmp_path)))
+    assert Manifest(make_args(tmp_path, segment_archive=True)).load("S1")["hashes"] == []
+
+
+def test_lm_unigrams_invalidate_the_manifest(tmp_path):
+    save_run(Manifest(make_args(tmp_path, lm="lm.arpa")))
+    assert Manifest(make_args(tmp_path, lm="lm.arpa", lm_unigrams="unigrams.txt")).load("S1")["hashes"] == []
+
+
+def test_resolved_chunk_length_is_hashed(tmp_path):
+    # --chunk-length not passed: the length chosen by the benchmark is part of the key
+    save_run(Manifest(make_args(tmp_path, chunking="adaptive"), chunk_length=10))
+    assert len(Manifest(make_args(tmp_path, chunking="adaptive"), chunk_length=10).load("S1")["hashes"]) == 1
+    assert Manifest(make_args(tmp_path, chunking="adaptive"), chunk_length=15).load("S1")["hashes"] == []
+    # Not used by the fixed chunking
+    save_run(Manifest(make_args(tmp_path), chunk_length=10))
+    assert len(Manifest(make_args(tmp_path), chunk_length=15).load("S1")["hashes"]) == 1
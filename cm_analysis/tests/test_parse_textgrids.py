@@ -0,0 +1,112 @@
+import argparse
+
+import pytest
+import textgrid
+
+from common import parse_textgrids
+from common.mark_preprocessing import MarkPreprocessing
+
+# Marks with every flag of MarkPreprocessing.detect_flags, alone and combined
+MARKS = [
+    "", " ", "###", "ok tudo bem", "L1 então... a gente foi lá", "eu acho ( ) que sim",
+    "(hipótese) de fala", "[sobreposição] de falas", "falou ((risos)) e saiu", "((tosse))",
+    "Doc. o senhor trabalha com (( )) [isso]", "a sigla do I. B. G. E.", "em 1998 eram 20%",
+    "ele disse: \"não!\" - e foi; embora?", "((ruído)) (talvez) [sim]"
+]
+
+# Sentence configurations of run_tests.sh
+CONFIGS = [
+    (True, False, []),
+    (False, True, []),
+    (False, False, ["incomprehensible_sentences", "hypothesis_sentences"]),
+    (False, False, ["sentences_with_annotation_parts"]),
+    (False, False, ["overlap_sentences"]),
+    (False, False, ["incomprehensible_sentences", "sentences_with_annotation_parts", "overlap_sentences"])
+]
+
+
+def write_textgrid(path):
+    tg = textgrid.TextGrid(minTime=0, maxTime=100)
+    for t, name in enumerate(["TB-L1", "TB-L2", "NTB"]):
+        tier = textgrid.IntervalTier(name=name, minTime=0, maxTime=100)
+        for i, mark in enumerate(MARKS[t:] + MARKS[:t]):
+            tier.add(minTime=2.5*i, maxTime=2.5*i + 1.25 + 0.25*t, mark=mark)
+        tg.append(tier)
+    tg.write(str(path))
+
+
+def make_args(tmp_path, accept_all, ignore_all, ignore_sentences_with):
+    return argparse.Namespace(
+        textgrids=[str(tmp_path / "SP_D2_999.TextGrid")],
+        accept_all=accept_all,
+        ignore_all=ignore_all,
+        ignore_sentences_with=ignore_sentences_with,
+        out_dir=str(tmp_path),
+        save_sentences_json_dir=None,
+        save_skipped_sentences_json_dir=None,
+        save_sentences_csv_dir=None,
+        save_skipped_sentences_csv_dir=None,
+        ptbr=False,
+        marks_cache=str(tmp_path / "marks.json"),
+        log_level="WARNING"
+    )
+
+
+def regex_sentences(args):
+    """
+    Sentences and N- tiers of the regex preprocessing (MarkPreprocessing
+    called on each mark).
+    """
+    if args.accept_all or args.ignore_all:
+        pre_process_nurcsp = MarkPreprocessing(
+            ignore_abreviations=not args.accept_all,
+            ignore_incomprehensible_sentences=not args.accept_all,
+            ignore_sentences_with_annotation_parts=not args.accept_all,
+            ignore_overlap_sentences=not args.accept_all,
+            remove_incomprehensible_parts=not args.accept_all
+        )
+    else:
+        pre_process_nurcsp = MarkPreprocessing(
+            ignore_incomprehensible_sentences="incomprehensible_sentences" in args.ignore_sentences_with,
+            ignore_sentences_with_annotation_parts="sentences_with_annotation_parts" in args.ignore_sentences_with,
+            ignore_overlap_sentences="overlap_sentences" in args.ignore_sentences_with
+        )
+    sentences = []
+    tiers = []
+    for tier in textgrid.TextGrid.fromFile(args.textgrids[0]):
+        new_tier = []
+        for it in tier:
+            text = pre_process_nurcsp(it.mark)
+            if text is not None:
+                sentences.append((it.minTime, it.maxTime, it.mark, text, it.maxTime - it.minTime))
+            new_tier.append((it.minTime, it.maxTime, text if text is not None else ""))
+        if "NTB" not in tier.name:
+            tiers.append(("N-" + tier.name, new_tier))
+    return sentences, tiers
+
+
+def parsed_sentences(args):
+    sentences, new_textgrids = parse_textgrids.parse_textgrids(args)
+    table = sentences["SP_D2_999"]
+    rows = [tuple(r[c] for c in ("start_sec", "end_sec", "mark", "text", "duration")) for r in table.to_records()]
+    tiers = [(tier.name, [(it.minTime, it.maxTime, it.mark) for it in tier])
+             for tier in new_textgrids["SP_D2_999"] if tier.name.startswith("N-")]
+    return rows, tiers
+
+
+@pytest.mark.parametrize("config", CONFIGS)
+def test_cached_marks_match_the_regex_preprocessing(tmp_path, monkeypatch, config):
+    write_textgrid(tmp_path / "SP_D2_999.TextGrid")
+    args = make_args(tmp_path, *config)
+    expected = regex_sentences(args)
+    assert 0 < len(expected[0]) < 3*len(MARKS)
+
+    # First run: marks classified and saved in the cache
+    assert parsed_sentences(args) == expected
+    assert (tmp_path / "marks.json").is_file()
+
+    # Second run: marks read from the cache, without classifying them again
+    def classify(self, mark):
+        raise AssertionError("The marks should be read from the cache")
+    monkeypatch.setattr(MarkPreprocessing, "classify", classify)
+    assert parsed_sentences(args) == expected
@@ -0,0 +1,60 @@
+import time
+import threading
+
+import pytest
+
+from common import scheduler
+
+
+def test_jobs_run_in_parallel(tmp_path):
+    jobs = [{"name": f"{config}/{sample}", "model": "m", "duration": duration}
+            for config in ("accept_all", "ignore_all", "ignore_overlap_sentences")
+            for sample, duration in (("SP_D2_062", 30.0), ("SP_DID_018", 20.0), ("SP_EF_124", 10.0))]
+    estimator = scheduler.RuntimeEstimator(str(tmp_path / "runtimes.json"))
+    lock = threading.Lock()
+    running = set()
+    concurrency = []
+
+    def run_job(job, worker):
+        with lock:
+            running.add(job["name"])
+            concurrency.append(len(running))
+        time.sleep(0.01)
+        with lock:
+            running.discard(job["name"])
+        return job["name"] != "ignore_all/SP_EF_124"
+
+    finished = []
+    failed = scheduler.run_jobs(jobs, 3, estimator, run_job, finished.append)
+    assert failed == 1
+    assert sorted(j["name"] for j in finished) == sorted(j["name"] for j in jobs)
+    # Jobs of the same inquiry also run at the same time
+    assert max(concurrency) > 1
+
+
+def test_measured_overhead(tmp_path):
+    estimator = scheduler.RuntimeEstimator(str(tmp_path / "runtimes.json"))
+    # 8s of model loading and 0.05s of inference per second of audio
+    for duration in (100.0, 100.0, 200.0):
+        estimator.record("m", duration, 8.0 + 0.05*duration, overhead=8.0)
+    assert estimator.estimate("m", 400.0) == pytest.approx(8.0 + 0.05*400)
+    # Jobs of similar durations do not separate the overhead without the measures
+    estimator.record("n", 100.0, 13.0)
+    assert estimator.estimate("n", 400.0) == pytest.approx(52.0)
+    # The observations are kept for the next sweeps
+    assert scheduler.RuntimeEstimator(str(tmp_path / "runtimes.json")).estimate("m", 400.0) == pytest.approx(28.0)
+
+
+def test_run_job_reports_its_overhead(tmp_path):
+    estimator = scheduler.RuntimeEstimator(str(tmp_path / "runtimes.json"))
+    jobs = [{"name": "a", "model": "m", "duration": 10.0}]
+    assert scheduler.run_jobs(jobs, 1, estimator, lambda job, worker: (True, 3.5)) == 0
+    assert estimator.observations["m"][0][2] == 3.5
+
+
+def test_longest_job_starts_first(tmp_path):
+    jobs = [{"name": str(d), "model": "m", "duration": d} for d in (5.0, 50.0, 20.0)]
+    started = []
+    scheduler.run_jobs(jobs, 1, scheduler.RuntimeEstimator(str(tmp_path / "runtimes.json")),
+                       lambda job, worker: started.append(job["duration"]) or True)
+    assert started == [50.0, 20.0, 5.0]
@@ -0,0 +1,77 @@
+import numpy as np
+import pytest
+
+pytest.importorskip("soundfile")
+from common import segment_archive  # noqa: E402
+
+SAMPLE_RATE = 16000
+
+
+def make_segments(n, seed=0):
+    rng = np.random.default_rng(seed)
+    segments = []
+    for i in range(n):
+        start_sec = 2.0*i + 0.5
+        end_sec = start_sec + 0.25 + 0.1*i
+        audio = np.clip(0.3*rng.standard_normal(int(SAMPLE_RATE*(end_sec - start_sec))), -1, 1)
+        segments.append((segment_archive.segment_key("SP_D2_255", start_sec, end_sec), start_sec, end_sec, audio))
+    return segments
+
+
+def write(archive_dir, segments, overwrite=False):
+    writer = segment_archive.SegmentArchiveWriter(str(archive_dir), "SP_D2_255", SAMPLE_RATE, overwrite=overwrite)
+    for key, start_sec, end_sec, audio in segments:
+        if key not in writer:
+            writer.add(key, start_sec, end_sec, audio)
+    writer.close()
+
+
+def test_random_access_by_segment(tmp_path):
+    segments = make_segments(5)
+    # Written out of order: the index is sorted by time
+    write(tmp_path, segments[::-1])
+    assert segment_archive.archive_exists(str(tmp_path), "SP_D2_255")
+
+    reader = segment_archive.SegmentArchiveReader(str(tmp_path), "SP_D2_255")
+    assert reader.sample_rate == SAMPLE_RATE
+    assert reader.keys() == [key for key, _, _, _ in segments]
+    for key, _, _, audio in [segments[3], segments[0], segments[4]]:
+        restored = reader.get(key)
+        assert restored.dtype == np.float32 and len(restored) == len(audio)
+        # 16-bit quantization
+        assert np.abs(restored - audio).max() <= 1.5/32768
+    assert "SP_D2_255_99.0_100.0.wav" not in reader
+
+
+def test_append_to_an_existing_archive(tmp_path):
+    segments = make_segments(4)
+    write(tmp_path, segments[:2])
+    # Bytes of an interrupted run that are not in the index are dropped
+    with open(tmp_path / "SP_D2_255.segments.pcm", 'ab') as fp:
+        fp.write(b"\x01\x02\x03")
+    write(tmp_path, segments)
+
+    reader = segment_archive.SegmentArchiveReader(str(tmp_path), "SP_D2_255")
+    assert reader.keys() == [key for key, _, _, _ in segments]
+    for key, _, _, audio in segments:
+        assert np.abs(reader.get(key) - audio).max() <= 1.5/32768
+    total = sum(len(audio) for _, _, _, audio in segments)
+    assert (tmp_path / "SP_D2_255.segments.pcm").stat().st_size == 2*total
+
+
+def test_empty_archive(tmp_path):
+    write(tmp_path, [])
+    assert (tmp_path / "SP_D2_255.segments.pcm").stat().st_size == 0
+    reader = segment_archive.SegmentArchiveReader(str(tmp_path), "SP_D2_255")
+    assert reader.keys() == []
+    assert "SP_D2_255_0.5_0.75.wav" not in reader
+
+    # An empty archive can be extended later
+    segments = make_segments(1)
+    write(tmp_path, segments)
+    reader = segment_archive.SegmentArchiveReader(str(tmp_path), "SP_D2_255")
+    assert reader.keys() == [segments[0][0]]
+
+
+def test_missing_archive(tmp_path):
+    assert not segment_archive.archive_exists(str(tmp_path), "SP_D2_255")
@@ -0,0 +1,81 @@
+import os
+import argparse
+
+from common import sharding
+from common.tables import ColumnTable, SENTENCE_SCHEMA
+
+DURATIONS = {"SP_D2_062": 100.0, "SP_D2_255": 90.0, "SP_DID_018": 60.0,
+             "SP_DID_137": 50.0, "SP_EF_124": 30.0, "SP_EF_153": 20.0}
+
+
+def make_corpus():
+    corpus_sentences = {}
+    for sample, duration in DURATIONS.items():
+        sentences = ColumnTable(SENTENCE_SCHEMA)
+        # Two sentences per inquiry
+        for start_sec, end_sec in ((0.0, duration/2), (duration/2, duration)):
+            sentences.append(start_sec=start_sec, end_sec=end_sec, mark="x", text="x", duration=end_sec-start_sec)
+        corpus_sentences[sample] = sentences
+    return corpus_sentences
+
+
+def make_args():
+    return argparse.Namespace(
+        audio_files=[f"audios/{sample}.wav" for sample in DURATIONS],
+        device=0,
+        lm_processes=None,
+        log_file=None,
+        log_level="WARNING"
+    )
+
+
+def shard_worker(args, corpus_sentences, corpus_new_textgrids):
+    # Same return value of run_shard: (summary, results files)
+    summary = [{
+        "SAMPLE": sample,
+        "DURATION": float(sentences.column("duration").sum()),
+        "DEVICE": args.device,
+        "LM_PROCESSES": args.lm_processes,
+        "PID": os.getpid()
+    } for sample, sentences in corpus_sentences.items()]
+    results_files = [f"out/{sample}_results_model.csv" for sample in corpus_sentences]
+    assert set(corpus_new_textgrids) == set(corpus_sentences)
+    return summary, results_files
+
+
+def test_balance_inquiries():
+    shards = sharding.balance_inquiries(make_args().audio_files, make_corpus(), 2)
+    assert sorted(f for shard in shards for f in shard) == sorted(make_args().audio_files)
+    loads = [sum(DURATIONS[os.path.splitext(os.path.basename(f))[0]] for f in shard) for shard in shards]
+    # Longest first, each to the least loaded shard
+    assert sorted(loads) == [170.0, 180.0]
+
+
+def test_balance_inquiries_with_more_shards_than_inquiries():
+    shards = sharding.balance_inquiries(make_args().audio_files[:2], make_corpus(), 4)
+    assert sorted(len(shard) for shard in shards) == [0, 0, 1, 1]
+
+
+def test_run_sharded_on_several_cpu_workers():
+    corpus_sentences = make_corpus()
+    corpus_new_textgrids = {sample: None for sample in corpus_sentences}
+    summary = []
+    results_files = []
+    for shard_summary, shard_results_files in sharding.run_sharded(
+        make_args(), shard_worker, corpus_sentences, corpus_new_textgrids, [-1, -1]
+    ):
+        summary += shard_summary
+        results_files += shard_results_files
+
+    # The merged summary has every inquiry once
+    assert sorted(row["SAMPLE"] for row in summary) == sorted(DURATIONS)
+    assert all(row["DURATION"] == DURATIONS[row["SAMPLE"]] for row in summary)
+    assert sorted(results_files) == sorted(f"out/{sample}_results_model.csv" for sample in DURATIONS)
+    # Two CPU processes with the cores split between them
+    assert {row["DEVICE"] for row in summary} == {-1}
+    assert len({row["PID"] for row in summary}) == 2
+    assert {row["LM_PROCESSES"] for row in summary} == {sharding.default_threads(2)}
+    loads = {}
+    for row in summary:
+        loads[row["PID"]] = loads.get(row["PID"], 0.0) + row["DURATION"]
+    assert sorted(loads.values()) == [170.0, 180.0]
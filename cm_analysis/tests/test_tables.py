@@ -0,0 +1,81 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from common.tables import ColumnTable, SENTENCE_SCHEMA, RESULT_SCHEMA, WORD_TIMESTAMP_SCHEMA
+
+
+def result_rows():
+    return [{
+        "path": f"audios/SP_D2_255_{i*1.5}_{i*1.5+1.25}.wav",
+        "start_sec": i*1.5,
+        "end_sec": i*1.5+1.25,
+        "mark": "((risos)) tudo bem" if i % 2 else "né",
+        "sentence": "tudo bem" if i % 2 else "né",
+        "duration": 1.25,
+        "prediction": "tudo bem" if i % 3 else "",
+        "phones": "",
+        "timestamps": str([{"text": "tudo", "timestamp": (0.02*i, 0.3)}]),
+        "wer": 0.5*(i % 3),
+        "mer": 1/3,
+        "wil": -1,
+        "cer": 0.125
+    } for i in range(7)]
+
+
+@pytest.mark.parametrize("ptbr", [False, True])
+def test_csv_matches_the_list_of_dicts(ptbr):
+    rows = result_rows()
+    table = ColumnTable(RESULT_SCHEMA)
+    for row in rows:
+        table.append(**row)
+
+    # Export of the previous lists of dicts
+    options = dict(sep=';' if ptbr else ',', decimal=',' if ptbr else '.', index=False)
+    assert table.to_frame().to_csv(**options) == pd.DataFrame(rows).to_csv(**options)
+    assert table.to_records() == rows
+    assert list(table) == rows and table[3] == rows[3]
+
+
+def test_extend_matches_append():
+    rows = result_rows()
+    appended = ColumnTable(RESULT_SCHEMA)
+    for row in rows:
+        appended.append(**row)
+    extended = ColumnTable(RESULT_SCHEMA)
+    extended.extend(**{name: [row[name] for row in rows[:3]] for name in RESULT_SCHEMA})
+    extended.extend(**{name: np.array([row[name] for row in rows[3:]], dtype=object)
+                       if RESULT_SCHEMA[name] in ("str", "obj") else np.array([row[name] for row in rows[3:]])
+                       for name in RESULT_SCHEMA})
+    assert extended.to_records() == appended.to_records()
+
+
+def test_strings_are_interned():
+    table = ColumnTable(SENTENCE_SCHEMA)
+    for _ in range(3):
+        # Different objects with the same value
+        mark = "".join(["tudo", " ", "bem"])
+        table.append(start_sec=0, end_sec=1, mark=mark, text=mark, duration=1)
+    marks = [row["mark"] for row in table]
+    assert marks[0] is marks[1] is marks[2] is table[0]["text"]
+
+
+def test_numeric_columns_and_set():
+    table = ColumnTable(WORD_TIMESTAMP_SCHEMA)
+    table.extend(path=["a.wav"]*3, tp_text=["eu", "acho", "que"], tp_start=[0, 1, 2], tp_end=[1, 2, 3],
+                 ts_start_sec=[10, 11, 12], ts_end_sec=[11, 12, 13])
+    starts = table.column("tp_start")
+    assert starts.dtype == np.float64 and starts.tolist() == [0.0, 1.0, 2.0]
+    # column() is a copy
+    starts[0] = 99
+    assert table[0]["tp_start"] == 0.0
+    table.set(1, tp_text="acha", tp_end=2.5)
+    assert table[1]["tp_text"] == "acha" and table[1]["tp_end"] == 2.5
+    assert table.column("path").dtype == object and len(table) == 3
+
+
+def test_empty_table():
+    table = ColumnTable(SENTENCE_SCHEMA)
+    assert len(table) == 0 and table.to_records() == []
+    assert len(table.column("duration")) == 0 and table.column("duration").sum() == 0
+    assert list(table.to_frame().columns) == list(SENTENCE_SCHEMA)
@@ -0,0 +1,57 @@
+import numpy as np
+
+from common.tier_index import TierIndex
+
+
+def test_none_end_timestamp_keeps_later_intervals():
+    index = TierIndex("TimestampsWords", 0.0, 100.0)
+    index.add_chunks([
+        {"text": "eu", "timestamp": (0.0, 0.5)},
+        {"text": "acho", "timestamp": (0.6, None)},
+    ], offset_sec=10.0, end_sec=12.0)
+    index.add_chunks([
+        {"text": "que", "timestamp": (0.0, 0.3)},
+        {"text": "sim", "timestamp": (0.4, 0.9)},
+    ], offset_sec=12.0, end_sec=13.0)
+
+    starts, ends, marks = index.resolve()
+    assert marks == ["eu", "acho", "que", "sim"]
+    # The missing end is the end of the sentence
+    assert np.isclose(ends[1], 12.0)
+    assert np.all(np.isfinite(starts)) and np.all(np.isfinite(ends))
+    assert index.conflicts == {"out_of_bounds": 0, "trimmed": 0, "dropped": 0}
+
+
+def test_nan_interval_is_dropped_alone():
+    index = TierIndex("Transcription", 0.0, 100.0)
+    index.add(1.0, 2.0, "a")
+    index.add(2.0, None, "b")
+    index.add(3.0, 4.0, "c")
+
+    _, _, marks = index.resolve()
+    assert marks == ["a", "c"]
+    assert index.conflicts["dropped"] == 1
+
+
+def test_touching_intervals_are_not_conflicts():
+    index = TierIndex("TimestampsWords", 0.0, 100.0)
+    # 0.1 + 2.2 ends slightly after 2.3 because of float rounding
+    index.add_chunks([{"text": "a", "timestamp": (0.0, 2.2)}], offset_sec=0.1, end_sec=3.0)
+    # Clamped to the end of its sentence (end_sec - epsilon)
+    index.add_chunks([{"text": "b", "timestamp": (0.0, 5.0)}], offset_sec=2.3, end_sec=4.0)
+    index.add_chunks([{"text": "c", "timestamp": (0.0, 1.0)}], offset_sec=4.0, end_sec=5.0)
+
+    _, _, marks = index.resolve()
+    assert marks == ["a", "b", "c"]
+    assert index.conflicts == {"out_of_bounds": 0, "trimmed": 0, "dropped": 0}
+
+
+def test_real_overlap_is_trimmed():
+    index = TierIndex("Transcription", 0.0, 100.0)
+    index.add(1.0, 3.0, "a")
+    index.add(2.0, 4.0, "b")
+
+    starts, ends, marks = index.resolve()
+    assert marks == ["a", "b"]
+    assert np.allclose(starts, [1.0, 3.0]) and np.allclose(ends, [3.0, 4.0])
+    assert index.conflicts["trimmed"] == 1
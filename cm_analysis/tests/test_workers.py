@@ -0,0 +1,79 @@
+import time
+import threading
+
+import pytest
+
+from common.workers import BoundedExecutor
+
+
+def test_submit_blocks_while_the_queue_is_full():
+    executor = BoundedExecutor(max_workers=1, max_pending=2)
+    release = threading.Event()
+    executor.submit(release.wait)
+    executor.submit(release.wait)
+
+    submitted = threading.Event()
+
+    def producer():
+        executor.submit(lambda: None)
+        submitted.set()
+
+    thread = threading.Thread(target=producer)
+    thread.start()
+    # Two jobs are pending: the third submit waits for a slot
+    assert not submitted.wait(0.2)
+    release.set()
+    assert submitted.wait(5)
+    thread.join()
+    assert executor.shutdown() == 0
+
+
+def test_failed_jobs_are_counted_and_propagated():
+    executor = BoundedExecutor(max_workers=2, max_pending=4)
+
+    def fail():
+        raise ValueError("export failed")
+
+    ok = executor.submit(lambda: 42)
+    failed = executor.submit(fail)
+    assert executor.shutdown() == 1
+    assert ok.result() == 42
+    assert isinstance(failed.exception(), ValueError)
+    with pytest.raises(ValueError):
+        failed.result()
+
+
+def test_failed_jobs_release_their_slots():
+    executor = BoundedExecutor(max_workers=1, max_pending=1)
+
+    def fail():
+        raise RuntimeError()
+
+    for _ in range(3):
+        executor.submit(fail)
+    # Would block forever if a failed job kept its slot
+    executor.submit(lambda: None).result(timeout=5)
+    assert executor.shutdown() == 3
+
+
+def test_join_waits_for_all_jobs():
+    executor = BoundedExecutor(max_workers=2, max_pending=8)
+    done = []
+    for i in range(6):
+        executor.submit(lambda i=i: time.sleep(0.01) or done.append(i))
+    assert executor.join() == 0
+    assert sorted(done) == list(range(6))
+    executor.shutdown()
+
+
+def test_synchronous_mode():
+    executor = BoundedExecutor(max_workers=0)
+    caller = threading.current_thread()
+    threads = []
+    future = executor.submit(lambda: threads.append(threading.current_thread()) or "ok")
+    assert future.done() and future.result() == "ok"
+    assert threads == [caller]
+
+    failed = executor.submit(lambda: 1/0)
+    assert isinstance(failed.exception(), ZeroDivisionError)
+    assert executor.shutdown() == 1